@@ -6,34 +6,53 @@ import aws_cdk as cdk
 from cdk_pipeline.pipeline_stack import CdkZ2jhPipelineStack
 
 from utils import config_util
+from utils.budget_util import add_resource_budget, tightest_budgets
 
 app = cdk.App()
 
-# Ensure environment(stage) is passed in context to pick correct values from context
-stage = app.node.try_get_context("stage")
-if stage is None or stage == "unknown":
+# Ensure environment(stage) is passed in context to pick correct values from context.
+# Several stages (-c stage=dev,prod or -c stage=all) synthesize in one process.
+stage_context = app.node.try_get_context("stage")
+if stage_context is None or stage_context == "unknown":
     sys.exit(
-        "You need to set the target stage." " USAGE: cdk <command> -c stage=dev <stack>"
+        "You need to set the target stage."
+        " USAGE: cdk <command> -c stage=dev <stack>"
+        " | -c stage=dev,prod | -c stage=all"
+    )
+if stage_context == "all":
+    stages = config_util.available_stages()
+else:
+    stages = [stage.strip() for stage in stage_context.split(",") if stage.strip()]
+
+# Load stage configs, config/common.yaml is parsed only once
+configs = {stage: config_util.load_config(stage) for stage in stages}
+
+if len(stages) == 1:
+    # this will allow using get_context where we don't specifically want to pass parameters
+    app.node.set_context("env_config", configs[stages[0]])
+
+# Counts resources, parameters and custom resources per stack against config budgets
+budget = add_resource_budget(app, tightest_budgets(configs.values()))
+
+for stage, config in configs.items():
+    # Setting up AWS Account and Region from yaml config
+    env = cdk.Environment(
+        account=config["aws"]["account"],
+        region=config["aws"]["region"],
     )
 
-# Load stage config and set cdk environment
-config = config_util.load_config(stage)
-
-# this will allow using get_context where we don't specifically want to pass parameters
-app.node.set_context("env_config", config)
-
-# Setting up AWS Account and Region from yaml config
-env = cdk.Environment(
-    account=config["aws"]["account"],
-    region=config["aws"]["region"],
-)
-
-# Passing stage to build CFT specific to an environment
-CdkZ2jhPipelineStack(
-    app,
-    "CdkZ2jhPipelineStack",
-    stage=stage,
-    env=env,
-)
+    # Passing stage to build CFT specific to an environment. With several stages
+    # the construct ids differ, the CloudFormation stack name stays the same.
+    CdkZ2jhPipelineStack(
+        app,
+        "CdkZ2jhPipelineStack" if len(stages) == 1 else f"{stage}-CdkZ2jhPipeline",
+        stage=stage,
+        config=config,
+        stack_name="CdkZ2jhPipelineStack",
+        env=env,
+    )
 
-app.synth()
+assembly = app.synth()
+print(f"Resource budget report: {budget.write_report(assembly.directory)}")
+if budget.violations():
+    sys.exit("Resource budget exceeded:\n" + "\n".join(budget.violations()))
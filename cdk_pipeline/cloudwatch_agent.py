@@ -0,0 +1,274 @@
+from typing import Any, Dict, List
+import json
+import yaml
+
+# CloudWatch agent scraping the Prometheus metrics of the hub and the cluster
+# autoscaler into the ContainerInsights/Prometheus namespace, built from the
+# `monitoring` section of stage config. MonitoringStack creates the
+# cwagent-prometheus service account (with its IAM role), the log group and
+# the dashboard and alarms over these metrics.
+
+NAME = "cwagent-prometheus"
+NAMESPACE = "amazon-cloudwatch"
+METRIC_NAMESPACE = "ContainerInsights/Prometheus"
+
+HUB_JOB = "jupyterhub"
+HUB_NAMESPACE = "z2jh"
+HUB_PORT = 8081
+# Hub service whose API token only has read:metrics. The chart generates the
+# token into its `hub` Secret, MonitoringStack copies it to HUB_TOKEN_SECRET.
+HUB_SERVICE = "cloudwatch-agent"
+HUB_SECRET = "hub"
+HUB_SECRET_TOKEN_KEY = f"hub.services.{HUB_SERVICE}.apiToken"
+# kubectl JSONPath of the token, the dots in its key escaped
+HUB_TOKEN_JSON_PATH = ".data." + HUB_SECRET_TOKEN_KEY.replace(".", "\\.")
+HUB_TOKEN_SECRET = "jupyterhub-metrics-token"
+HUB_TOKEN_DIR = "/etc/jupyterhub-metrics"
+AUTOSCALER_JOB = "cluster-autoscaler"
+
+# Buckets of JupyterHub's jupyterhub_server_spawn_duration_seconds histogram
+SPAWN_DURATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 15, 30, 60, 120, 180, 300, 600)
+
+
+def log_group_name(cluster_name: str) -> str:
+    return f"/aws/containerinsights/{cluster_name}/prometheus"
+
+
+# `le` label of a histogram bucket as the Prometheus client renders it
+def bucket_label(bound: float) -> str:
+    return str(float(bound))
+
+
+def prometheus_config(monitoring_config) -> Dict[str, Any]:
+    return {
+        "global": {
+            "scrape_interval": monitoring_config["scrape_interval"],
+            "scrape_timeout": "10s",
+        },
+        "scrape_configs": [
+            {
+                "job_name": HUB_JOB,
+                "metrics_path": "/hub/metrics",
+                "bearer_token_file": f"{HUB_TOKEN_DIR}/token",
+                "kubernetes_sd_configs": [
+                    {"role": "pod", "namespaces": {"names": [HUB_NAMESPACE]}}
+                ],
+                "relabel_configs": [
+                    {
+                        "source_labels": ["__meta_kubernetes_pod_label_component"],
+                        "regex": "hub",
+                        "action": "keep",
+                    },
+                    {
+                        "source_labels": [
+                            "__meta_kubernetes_pod_container_port_number"
+                        ],
+                        "regex": str(HUB_PORT),
+                        "action": "keep",
+                    },
+                ],
+            },
+            {
+                "job_name": AUTOSCALER_JOB,
+                "kubernetes_sd_configs": [
+                    {"role": "pod", "namespaces": {"names": ["kube-system"]}}
+                ],
+                "relabel_configs": [
+                    {
+                        "source_labels": ["__meta_kubernetes_pod_label_app"],
+                        "regex": "cluster-autoscaler",
+                        "action": "keep",
+                    },
+                    # The autoscaler declares no container port, take its annotation
+                    {
+                        "source_labels": [
+                            "__address__",
+                            "__meta_kubernetes_pod_annotation_prometheus_io_port",
+                        ],
+                        "regex": "([^:]+)(?::\\d+)?;(\\d+)",
+                        "replacement": "$1:$2",
+                        "target_label": "__address__",
+                    },
+                ],
+            },
+        ],
+    }
+
+
+def _declaration(job: str, dimensions: List[str], *selectors: str) -> Dict[str, Any]:
+    return {
+        "source_labels": ["job"],
+        "label_matcher": f"^{job}$",
+        "dimensions": [["ClusterName"] + dimensions],
+        "metric_selectors": list(selectors),
+    }
+
+
+# Which scraped series become CloudWatch metrics, and their dimensions
+def metric_declarations() -> List[Dict[str, Any]]:
+    return [
+        _declaration(
+            HUB_JOB,
+            ["status", "le"],
+            "^jupyterhub_server_spawn_duration_seconds_bucket$",
+        ),
+        _declaration(
+            HUB_JOB,
+            ["status"],
+            "^jupyterhub_server_spawn_duration_seconds_(sum|count)$",
+        ),
+        _declaration(
+            HUB_JOB,
+            [],
+            "^jupyterhub_running_servers$",
+            "^jupyterhub_total_users$",
+            "^jupyterhub_active_users$",
+        ),
+        _declaration(
+            AUTOSCALER_JOB,
+            [],
+            "^cluster_autoscaler_unschedulable_pods_count$",
+            "^cluster_autoscaler_unneeded_nodes_count$",
+        ),
+        _declaration(AUTOSCALER_JOB, ["state"], "^cluster_autoscaler_nodes_count$"),
+    ]
+
+
+def agent_config(cluster_name: str, region: str) -> Dict[str, Any]:
+    return {
+        "agent": {"region": region},
+        "logs": {
+            "metrics_collected": {
+                "prometheus": {
+                    "cluster_name": cluster_name,
+                    "log_group_name": log_group_name(cluster_name),
+                    "prometheus_config_path": "/etc/prometheusconfig/prometheus.yaml",
+                    "emf_processor": {
+                        "metric_declaration_dedup": True,
+                        "metric_namespace": METRIC_NAMESPACE,
+                        "metric_declaration": metric_declarations(),
+                    },
+                }
+            },
+            "force_flush_interval": 5,
+        },
+    }
+
+
+# Objects besides the namespace and the service account, which need the
+# namespace first and the IAM role
+def manifests(
+    cluster_name: str, region: str, monitoring_config
+) -> List[Dict[str, Any]]:
+    return [
+        {
+            "apiVersion": "rbac.authorization.k8s.io/v1",
+            "kind": "ClusterRole",
+            "metadata": {"name": NAME},
+            "rules": [
+                {
+                    "apiGroups": [""],
+                    "resources": [
+                        "nodes",
+                        "nodes/proxy",
+                        "services",
+                        "endpoints",
+                        "pods",
+                    ],
+                    "verbs": ["get", "list", "watch"],
+                },
+                {
+                    "apiGroups": ["extensions"],
+                    "resources": ["ingresses"],
+                    "verbs": ["get", "list", "watch"],
+                },
+                {"nonResourceURLs": ["/metrics"], "verbs": ["get"]},
+            ],
+        },
+        {
+            "apiVersion": "rbac.authorization.k8s.io/v1",
+            "kind": "ClusterRoleBinding",
+            "metadata": {"name": NAME},
+            "roleRef": {
+                "apiGroup": "rbac.authorization.k8s.io",
+                "kind": "ClusterRole",
+                "name": NAME,
+            },
+            "subjects": [
+                {"kind": "ServiceAccount", "name": NAME, "namespace": NAMESPACE}
+            ],
+        },
+        {
+            "apiVersion": "v1",
+            "kind": "ConfigMap",
+            "metadata": {"name": "prometheus-cwagentconfig", "namespace": NAMESPACE},
+            "data": {
+                "cwagentconfig.json": json.dumps(agent_config(cluster_name, region))
+            },
+        },
+        {
+            "apiVersion": "v1",
+            "kind": "ConfigMap",
+            "metadata": {"name": "prometheus-config", "namespace": NAMESPACE},
+            "data": {
+                "prometheus.yaml": yaml.safe_dump(prometheus_config(monitoring_config))
+            },
+        },
+        {
+            "apiVersion": "apps/v1",
+            "kind": "Deployment",
+            "metadata": {"name": NAME, "namespace": NAMESPACE},
+            "spec": {
+                "replicas": 1,
+                "selector": {"matchLabels": {"app": NAME}},
+                "template": {
+                    "metadata": {"labels": {"app": NAME}},
+                    "spec": {
+                        "serviceAccountName": NAME,
+                        "terminationGracePeriodSeconds": 60,
+                        "containers": [
+                            {
+                                "name": "cloudwatch-agent",
+                                "image": monitoring_config["agent_image"],
+                                "imagePullPolicy": "IfNotPresent",
+                                "resources": {
+                                    "limits": {"cpu": "1000m", "memory": "1000Mi"},
+                                    "requests": {"cpu": "200m", "memory": "200Mi"},
+                                },
+                                "env": [{"name": "CI_VERSION", "value": "k8s/1.3.16"}],
+                                "volumeMounts": [
+                                    {
+                                        "name": "prometheus-cwagentconfig",
+                                        "mountPath": "/etc/cwagentconfig",
+                                    },
+                                    {
+                                        "name": "prometheus-config",
+                                        "mountPath": "/etc/prometheusconfig",
+                                    },
+                                    {
+                                        "name": HUB_TOKEN_SECRET,
+                                        "mountPath": HUB_TOKEN_DIR,
+                                        "readOnly": True,
+                                    },
+                                ],
+                            }
+                        ],
+                        "volumes": [
+                            {
+                                "name": "prometheus-cwagentconfig",
+                                "configMap": {"name": "prometheus-cwagentconfig"},
+                            },
+                            {
+                                "name": "prometheus-config",
+                                "configMap": {"name": "prometheus-config"},
+                            },
+                            {
+                                "name": HUB_TOKEN_SECRET,
+                                "secret": {"secretName": HUB_TOKEN_SECRET},
+                            },
+                        ],
+                    },
+                },
+            },
+        },
+    ]
@@ -0,0 +1,283 @@
+from typing import Any, Dict, List
+import yaml
+
+# Cluster Autoscaler objects for the kube-system namespace, built from the
+# `eks.cluster_autoscaler` section of stage config. EksStack creates the
+# cluster-autoscaler service account (with its IAM role) and tags the node
+# pools with `discovery_tags`.
+
+NAME = "cluster-autoscaler"
+NAMESPACE = "kube-system"
+PRIORITY_EXPANDER_CONFIG_MAP = "cluster-autoscaler-priority-expander"
+
+# The autoscaler minor version has to match the cluster's Kubernetes version
+IMAGE = "registry.k8s.io/autoscaling/cluster-autoscaler"
+IMAGE_TAGS = {
+    "1.21": "v1.21.3",
+    "1.22": "v1.22.3",
+    "1.23": "v1.23.1",
+    "1.24": "v1.24.1",
+    "1.25": "v1.25.1",
+}
+
+LABELS = {
+    "k8s-addon": "cluster-autoscaler.addons.k8s.io",
+    "k8s-app": NAME,
+}
+
+
+# ASG tags the autoscaler discovers its node groups by. EKS adds them to the
+# ASGs of managed node groups itself.
+def discovery_tags(cluster_name: str) -> Dict[str, str]:
+    return {
+        "k8s.io/cluster-autoscaler/enabled": "true",
+        f"k8s.io/cluster-autoscaler/{cluster_name}": "owned",
+    }
+
+
+def image(kubernetes_version: str, autoscaler_config) -> str:
+    tag = autoscaler_config.get("image_tag") or IMAGE_TAGS.get(kubernetes_version)
+    if tag is None:
+        raise ValueError(
+            f"No cluster-autoscaler image for Kubernetes {kubernetes_version},"
+            " set eks.cluster_autoscaler.image_tag"
+        )
+    return f"{IMAGE}:{tag}"
+
+
+def command(cluster_name: str, autoscaler_config) -> List[str]:
+    tag_filter = ",".join(discovery_tags(cluster_name))
+    return [
+        "./cluster-autoscaler",
+        "--v=4",
+        "--stderrthreshold=info",
+        "--cloud-provider=aws",
+        "--skip-nodes-with-local-storage=false",
+        f"--expander={autoscaler_config['expander']}",
+        f"--node-group-auto-discovery=asg:tag={tag_filter}",
+        "--balance-similar-node-groups",
+        "--skip-nodes-with-system-pods=false",
+        f"--scan-interval={autoscaler_config['scan_interval']}",
+        f"--scale-down-delay-after-add={autoscaler_config['scale_down_delay_after_add']}",
+        f"--scale-down-unneeded-time={autoscaler_config['scale_down_unneeded_time']}",
+    ]
+
+
+# ConfigMap of the priority expander: priority -> ASG name regexes, highest wins
+def priority_expander_config_map(priorities: Dict[Any, List[str]]) -> Dict[str, Any]:
+    return {
+        "apiVersion": "v1",
+        "kind": "ConfigMap",
+        "metadata": {"name": PRIORITY_EXPANDER_CONFIG_MAP, "namespace": NAMESPACE},
+        "data": {
+            "priorities": yaml.safe_dump(
+                {
+                    int(priority): list(patterns)
+                    for priority, patterns in priorities.items()
+                }
+            )
+        },
+    }
+
+
+def manifests(
+    cluster_name: str, kubernetes_version: str, autoscaler_config
+) -> List[Dict[str, Any]]:
+    documents = [
+        {
+            "apiVersion": "rbac.authorization.k8s.io/v1",
+            "kind": "ClusterRole",
+            "metadata": {"name": NAME, "labels": LABELS},
+            "rules": [
+                {
+                    "apiGroups": [""],
+                    "resources": ["events", "endpoints"],
+                    "verbs": ["create", "patch"],
+                },
+                {
+                    "apiGroups": [""],
+                    "resources": ["pods/eviction"],
+                    "verbs": ["create"],
+                },
+                {
+                    "apiGroups": [""],
+                    "resources": ["pods/status"],
+                    "verbs": ["update"],
+                },
+                {
+                    "apiGroups": [""],
+                    "resources": ["endpoints"],
+                    "resourceNames": [NAME],
+                    "verbs": ["get", "update"],
+                },
+                {
+                    "apiGroups": [""],
+                    "resources": ["nodes"],
+                    "verbs": ["watch", "list", "get", "update"],
+                },
+                {
+                    "apiGroups": [""],
+                    "resources": [
+                        "namespaces",
+                        "pods",
+                        "services",
+                        "replicationcontrollers",
+                        "persistentvolumeclaims",
+                        "persistentvolumes",
+                    ],
+                    "verbs": ["watch", "list", "get"],
+                },
+                {
+                    "apiGroups": ["extensions"],
+                    "resources": ["replicasets", "daemonsets"],
+                    "verbs": ["watch", "list", "get"],
+                },
+                {
+                    "apiGroups": ["policy"],
+                    "resources": ["poddisruptionbudgets"],
+                    "verbs": ["watch", "list"],
+                },
+                {
+                    "apiGroups": ["apps"],
+                    "resources": ["statefulsets", "replicasets", "daemonsets"],
+                    "verbs": ["watch", "list", "get"],
+                },
+                {
+                    "apiGroups": ["storage.k8s.io"],
+                    "resources": [
+                        "storageclasses",
+                        "csinodes",
+                        "csidrivers",
+                        "csistoragecapacities",
+                    ],
+                    "verbs": ["watch", "list", "get"],
+                },
+                {
+                    "apiGroups": ["batch", "extensions"],
+                    "resources": ["jobs"],
+                    "verbs": ["get", "list", "watch", "patch"],
+                },
+                {
+                    "apiGroups": ["coordination.k8s.io"],
+                    "resources": ["leases"],
+                    "verbs": ["create"],
+                },
+                {
+                    "apiGroups": ["coordination.k8s.io"],
+                    "resourceNames": [NAME],
+                    "resources": ["leases"],
+                    "verbs": ["get", "update"],
+                },
+            ],
+        },
+        {
+            "apiVersion": "rbac.authorization.k8s.io/v1",
+            "kind": "Role",
+            "metadata": {"name": NAME, "namespace": NAMESPACE, "labels": LABELS},
+            "rules": [
+                {
+                    "apiGroups": [""],
+                    "resources": ["configmaps"],
+                    "verbs": ["create", "list", "watch"],
+                },
+                {
+                    "apiGroups": [""],
+                    "resources": ["configmaps"],
+                    "resourceNames": [
+                        "cluster-autoscaler-status",
+                        PRIORITY_EXPANDER_CONFIG_MAP,
+                    ],
+                    "verbs": ["delete", "get", "update", "watch"],
+                },
+            ],
+        },
+        {
+            "apiVersion": "rbac.authorization.k8s.io/v1",
+            "kind": "ClusterRoleBinding",
+            "metadata": {"name": NAME, "labels": LABELS},
+            "roleRef": {
+                "apiGroup": "rbac.authorization.k8s.io",
+                "kind": "ClusterRole",
+                "name": NAME,
+            },
+            "subjects": [
+                {"kind": "ServiceAccount", "name": NAME, "namespace": NAMESPACE}
+            ],
+        },
+        {
+            "apiVersion": "rbac.authorization.k8s.io/v1",
+            "kind": "RoleBinding",
+            "metadata": {"name": NAME, "namespace": NAMESPACE, "labels": LABELS},
+            "roleRef": {
+                "apiGroup": "rbac.authorization.k8s.io",
+                "kind": "Role",
+                "name": NAME,
+            },
+            "subjects": [
+                {"kind": "ServiceAccount", "name": NAME, "namespace": NAMESPACE}
+            ],
+        },
+        {
+            "apiVersion": "apps/v1",
+            "kind": "Deployment",
+            "metadata": {
+                "name": NAME,
+                "namespace": NAMESPACE,
+                "labels": {"app": NAME},
+            },
+            "spec": {
+                "replicas": 1,
+                "selector": {"matchLabels": {"app": NAME}},
+                "template": {
+                    "metadata": {
+                        "labels": {"app": NAME},
+                        "annotations": {
+                            "prometheus.io/scrape": "true",
+                            "prometheus.io/port": "8085",
+                            # Never evict the autoscaler to scale down its own node
+                            "cluster-autoscaler.kubernetes.io/safe-to-evict": "false",
+                        },
+                    },
+                    "spec": {
+                        "priorityClassName": "system-cluster-critical",
+                        "serviceAccountName": NAME,
+                        "containers": [
+                            {
+                                "image": image(kubernetes_version, autoscaler_config),
+                                "name": NAME,
+                                "resources": {
+                                    "limits": {"cpu": "100m", "memory": "500Mi"},
+                                    "requests": {"cpu": "100m", "memory": "500Mi"},
+                                },
+                                "command": command(cluster_name, autoscaler_config),
+                                "volumeMounts": [
+                                    {
+                                        "name": "ssl-certs",
+                                        "mountPath": "/etc/ssl/certs/ca-certificates.crt",
+                                        "readOnly": True,
+                                    }
+                                ],
+                                "imagePullPolicy": "Always",
+                            }
+                        ],
+                        "volumes": [
+                            {
+                                "name": "ssl-certs",
+                                "hostPath": {"path": "/etc/ssl/certs/ca-bundle.crt"},
+                            }
+                        ],
+                    },
+                },
+            },
+        },
+    ]
+
+    if autoscaler_config["expander"] == "priority":
+        priorities = autoscaler_config.get("priorities")
+        if not priorities:
+            raise ValueError(
+                "eks.cluster_autoscaler.expander priority needs priorities"
+            )
+        documents.append(priority_expander_config_map(priorities))
+
+    return documents
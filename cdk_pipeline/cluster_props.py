@@ -1,107 +1,263 @@
+from functools import cached_property
+from typing import Dict, List
+
 from aws_cdk import (
+    aws_ec2 as ec2,
     aws_eks as eks,
+    aws_iam as iam,
     aws_ssm as ssm,
     aws_route53 as route53,
+    Fn,
+    Size,
+    Stack,
 )
 from constructs import Construct
 
+# EksStack publishes everything the other stages need about the cluster as one
+# comma separated parameter: the fields below, in this order, followed by the
+# private route table ids, the private subnet ids and the subnets' AZs.
+# CloudFormation can split a string at deploy time but can't parse JSON, so the
+# value is a delimited list rather than a JSON document.
+CLUSTER_ATTRIBUTES_PARAMETER = "/omnispin/eks/cluster/attributes"
+CLUSTER_ATTRIBUTE_FIELDS = (
+    "cluster_name",
+    "kubectl_role",
+    "oidc_arn",
+    "eks_vpc",
+    "eks_vpc_cidr",
+    "eks_security_group_id",
+    "efs_file_system_id",
+    "kubectl_function_arn",
+    "kubectl_handler_role_arn",
+)
+
+# Postgres hub database, see z2jh.hub_db in config
+HUB_DB_ENDPOINT_PARAMETER = "/omnispin/hub/db/endpoint"
+HUB_DB_ROLE_PARAMETER = "/omnispin/hub/db/role"
+HUB_DB_PASSWORD_SECRET = "omnispin/hub/db/password"
+
+
+def encode_cluster_attributes(
+    attributes: Dict[str, str],
+    route_tables: List[str],
+    private_subnets: List[str],
+    availability_zones: List[str],
+):
+    values = [attributes[field] for field in CLUSTER_ATTRIBUTE_FIELDS]
+    return Fn.join(",", values + route_tables + private_subnets + availability_zones)
+
+
+# Memory and environment of a cluster's kubectl handler Lambda from eks.kubectl,
+# as keyword arguments of eks.Cluster and eks.Cluster.from_cluster_attributes
+def kubectl_handler_props(config) -> Dict[str, object]:
+    kubectl_config = config["eks"].get("kubectl") or {}
+    props = {}
+    if kubectl_config.get("memory_mib"):
+        props["kubectl_memory"] = Size.mebibytes(kubectl_config["memory_mib"])
+    if kubectl_config.get("environment"):
+        props["kubectl_environment"] = {
+            key: str(value) for key, value in kubectl_config["environment"].items()
+        }
+    return props
+
+
+# The AWS Load Balancer Controller names the proxy NLB so R53EntryStage can
+# look it up, see eks.load_balancer in config
+def proxy_load_balancer_name(config) -> str:
+    name = config["eks"]["load_balancer"].get("name") or f"{config['stage']}-z2jh-proxy"
+    if len(name) > 32:
+        raise ValueError(f"Load balancer name {name} is longer than 32 characters")
+    return name
+
 
 class ClusterProps(Construct):
     """
     Cluster Variables
+
+    Use `ClusterProps.of(stack)` so each stack resolves the cluster attributes
+    parameter, imports the cluster and looks up Vantage values only once.
+    Values are looked up on first use, a stack only gets the CloudFormation
+    parameters it actually reads.
     """
 
-    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    def __init__(
+        self, scope: Construct, construct_id: str, config=None, **kwargs
+    ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
-        config = self.node.try_get_context("env_config")
-        # EKS: Cluster
-        self.cluster_name = ssm.StringParameter.value_for_string_parameter(
-            self, "/omnispin/eks/cluster/name"
-        )
+        self.config = config or self.node.try_get_context("env_config")
+        self.service_name = "proxy-public"
+        self.namesapce = "z2jh"
 
-        self.kubectl_role = ssm.StringParameter.value_for_string_parameter(
-            self, "/omnispin/eks/kubectl/role"
-        )
+    @classmethod
+    def of(cls, scope: Construct, config=None) -> "ClusterProps":
+        stack = Stack.of(scope)
+        props = stack.node.try_find_child("cluster_props")
+        if props is None:
+            props = cls(stack, "cluster_props", config=config)
+        return props
 
-        self.oidc_arn = ssm.StringParameter.value_for_string_parameter(
-            self, "/omnispin/eks/oidc/arn"
+    # EKS: Cluster
+    @cached_property
+    def __attribute_values(self) -> List[str]:
+        # One private route table, private subnet and AZ name per AZ
+        az_count = self.config["eks"]["vpc"]["max_azs"]
+        value = ssm.StringParameter.value_for_string_parameter(
+            self, CLUSTER_ATTRIBUTES_PARAMETER
         )
+        return Fn.split(",", value, len(CLUSTER_ATTRIBUTE_FIELDS) + 3 * az_count)
 
-        self.eks_vpc = ssm.StringParameter.value_for_string_parameter(
-            self, "/omnispin/eks/vpc"
-        )
+    def __attribute(self, field: str) -> str:
+        return self.__attribute_values[CLUSTER_ATTRIBUTE_FIELDS.index(field)]
 
-        self.eks_vpc_cidr = ssm.StringParameter.value_for_string_parameter(
-            self, "/omnispin/eks/vpc/cidr"
-        )
+    @property
+    def cluster_name(self):
+        return self.__attribute("cluster_name")
 
-        self.eks_private_routetable1 = ssm.StringParameter.value_for_string_parameter(
-            self, "/omnispin/eks/vpc/private/routetable1"
-        )
+    @property
+    def kubectl_role(self):
+        return self.__attribute("kubectl_role")
 
-        self.eks_private_routetable2 = ssm.StringParameter.value_for_string_parameter(
-            self, "/omnispin/eks/vpc/private/routetable2"
-        )
+    @property
+    def oidc_arn(self):
+        return self.__attribute("oidc_arn")
 
-        self.eks_private_routetable3 = ssm.StringParameter.value_for_string_parameter(
-            self, "/omnispin/eks/vpc/private/routetable3"
-        )
+    @property
+    def eks_vpc(self):
+        return self.__attribute("eks_vpc")
 
-        self.eks_security_group_id = ssm.StringParameter.value_for_string_parameter(
-            self, "/omnispin/eks/security_group/id"
-        )
+    @property
+    def eks_vpc_cidr(self):
+        return self.__attribute("eks_vpc_cidr")
+
+    @property
+    def eks_security_group_id(self):
+        return self.__attribute("eks_security_group_id")
+
+    @property
+    def efs_file_system_id(self):
+        return self.__attribute("efs_file_system_id")
 
-        self.provider = eks.OpenIdConnectProvider.from_open_id_connect_provider_arn(
+    @property
+    def kubectl_function_arn(self):
+        return self.__attribute("kubectl_function_arn")
+
+    @property
+    def kubectl_handler_role_arn(self):
+        return self.__attribute("kubectl_handler_role_arn")
+
+    @property
+    def eks_private_routetables(self) -> List[str]:
+        start = len(CLUSTER_ATTRIBUTE_FIELDS)
+        end = start + self.config["eks"]["vpc"]["max_azs"]
+        return self.__attribute_values[start:end]
+
+    @property
+    def eks_private_subnets(self) -> List[str]:
+        az_count = self.config["eks"]["vpc"]["max_azs"]
+        start = len(CLUSTER_ATTRIBUTE_FIELDS) + az_count
+        end = start + az_count
+        return self.__attribute_values[start:end]
+
+    @property
+    def eks_availability_zones(self) -> List[str]:
+        start = len(CLUSTER_ATTRIBUTE_FIELDS) + 2 * self.config["eks"]["vpc"]["max_azs"]
+        return self.__attribute_values[start:]
+
+    @cached_property
+    def provider(self):
+        return eks.OpenIdConnectProvider.from_open_id_connect_provider_arn(
             self, "oidc_provider", self.oidc_arn
         )
 
-        self.cluster = eks.Cluster.from_cluster_attributes(
+    @cached_property
+    def vpc(self):
+        return ec2.Vpc.from_vpc_attributes(
             self,
-            "z2jh",
-            cluster_name=self.cluster_name,
-            kubectl_role_arn=self.kubectl_role,
-            open_id_connect_provider=self.provider,
+            "eks_vpc",
+            vpc_id=self.eks_vpc,
+            vpc_cidr_block=self.eks_vpc_cidr,
+            # The AZs the cluster's subnets are actually in, in subnet order
+            availability_zones=self.eks_availability_zones,
+            private_subnet_ids=self.eks_private_subnets,
+            private_subnet_route_table_ids=self.eks_private_routetables,
         )
 
-        # ROUT 53: hosted_zone_id and zone_name Based on Account. Need to create a map for this
-        hosted_zone_id = config["r53"]["zone_id"]
-        zone_name = config["r53"]["zone_name"]
-        self.zone = route53.HostedZone.from_hosted_zone_attributes(
-            self, "HostedZone", hosted_zone_id=hosted_zone_id, zone_name=zone_name
+    # EksStack's kubectl handler, already warm from the cluster deploy
+    @cached_property
+    def kubectl_provider(self):
+        return eks.KubectlProvider.from_kubectl_provider_attributes(
+            self,
+            "kubectl_provider",
+            function_arn=self.kubectl_function_arn,
+            kubectl_role_arn=self.kubectl_role,
+            handler_role=iam.Role.from_role_arn(
+                self, "kubectl_handler_role", self.kubectl_handler_role_arn
+            ),
         )
-        self.service_name = "proxy-public"
-        self.namesapce = "z2jh"
 
-        # TD: Vantage properties
-        self.td_vpc = ssm.StringParameter.value_for_string_parameter(
-            self, "/spt/core/vpc"
+    @cached_property
+    def cluster(self):
+        kubectl_config = self.config["eks"].get("kubectl") or {}
+        if kubectl_config.get("shared_provider"):
+            kubectl = {"kubectl_provider": self.kubectl_provider}
+        else:
+            # A kubectl handler of this stack's own
+            kubectl = kubectl_handler_props(self.config)
+            if kubectl_config.get("private_subnets"):
+                kubectl["vpc"] = self.vpc
+                kubectl["kubectl_private_subnet_ids"] = self.eks_private_subnets
+                kubectl["kubectl_security_group_id"] = self.eks_security_group_id
+        # Imported at stack level, where Z2jhDeployStack imported it, so its Helm
+        # chart keeps its logical id. Custom resources of stacks that imported it
+        # under cluster_props need a new construct id: their kubectl provider
+        # moved, and CloudFormation can't change a ServiceToken in place.
+        return eks.Cluster.from_cluster_attributes(
+            Stack.of(self),
+            "z2jh",
+            cluster_name=self.cluster_name,
+            kubectl_role_arn=self.kubectl_role,
+            open_id_connect_provider=self.provider,
+            **kubectl,
         )
 
-        self.td_vpc_cidr = ssm.StringParameter.value_for_string_parameter(
-            self, "/spt/core/vpcCidrBlock"
+    # Hub database: host:port and the role the hub reads the password with
+    @cached_property
+    def hub_db_endpoint(self):
+        return ssm.StringParameter.value_for_string_parameter(
+            self, HUB_DB_ENDPOINT_PARAMETER
         )
 
-        self.td_private_subnet1 = ssm.StringParameter.value_for_string_parameter(
-            self, "/spt/core/privateSubnet1"
+    @cached_property
+    def hub_db_role(self):
+        return ssm.StringParameter.value_for_string_parameter(
+            self, HUB_DB_ROLE_PARAMETER
         )
 
-        self.td_private_subnet2 = ssm.StringParameter.value_for_string_parameter(
-            self, "/spt/core/privateSubnet2"
+    # ROUT 53: hosted_zone_id and zone_name Based on Account. Need to create a map for this
+    @cached_property
+    def zone(self):
+        hosted_zone_id = self.config["r53"]["zone_id"]
+        zone_name = self.config["r53"]["zone_name"]
+        return route53.HostedZone.from_hosted_zone_attributes(
+            self, "HostedZone", hosted_zone_id=hosted_zone_id, zone_name=zone_name
         )
 
-        self.td_private_subnet3 = ssm.StringParameter.value_for_string_parameter(
-            self, "/spt/core/privateSubnet3"
+    # TD: Vantage properties of a teradata.databases entry in peering mode.
+    # value_for_string_parameter resolves each parameter once per stack.
+    def __td_parameter(self, database, name: str):
+        return ssm.StringParameter.value_for_string_parameter(
+            self, database["ssm_prefix"] + "/" + name
         )
 
-        self.td_private_routetable1 = ssm.StringParameter.value_for_string_parameter(
-            self, "/spt/core/privateRouteTable1"
-        )
+    def td_vpc(self, database):
+        return self.__td_parameter(database, "vpc")
 
-        self.td_private_routetable2 = ssm.StringParameter.value_for_string_parameter(
-            self, "/spt/core/privateRouteTable2"
-        )
+    def td_vpc_cidr(self, database):
+        return self.__td_parameter(database, "vpcCidrBlock")
 
-        self.td_private_routetable3 = ssm.StringParameter.value_for_string_parameter(
-            self, "/spt/core/privateRouteTable3"
-        )
+    def td_private_routetables(self, database) -> List[str]:
+        return [
+            self.__td_parameter(database, f"privateRouteTable{i}")
+            for i in range(1, database["private_route_tables"] + 1)
+        ]
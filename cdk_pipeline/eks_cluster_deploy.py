@@ -1,3 +1,4 @@
+from typing import Dict, List
 from aws_cdk import (
     aws_eks as eks,
     aws_ec2 as ec2,
@@ -5,17 +6,57 @@ from aws_cdk import (
     aws_ssm as ssm,
     CfnJson,
     Fn,
+    Tags,
     aws_autoscaling as autoscaling,
     aws_efs as efs,
+    aws_cloudwatch as cloudwatch,
+    aws_cloudwatch_actions as cloudwatch_actions,
+    aws_sns as sns,
+    aws_rds as rds,
+    aws_secretsmanager as secretsmanager,
 )
 from constructs import Construct
 import aws_cdk as cdk
 
 # from aws_cdk.lambda_layer_kubectl import KubectlLayer  #KubectlV24Layer
 # import cdk8s
-import yaml
 from aws_cdk.lambda_layer_kubectl_v24 import KubectlV24Layer
 from utils.stack_util import add_tags_to_stack
+from cdk_pipeline import cluster_autoscaler, node_bootstrap
+from cdk_pipeline.z2jh_values import (
+    DATASETS_CLAIM,
+    EBS_STORAGE_CLASS,
+    EFS_STORAGE_CLASS,
+    HUB_DB_EBS_CLAIM,
+    helm_values,
+    notebook_images,
+    uses_ebs,
+    uses_ebs_homes,
+)
+from cdk_pipeline.cluster_props import (
+    CLUSTER_ATTRIBUTES_PARAMETER,
+    HUB_DB_ENDPOINT_PARAMETER,
+    HUB_DB_PASSWORD_SECRET,
+    HUB_DB_ROLE_PARAMETER,
+    encode_cluster_attributes,
+    kubectl_handler_props,
+)
+from utils.manifest_util import format_custom_resource_report
+from utils.yaml_util import load_documents
+
+WARM_POOL_STATES = {
+    "stopped": autoscaling.PoolState.STOPPED,
+    "running": autoscaling.PoolState.RUNNING,
+}
+
+TAINT_EFFECTS = {
+    "NoSchedule": eks.TaintEffect.NO_SCHEDULE,
+    "PreferNoSchedule": eks.TaintEffect.PREFER_NO_SCHEDULE,
+    "NoExecute": eks.TaintEffect.NO_EXECUTE,
+}
+
+# Nested stack eks.Cluster creates its kubectl handler in
+KUBECTL_PROVIDER_ID = "@aws-cdk/aws-eks.KubectlProvider"
 
 
 class EksStack(cdk.Stack):
@@ -26,53 +67,89 @@ class EksStack(cdk.Stack):
     def __init__(self, scope: Construct, construct_id: str, config, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        self.config = config
+
         # Apply common tags to stack resources.
         add_tags_to_stack(self, config)
 
+        # Documents per manifest group and the last bundled group, see __yaml_manifest
+        self.manifest_groups = {}
+        self.__last_manifest_bundle = None
+
         # Create Resources
         self.__create_cluster()
         self.__cluster_auto_scaling_group()
         self.__cluster_auto_scaler()
+        self.__load_balancer_controller()
         self.__efs_csi_drivers()
         self.__efs_file_system()
         self.__efs_storage_class()
+        self.__datasets_volume()
+        if uses_ebs(self.config["z2jh"]):
+            self.__ebs_storage_class()
+        self.__hub_database()
         self.__create_ssm_parameters()
 
+        # Shown by `cdk synth` next to the other stack messages
+        cdk.Annotations.of(self).add_info(
+            format_custom_resource_report(self.node.path, self.manifest_groups)
+        )
+
     def __create_cluster(self):
+        # Cluster VPC, a public and a private subnet in each of eks.vpc.max_azs AZs.
+        # Built at the path eks.Cluster gives its default VPC, z2jh/DefaultVpc (a
+        # "Default" path component is left out of logical ids), so the VPC of an
+        # existing cluster isn't replaced.
+        self.cluster_vpc = ec2.Vpc(
+            Construct(Construct(self, "Default"), "z2jh"),
+            "DefaultVpc",
+            max_azs=self.config["eks"]["vpc"]["max_azs"],
+        )
+
         # EKS Cluster construct
+        self.kubernetes_version = eks.KubernetesVersion.V1_24
         self.cluster = eks.Cluster(
             self,
             "z2jh",
-            version=eks.KubernetesVersion.V1_24,
+            vpc=self.cluster_vpc,
+            version=self.kubernetes_version,
             kubectl_layer=KubectlV24Layer(self, "kubectl"),
             output_cluster_name=True,
             default_capacity=0,
             prune=True,
+            **kubectl_handler_props(self.config),
         )
 
     def __cluster_auto_scaling_group(self):
         # Cluster Auto Scaling
-        # Cluster Auto Scaling Group of Managed Nodes
-        self.cluster.add_auto_scaling_group_capacity(
-            "AutoScaling",
-            instance_type=ec2.InstanceType.of(
-                ec2.InstanceClass.M5, ec2.InstanceSize.LARGE
-            ),
-            bootstrap_enabled=True,
-            min_capacity=2,
-            max_capacity=6,
-            block_devices=[
-                autoscaling.BlockDevice(
-                    device_name="/dev/xvda",
-                    volume=autoscaling.BlockDeviceVolume.ebs(
-                        volume_size=100,
-                        volume_type=autoscaling.EbsDeviceVolumeType.GP3,
-                        throughput=125,
-                        delete_on_termination=True,
-                    ),
-                ),
-            ],
-        )
+        # Node pools from config: self-managed Auto Scaling Groups or EKS managed node groups
+        self.auto_scaling_groups = []
+        self.nodegroups = []
+        pools = self.config["eks"]["node_pools"]
+        # A pending user whose EBS home is in an AZ without room needs a node in
+        # that AZ, which a group spread across AZs may not start
+        if uses_ebs_homes(self.config["z2jh"]) and not any(
+            pool.get("zonal") and pool.get("purpose") in (None, "user")
+            for pool in pools
+        ):
+            raise ValueError(
+                "EBS homes need a zonal user node pool, set zonal: true on one"
+                " of eks.node_pools"
+            )
+        for pool in pools:
+            for pool_id, subnets in self.__node_pool_placements(pool):
+                if pool["type"] == "managed":
+                    self.nodegroups.append(
+                        self.__managed_node_pool(pool, pool_id, subnets)
+                    )
+                elif pool["type"] == "asg":
+                    self.auto_scaling_groups.append(
+                        self.__asg_node_pool(pool, pool_id, subnets)
+                    )
+                else:
+                    raise ValueError(
+                        f"Unknown node pool type {pool['type']} for {pool['name']}"
+                    )
 
         # Policy
         k8s_asg_policy = iam.PolicyStatement(
@@ -84,6 +161,8 @@ class EksStack(cdk.Stack):
                 "autoscaling:SetDesiredCapacity",
                 "autoscaling:TerminateInstanceInAutoScalingGroup",
                 "ec2:DescribeLaunchTemplateVersions",
+                "ec2:DescribeInstanceTypes",
+                "eks:DescribeNodegroup",
             ],
             resources=["*"],
         )
@@ -91,25 +170,329 @@ class EksStack(cdk.Stack):
             "ca", namespace="kube-system", name="cluster-autoscaler"
         ).add_to_principal_policy(k8s_asg_policy)
 
-    def __yaml_manifest(self, file_locatoin: str, name: str):
-        with open(file_locatoin, "r") as f:
-            files = f.read().split("---")
+    # (construct id, subnets) of each group of a pool. A zonal pool has a group
+    # per AZ of the cluster VPC, cluster-autoscaler balances similar groups.
+    def __node_pool_placements(self, pool):
+        if not pool.get("zonal"):
+            return [(pool["name"], None)]
+        return [
+            (
+                f"{pool['name']}-{subnet.availability_zone}",
+                ec2.SubnetSelection(subnets=[subnet]),
+            )
+            for subnet in self.cluster_vpc.private_subnets
+        ]
+
+    def __node_pool_labels(self, pool) -> Dict[str, str]:
+        labels = dict(pool.get("labels") or {})
+        if pool.get("purpose"):
+            labels["hub.jupyter.org/node-purpose"] = pool["purpose"]
+        return labels
+
+    def __node_pool_taints(self, pool) -> List[Dict[str, str]]:
+        taints = list(pool.get("taints") or [])
+        # Only user pods tolerate this taint, hub and proxy stay off user nodes
+        if pool.get("purpose") == "user":
+            taints.append(
+                {
+                    "key": "hub.jupyter.org/dedicated",
+                    "value": "user",
+                    "effect": "NoSchedule",
+                }
+            )
+        return taints
+
+    def __asg_node_pool(self, pool, pool_id: str, subnets):
+        # A launch configuration has one instance type, mixed pools are managed
+        if len(pool["instance_types"]) != 1:
+            raise ValueError(
+                f"asg node pool {pool['name']} needs exactly one instance type,"
+                f" got {pool['instance_types']}; use type: managed for several"
+            )
+        labels = self.__node_pool_labels(pool)
+        taints = self.__node_pool_taints(pool)
+        kubelet_extra_args = []
+        if labels:
+            node_labels = ",".join(f"{key}={value}" for key, value in labels.items())
+            kubelet_extra_args.append(f"--node-labels={node_labels}")
+        if taints:
+            node_taints = ",".join(
+                f"{taint['key']}={taint['value']}:{taint['effect']}" for taint in taints
+            )
+            kubelet_extra_args.append(f"--register-with-taints={node_taints}")
 
-            for file in files:
-                manifest = yaml.safe_load(file)
-                if manifest is not None:
-                    self.cluster.add_manifest(
-                        manifest["kind"] + name,
-                        manifest,
+        # Pools with their own boot steps render the bootstrap themselves, see __node_bootstrap
+        custom_bootstrap = node_bootstrap.uses_boot_script(pool)
+        asg = self.cluster.add_auto_scaling_group_capacity(
+            pool_id,
+            instance_type=ec2.InstanceType(pool["instance_types"][0]),
+            vpc_subnets=subnets,
+            bootstrap_enabled=not custom_bootstrap,
+            bootstrap_options=(
+                eks.BootstrapOptions(kubelet_extra_args=" ".join(kubelet_extra_args))
+                if kubelet_extra_args
+                else None
+            ),
+            min_capacity=pool["min"],
+            max_capacity=pool["max"],
+            desired_capacity=pool.get("desired"),
+            spot_price=pool.get("spot_price"),
+            block_devices=[
+                autoscaling.BlockDevice(
+                    device_name="/dev/xvda",
+                    volume=autoscaling.BlockDeviceVolume.ebs(
+                        volume_size=pool["disk"]["size"],
+                        volume_type=autoscaling.EbsDeviceVolumeType.GP3,
+                        throughput=pool["disk"].get("throughput"),
+                        iops=pool["disk"].get("iops"),
+                        delete_on_termination=True,
+                    ),
+                ),
+            ],
+        )
+
+        # Lets cluster-autoscaler find the pool
+        for key, value in cluster_autoscaler.discovery_tags(
+            self.cluster.cluster_name
+        ).items():
+            Tags.of(asg).add(
+                key,
+                value,
+                include_resource_types=["AWS::AutoScaling::AutoScalingGroup"],
+            )
+        # Lets cluster-autoscaler scale the pool up from zero nodes
+        for key, value in labels.items():
+            Tags.of(asg).add(
+                f"k8s.io/cluster-autoscaler/node-template/label/{key}", value
+            )
+        for taint in taints:
+            Tags.of(asg).add(
+                f"k8s.io/cluster-autoscaler/node-template/taint/{taint['key']}",
+                f"{taint['value']}:{taint['effect']}",
+            )
+
+        if custom_bootstrap:
+            self.__node_bootstrap(asg, pool, " ".join(kubelet_extra_args))
+        self.__node_ready_hook(asg, pool)
+        self.__warm_pool(asg, pool)
+        return asg
+
+    def __warm_pool(self, asg, pool):
+        # Instances launched and pulled ahead of a scale-out, started instead
+        # of booted cold. The boot script keeps them out of the cluster until then.
+        warm_pool = pool.get("warm_pool")
+        if not warm_pool:
+            return
+        if pool.get("spot_price"):
+            raise ValueError(
+                f"Warm pools can't launch spot instances, see {pool['name']}"
+            )
+        state = warm_pool.get("state", "stopped")
+        if state not in WARM_POOL_STATES:
+            # Hibernation needs a launch template, ASG capacity has a launch configuration
+            raise ValueError(
+                f"Unsupported warm pool state {state} for {pool['name']},"
+                f" expected one of {sorted(WARM_POOL_STATES)}"
+            )
+        asg.add_warm_pool(
+            min_size=warm_pool.get("min_size"),
+            max_group_prepared_capacity=warm_pool.get("max_prepared"),
+            pool_state=WARM_POOL_STATES[state],
+            reuse_on_scale_in=warm_pool.get("reuse_on_scale_in", False),
+        )
+
+    def __node_ready_hook(self, asg, pool):
+        # Launching instances stay in Pending:Wait until the boot script says
+        # their kubelet is up (or, in the warm pool, their images are pulled)
+        timeout = node_bootstrap.ready_timeout(pool)
+        if timeout is None:
+            return
+        asg.add_lifecycle_hook(
+            "NodeReadyHook",
+            lifecycle_hook_name=node_bootstrap.LIFECYCLE_HOOK_NAME,
+            lifecycle_transition=autoscaling.LifecycleTransition.INSTANCE_LAUNCHING,
+            heartbeat_timeout=cdk.Duration.seconds(timeout),
+            default_result=autoscaling.DefaultResult.CONTINUE,
+        )
+        Tags.of(asg).add(
+            node_bootstrap.POOL_TAG,
+            pool["name"],
+            include_resource_types=["AWS::AutoScaling::AutoScalingGroup"],
+        )
+        # Tag scoped: the group's name would make the role depend on the group
+        asg.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["autoscaling:CompleteLifecycleAction"],
+                resources=["*"],
+                conditions={
+                    "StringEquals": {
+                        f"autoscaling:ResourceTag/{node_bootstrap.POOL_TAG}": pool[
+                            "name"
+                        ]
+                    }
+                },
+            )
+        )
+        asg.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["autoscaling:DescribeAutoScalingInstances"],
+                resources=["*"],
+            )
+        )
+
+    def __node_bootstrap(self, asg, pool, kubelet_extra_args: str):
+        # The bootstrap CDK renders for ASG capacity, as a boot script that also
+        # pulls the notebook images before the node joins, so no user pod starts
+        # with a cold image, and handles warm pool starts, see node_bootstrap.py
+        if pool.get("prepull_images") is True:
+            images = notebook_images(helm_values(self.config))
+        else:
+            images = list(pool.get("prepull_images") or [])
+
+        if pool.get("spot_price"):
+            lifecycle_args = "--node-labels lifecycle=Ec2Spot --register-with-taints=spotInstance=true:PreferNoSchedule"
+        else:
+            lifecycle_args = "--node-labels lifecycle=OnDemand"
+        kubelet_args = f"{lifecycle_args} {kubelet_extra_args}".strip()
+        # An explicit maxPods would be overwritten with the ENI based one
+        use_max_pods = "maxPods" not in node_bootstrap.kubelet_config(pool)
+
+        script = node_bootstrap.boot_script(
+            pool,
+            images,
+            bootstrap_command=f"/etc/eks/bootstrap.sh {self.cluster.cluster_name}"
+            f' --kubelet-extra-args "{kubelet_args}"'
+            f" --apiserver-endpoint '{self.cluster.cluster_endpoint}'"
+            f" --b64-cluster-ca '{self.cluster.cluster_certificate_authority_data}'"
+            f" --use-max-pods {str(use_max_pods).lower()}",
+            signal_command=f"/opt/aws/bin/cfn-signal --exit-code $? --stack {self.stack_name}"
+            f" --resource {asg.node.default_child.logical_id} --region {self.region}",
+        )
+        asg.add_user_data(*node_bootstrap.user_data_commands(script))
+
+    def __managed_node_pool(self, pool, pool_id: str, subnets):
+        if node_bootstrap.uses_boot_script(pool):
+            raise ValueError(
+                f"{', '.join(node_bootstrap.BOOT_KEYS)} are for asg pools,"
+                f" {pool['name']} is a managed node group"
+            )
+        # Launch template only sets the root volume, EKS still adds its bootstrap user data
+        launch_template = ec2.CfnLaunchTemplate(
+            self,
+            f"{pool_id}LaunchTemplate",
+            launch_template_data=ec2.CfnLaunchTemplate.LaunchTemplateDataProperty(
+                block_device_mappings=[
+                    ec2.CfnLaunchTemplate.BlockDeviceMappingProperty(
+                        device_name="/dev/xvda",
+                        ebs=ec2.CfnLaunchTemplate.EbsProperty(
+                            volume_size=pool["disk"]["size"],
+                            volume_type="gp3",
+                            throughput=pool["disk"].get("throughput"),
+                            iops=pool["disk"].get("iops"),
+                            delete_on_termination=True,
+                        ),
                     )
+                ]
+            ),
+        )
+
+        taints = [
+            eks.TaintSpec(
+                key=taint["key"],
+                value=taint["value"],
+                effect=TAINT_EFFECTS[taint["effect"]],
+            )
+            for taint in self.__node_pool_taints(pool)
+        ]
+        return self.cluster.add_nodegroup_capacity(
+            pool_id,
+            subnets=subnets,
+            # Several instance types with SPOT capacity is EKS's mixed-instances spot pool
+            instance_types=[
+                ec2.InstanceType(instance_type)
+                for instance_type in pool["instance_types"]
+            ],
+            capacity_type=(
+                eks.CapacityType.SPOT
+                if pool.get("spot")
+                else eks.CapacityType.ON_DEMAND
+            ),
+            min_size=pool["min"],
+            max_size=pool["max"],
+            desired_size=pool.get("desired"),
+            labels=self.__node_pool_labels(pool) or None,
+            taints=taints or None,
+            launch_template_spec=eks.LaunchTemplateSpec(
+                id=launch_template.ref,
+                version=launch_template.attr_latest_version_number,
+            ),
+        )
+
+    def __yaml_manifest(self, name: str, *file_locations: str):
+        self.__manifest_group(
+            name,
+            [
+                document
+                for file_location in file_locations
+                for document in load_documents(file_location)
+            ],
+        )
+
+    def __manifest_group(self, name: str, documents: List[Dict]):
+        manifests_config = self.config["eks"]["manifests"]
+        self.manifest_groups[name] = len(documents)
+
+        if manifests_config["bundle"]:
+            # One custom resource, i.e. one kubectl apply, for the whole group
+            manifests = [self.cluster.add_manifest(f"Bundle{name}", *documents)]
+            # Groups still apply in the order they are declared
+            if self.__last_manifest_bundle is not None:
+                manifests[0].node.add_dependency(self.__last_manifest_bundle)
+            self.__last_manifest_bundle = manifests[0]
+        else:
+            manifests = [
+                self.cluster.add_manifest(manifest["kind"] + name, manifest)
+                for manifest in documents
+            ]
+
+        # Replaced custom resources are dropped without `kubectl delete`, which
+        # would otherwise remove the objects the new resources just applied
+        if manifests_config["retain_replaced"]:
+            for manifest in manifests:
+                manifest.node.default_child.apply_removal_policy(
+                    cdk.RemovalPolicy.RETAIN
+                )
 
     def __cluster_auto_scaler(self):
-        # Cluster Auto Scaler Manifest
-        self.__yaml_manifest("./etc/cluster-autoscaler-autodiscover.yaml", "ca")
+        # Cluster Auto Scaler, its image follows the cluster version and it
+        # discovers the node pools by the tags added in __asg_node_pool
+        self.__manifest_group(
+            "ca",
+            cluster_autoscaler.manifests(
+                self.cluster.cluster_name,
+                self.kubernetes_version.version,
+                self.config["eks"]["cluster_autoscaler"],
+            ),
+        )
         ##############
         # Eviction Policy Needed!!!  #
         ##############
 
+    def __load_balancer_controller(self):
+        # Gives proxy-public an NLB with IP targets, see eks.load_balancer
+        lb_config = self.config["eks"]["load_balancer"]
+        if lb_config["type"] != "nlb":
+            return
+        controller = eks.AlbController(
+            self,
+            "LoadBalancerController",
+            cluster=self.cluster,
+            version=eks.AlbControllerVersion.V2_4_1,
+            repository=lb_config.get("controller_image_repository"),
+        )
+        # The chart waits for the controller pods, which need nodes to run on
+        controller.node.add_dependency(*self.auto_scaling_groups, *self.nodegroups)
+
     def __efs_csi_drivers(self):
         # Policy
         oidc_provider_arn = (
@@ -181,10 +564,9 @@ class EksStack(cdk.Stack):
             name="efs-csi-controller-sa",
         )
         # EFS CSI Driver
-        self.__yaml_manifest("./etc/public-efs-driver.yaml", "efs")
+        self.__yaml_manifest("efs", "./etc/public-efs-driver.yaml")
 
         # EFS Security Groups Settings
-        self.cluster_vpc = self.cluster.vpc
         cluster_cidr = self.cluster.vpc.vpc_cidr_block
         self.allow_efs_traffic = ec2.SecurityGroup(
             self,
@@ -202,21 +584,147 @@ class EksStack(cdk.Stack):
         # Create EFS File System
 
     def __efs_file_system(self):
+        efs_config = self.config["eks"]["efs"]
+
+        # Enum member names, the config may spell them in either case
+        throughput_mode = efs_config["throughput_mode"].upper()
+        performance_mode = efs_config["performance_mode"].upper()
+        provisioned_throughput = None
+        if throughput_mode == "PROVISIONED":
+            provisioned_throughput = cdk.Size.mebibytes(
+                efs_config["provisioned_throughput_mibps"]
+            )
+        lifecycle_policy = efs_config.get("lifecycle_policy")
+        out_of_ia_policy = efs_config.get("out_of_infrequent_access_policy")
+
         self.efs_file_system = efs.FileSystem(
             self,
             "Z2jhEfsFileSystem",
             vpc=self.cluster_vpc,
-            lifecycle_policy=efs.LifecyclePolicy.AFTER_14_DAYS,
-            performance_mode=efs.PerformanceMode.GENERAL_PURPOSE,
-            out_of_infrequent_access_policy=efs.OutOfInfrequentAccessPolicy.AFTER_1_ACCESS,
+            lifecycle_policy=(
+                getattr(efs.LifecyclePolicy, lifecycle_policy)
+                if lifecycle_policy
+                else None
+            ),
+            performance_mode=getattr(efs.PerformanceMode, performance_mode),
+            # Bursting is the EFS default, left out so the template doesn't change
+            throughput_mode=(
+                None
+                if throughput_mode == "BURSTING"
+                else getattr(efs.ThroughputMode, throughput_mode)
+            ),
+            provisioned_throughput_per_second=provisioned_throughput,
+            out_of_infrequent_access_policy=(
+                getattr(efs.OutOfInfrequentAccessPolicy, out_of_ia_policy)
+                if out_of_ia_policy
+                else None
+            ),
             security_group=self.allow_efs_traffic,
         )
 
+        if efs_config["monitoring"]["enabled"]:
+            self.__efs_monitoring(efs_config, throughput_mode, performance_mode)
+
+    def __efs_metric(self, metric_name: str, statistic: str):
+        return cloudwatch.Metric(
+            namespace="AWS/EFS",
+            metric_name=metric_name,
+            dimensions_map={"FileSystemId": self.efs_file_system.file_system_id},
+            statistic=statistic,
+            period=cdk.Duration.minutes(1),
+        )
+
+    def __efs_monitoring(self, efs_config, throughput_mode, performance_mode):
+        monitoring = efs_config["monitoring"]
+        bursting = throughput_mode == "BURSTING"
+        general_purpose = performance_mode == "GENERAL_PURPOSE"
+
+        burst_credits = self.__efs_metric("BurstCreditBalance", "Minimum")
+        percent_io_limit = self.__efs_metric("PercentIOLimit", "Maximum")
+        # Bytes per minute to MiB/s
+        throughput = cloudwatch.MathExpression(
+            expression="metered / PERIOD(metered) / 1048576",
+            using_metrics={"metered": self.__efs_metric("MeteredIOBytes", "Sum")},
+            label="Metered throughput (MiB/s)",
+            period=cdk.Duration.minutes(1),
+        )
+        permitted_throughput = cloudwatch.MathExpression(
+            expression="permitted / 1048576",
+            using_metrics={
+                "permitted": self.__efs_metric("PermittedThroughput", "Average")
+            },
+            label="Permitted throughput (MiB/s)",
+            period=cdk.Duration.minutes(1),
+        )
+
+        alarms = []
+        if bursting:
+            alarms.append(
+                burst_credits.create_alarm(
+                    self,
+                    "EfsBurstCreditBalanceAlarm",
+                    alarm_description="EFS home directories are running out of burst credits",
+                    threshold=monitoring["burst_credit_balance_threshold"],
+                    comparison_operator=cloudwatch.ComparisonOperator.LESS_THAN_THRESHOLD,
+                    evaluation_periods=5,
+                    treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+                )
+            )
+        if general_purpose:
+            alarms.append(
+                percent_io_limit.create_alarm(
+                    self,
+                    "EfsPercentIOLimitAlarm",
+                    alarm_description="EFS home directories are close to the general purpose IO limit",
+                    threshold=monitoring["percent_io_limit_threshold"],
+                    comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
+                    evaluation_periods=5,
+                    treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+                )
+            )
+
+        if monitoring.get("alarm_topic_arn"):
+            topic = sns.Topic.from_topic_arn(
+                self, "EfsAlarmTopic", monitoring["alarm_topic_arn"]
+            )
+            for alarm in alarms:
+                alarm.add_alarm_action(cloudwatch_actions.SnsAction(topic))
+
+        widgets = [
+            cloudwatch.GraphWidget(
+                title="Throughput (MiB/s)",
+                left=[throughput, permitted_throughput],
+                width=12,
+            )
+        ]
+        if bursting:
+            widgets.append(
+                cloudwatch.GraphWidget(
+                    title="Burst credit balance (bytes)", left=[burst_credits], width=12
+                )
+            )
+        if general_purpose:
+            widgets.append(
+                cloudwatch.GraphWidget(
+                    title="Percent IO limit", left=[percent_io_limit], width=12
+                )
+            )
+        widgets += (
+            [cloudwatch.AlarmStatusWidget(alarms=alarms, width=12)] if alarms else []
+        )
+
+        cloudwatch.Dashboard(
+            self,
+            "EfsDashboard",
+            dashboard_name=f"{self.config['name']}-efs-{self.region}",
+            widgets=[widgets],
+        )
+
     def __efs_storage_class(self):
         efs_storage_class = {
             "kind": "StorageClass",
             "apiVersion": "storage.k8s.io/v1",
-            "metadata": {"name": "efs-sc"},
+            "metadata": {"name": EFS_STORAGE_CLASS},
             "provisioner": "efs.csi.aws.com",
             "parameters": {
                 "provisioningMode": "efs-ap",
@@ -231,6 +739,242 @@ class EksStack(cdk.Stack):
             efs_storage_class,
         )
 
+    def __datasets_volume(self):
+        # Shared datasets: an EFS access point bound read-only to one claim the
+        # user pods mount, see z2jh.datasets
+        if not (self.config["z2jh"].get("datasets") or {}).get("enabled"):
+            return
+        access_point = self.efs_file_system.add_access_point(
+            "DatasetsAccessPoint",
+            path="/datasets",
+            # Root owned, users can't write even where the mount isn't read-only
+            create_acl=efs.Acl(owner_uid="0", owner_gid="0", permissions="755"),
+        )
+        namespace = self.__z2jh_namespace()
+
+        volume_name = f"z2jh-{DATASETS_CLAIM}"
+        # EFS doesn't enforce a size, the API requires one
+        capacity = {"storage": "1Ti"}
+        datasets = self.cluster.add_manifest(
+            "Datasets",
+            {
+                "apiVersion": "v1",
+                "kind": "PersistentVolume",
+                "metadata": {"name": volume_name},
+                "spec": {
+                    "capacity": capacity,
+                    "accessModes": ["ReadOnlyMany"],
+                    "persistentVolumeReclaimPolicy": "Retain",
+                    "storageClassName": "",
+                    "csi": {
+                        "driver": "efs.csi.aws.com",
+                        "volumeHandle": f"{self.efs_file_system.file_system_id}"
+                        f"::{access_point.access_point_id}",
+                        "readOnly": True,
+                    },
+                },
+            },
+            {
+                "apiVersion": "v1",
+                "kind": "PersistentVolumeClaim",
+                "metadata": {"name": DATASETS_CLAIM, "namespace": "z2jh"},
+                "spec": {
+                    "accessModes": ["ReadOnlyMany"],
+                    "storageClassName": "",
+                    "volumeName": volume_name,
+                    "resources": {"requests": capacity},
+                },
+            },
+        )
+        datasets.node.add_dependency(namespace)
+
+    def __z2jh_namespace(self):
+        # The Helm release creates the namespace otherwise, claims EksStack puts
+        # in it need it first. Retained: turning those off mustn't delete the
+        # hub's namespace. The id is from when only the datasets claim used it.
+        namespace = self.cluster.node.try_find_child("manifest-DatasetsNamespace")
+        if namespace is None:
+            namespace = self.cluster.add_manifest(
+                "DatasetsNamespace",
+                {"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": "z2jh"}},
+            )
+            namespace.node.default_child.apply_removal_policy(cdk.RemovalPolicy.RETAIN)
+        return namespace
+
+    def __service_account_role(
+        self, construct_id: str, namespace: str, service_account: str, **kwargs
+    ):
+        # IAM role a Kubernetes service account assumes through the cluster OIDC provider
+        oidc_provider = self.cluster.open_id_connect_provider
+        issuer = oidc_provider.open_id_connect_provider_issuer
+        conditions = CfnJson(
+            self,
+            f"{construct_id}Condition",
+            value={
+                f"{issuer}:sub": f"system:serviceaccount:{namespace}:{service_account}",
+                f"{issuer}:aud": "sts.amazonaws.com",
+            },
+        )
+        return iam.Role(
+            self,
+            construct_id,
+            assumed_by=iam.OpenIdConnectPrincipal(
+                oidc_provider, conditions={"StringEquals": conditions}
+            ),
+            **kwargs,
+        )
+
+    def __hub_database(self):
+        hub_db = self.config["z2jh"].get("hub_db") or {}
+        db_type = hub_db.get("type", "sqlite-efs")
+        if db_type == "sqlite-ebs":
+            self.__hub_sqlite_ebs()
+        elif db_type == "postgres":
+            self.__hub_postgres(hub_db["postgres"])
+
+    def __hub_sqlite_ebs(self):
+        # The hub's SQLite claim on ebs-gp3, see HUB_DB_EBS_CLAIM. Retained, it
+        # holds the hub's users and tokens.
+        claim = self.cluster.add_manifest(
+            "HubDbEbsClaim",
+            {
+                "apiVersion": "v1",
+                "kind": "PersistentVolumeClaim",
+                "metadata": {"name": HUB_DB_EBS_CLAIM, "namespace": "z2jh"},
+                "spec": {
+                    "accessModes": ["ReadWriteOnce"],
+                    "storageClassName": EBS_STORAGE_CLASS,
+                    "resources": {"requests": {"storage": "1Gi"}},
+                },
+            },
+        )
+        claim.node.default_child.apply_removal_policy(cdk.RemovalPolicy.RETAIN)
+        claim.node.add_dependency(self.__z2jh_namespace(), self.ebs_storage_class)
+
+    def __ebs_storage_class(self):
+        ebs_config = self.config["eks"].get("ebs") or {}
+        # Unset keeps gp3's baseline, and the StorageClass of existing clusters as is
+        gp3_performance = {
+            key: str(ebs_config[key])
+            for key in ("iops", "throughput")
+            if ebs_config.get(key) is not None
+        }
+        iops = ebs_config.get("iops") or 3000
+        if ebs_config.get("throughput") and ebs_config["throughput"] * 4 > iops:
+            raise ValueError(
+                f"gp3 throughput {ebs_config['throughput']} MiB/s needs at least"
+                f" {ebs_config['throughput'] * 4} IOPS, eks.ebs.iops is {iops}"
+            )
+
+        # EBS CSI driver add-on, the in-tree EBS provisioner has no gp3 support
+        ebs_csi_role = self.__service_account_role(
+            "AmazonEKS_EBS_CSI_DriverRole",
+            "kube-system",
+            "ebs-csi-controller-sa",
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name(
+                    "service-role/AmazonEBSCSIDriverPolicy"
+                )
+            ],
+        )
+        ebs_csi_driver = eks.CfnAddon(
+            self,
+            "EbsCsiDriver",
+            addon_name="aws-ebs-csi-driver",
+            cluster_name=self.cluster.cluster_name,
+            service_account_role_arn=ebs_csi_role.role_arn,
+            resolve_conflicts="OVERWRITE",
+        )
+
+        ebs_storage_class = {
+            "kind": "StorageClass",
+            "apiVersion": "storage.k8s.io/v1",
+            "metadata": {"name": EBS_STORAGE_CLASS},
+            "provisioner": "ebs.csi.aws.com",
+            # Create the volume in the zone the pod is scheduled to
+            "volumeBindingMode": "WaitForFirstConsumer",
+            "allowVolumeExpansion": True,
+            "parameters": {"type": "gp3", "encrypted": "true", **gp3_performance},
+        }
+        self.ebs_storage_class = self.cluster.add_manifest(
+            "EbsStorageClass", ebs_storage_class
+        )
+        self.ebs_storage_class.node.add_dependency(ebs_csi_driver)
+
+    def __hub_postgres(self, postgres):
+        # Plain string secret, the hub writes it into a pgpass file as is.
+        # No punctuation: ':' and backslashes would need escaping in pgpass.
+        self.hub_db_password = secretsmanager.Secret(
+            self,
+            "HubDbPassword",
+            secret_name=HUB_DB_PASSWORD_SECRET,
+            generate_secret_string=secretsmanager.SecretStringGenerator(
+                exclude_punctuation=True, password_length=32
+            ),
+        )
+
+        hub_db_security_group = ec2.SecurityGroup(
+            self,
+            "HubDbSecurityGroup",
+            vpc=self.cluster.vpc,
+            allow_all_outbound=False,
+            description="Allow Inbound PostgreSQL Traffic from EKS VPC",
+        )
+        hub_db_security_group.add_ingress_rule(
+            peer=ec2.Peer.ipv4(self.cluster.vpc.vpc_cidr_block),
+            connection=ec2.Port.tcp(5432),
+            description="Allow PostgreSQL in EKS VPC",
+        )
+
+        engine_version = str(postgres["engine_version"])
+        self.hub_db = rds.DatabaseInstance(
+            self,
+            "HubDatabase",
+            engine=rds.DatabaseInstanceEngine.postgres(
+                version=rds.PostgresEngineVersion.of(
+                    engine_version, engine_version.split(".")[0]
+                )
+            ),
+            instance_type=ec2.InstanceType(postgres["instance_type"]),
+            vpc=self.cluster.vpc,
+            vpc_subnets=ec2.SubnetSelection(
+                subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS
+            ),
+            security_groups=[hub_db_security_group],
+            credentials=rds.Credentials.from_password(
+                postgres.get("username", "jupyterhub"),
+                self.hub_db_password.secret_value,
+            ),
+            database_name=postgres.get("database_name", "jupyterhub"),
+            allocated_storage=postgres["allocated_storage"],
+            storage_type=rds.StorageType.GP3,
+            storage_encrypted=True,
+            multi_az=postgres["multi_az"],
+        )
+
+        # The hub pod reads the password with this role, see hub_db_values
+        hub_role = self.__service_account_role("HubDbPasswordReader", "z2jh", "hub")
+        self.hub_db_password.grant_read(hub_role)
+
+        ssm.StringParameter(
+            self,
+            "HubDbEndpoint",
+            parameter_name=HUB_DB_ENDPOINT_PARAMETER,
+            string_value=Fn.join(
+                ":",
+                [
+                    self.hub_db.db_instance_endpoint_address,
+                    self.hub_db.db_instance_endpoint_port,
+                ],
+            ),
+        )
+        ssm.StringParameter(
+            self,
+            "HubDbRole",
+            parameter_name=HUB_DB_ROLE_PARAMETER,
+            string_value=hub_role.role_arn,
+        )
+
     def __create_ssm_parameters(self):
         ssm.StringParameter(
             self,
@@ -285,6 +1029,43 @@ class EksStack(cdk.Stack):
         )
 
         subnets = self.cluster.vpc.private_subnets
+        route_tables = [str(subnet.route_table.route_table_id) for subnet in subnets]
+
+        # Consumers read as many route tables as the config says the VPC has,
+        # fewer are built when the region has fewer AZs
+        if len(route_tables) != self.config["eks"]["vpc"]["max_azs"]:
+            raise ValueError(
+                f"Cluster VPC has {len(route_tables)} private route tables,"
+                f" eks.vpc.max_azs is {self.config['eks']['vpc']['max_azs']}:"
+                f" {self.region} has {len(self.availability_zones)} AZs"
+            )
+
+        # The cluster's kubectl handler, stacks importing the cluster can share it
+        kubectl_provider = self.node.find_child(KUBECTL_PROVIDER_ID)
+
+        # Everything the other stages need, resolved by them as one parameter.
+        # The individual parameters above and below are kept for external readers.
+        ssm.StringParameter(
+            self,
+            "ClusterAttributes",
+            parameter_name=CLUSTER_ATTRIBUTES_PARAMETER,
+            string_value=encode_cluster_attributes(
+                {
+                    "cluster_name": self.cluster.cluster_name,
+                    "kubectl_role": self.cluster.admin_role.role_arn,
+                    "oidc_arn": self.cluster.open_id_connect_provider.open_id_connect_provider_arn,
+                    "eks_vpc": self.cluster.vpc.vpc_id,
+                    "eks_vpc_cidr": self.cluster.vpc.vpc_cidr_block,
+                    "eks_security_group_id": self.cluster.cluster_security_group_id,
+                    "efs_file_system_id": self.efs_file_system.file_system_id,
+                    "kubectl_function_arn": kubectl_provider.service_token,
+                    "kubectl_handler_role_arn": kubectl_provider.handler_role.role_arn,
+                },
+                route_tables,
+                [subnet.subnet_id for subnet in subnets],
+                [subnet.availability_zone for subnet in subnets],
+            ),
+        )
 
         for i, subnet in enumerate(subnets):
             ssm.StringParameter(
@@ -0,0 +1,274 @@
+from aws_cdk import (
+    aws_cloudwatch as cloudwatch,
+    aws_cloudwatch_actions as cloudwatch_actions,
+    aws_eks as eks,
+    aws_iam as iam,
+    aws_logs as logs,
+    aws_sns as sns,
+)
+from constructs import Construct
+import aws_cdk as cdk
+from cdk_pipeline import cloudwatch_agent
+from cdk_pipeline.cluster_props import ClusterProps
+from utils.stack_util import add_tags_to_stack
+
+
+class MonitoringStack(cdk.Stack):
+    """
+    Monitoring Stack
+    1. CloudWatch agent scraping the hub's and the cluster autoscaler's
+       Prometheus metrics, see `cloudwatch_agent.py`
+    2. Dashboard of spawn time, pending pods, nodes and EFS load
+    3. Alarm on the p95 spawn time
+    """
+
+    def __init__(self, scope: Construct, construct_id: str, config, **kwargs) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        self.config = config
+        self.monitoring_config = config["monitoring"]
+
+        add_tags_to_stack(self, config)
+
+        self.cluster_props = ClusterProps.of(self, config)
+        self.cluster = self.cluster_props.cluster
+
+        self.__cloudwatch_agent()
+        self.__spawn_time_alarm()
+        self.__dashboard()
+
+    def __cloudwatch_agent(self):
+        cluster_name = self.cluster_props.cluster_name
+
+        namespace = self.cluster.add_manifest(
+            "CloudWatchNamespace",
+            {
+                "apiVersion": "v1",
+                "kind": "Namespace",
+                "metadata": {"name": cloudwatch_agent.NAMESPACE},
+            },
+        )
+        service_account = self.cluster.add_service_account(
+            "CloudWatchAgent",
+            name=cloudwatch_agent.NAME,
+            namespace=cloudwatch_agent.NAMESPACE,
+        )
+        service_account.node.add_dependency(namespace)
+        service_account.role.add_managed_policy(
+            iam.ManagedPolicy.from_aws_managed_policy_name(
+                "CloudWatchAgentServerPolicy"
+            )
+        )
+
+        # Created ahead of the agent so it doesn't create one without retention
+        log_group = logs.LogGroup(
+            self,
+            "PrometheusLogGroup",
+            log_group_name=cloudwatch_agent.log_group_name(cluster_name),
+            retention=logs.RetentionDays.ONE_MONTH,
+            removal_policy=cdk.RemovalPolicy.DESTROY,
+        )
+
+        # The hub service token the chart generated, copied next to the agent.
+        # The kubectl handler logs it, it can only read metrics.
+        hub_token = eks.KubernetesObjectValue(
+            self,
+            "HubMetricsToken",
+            cluster=self.cluster,
+            object_type="secret",
+            object_name=cloudwatch_agent.HUB_SECRET,
+            object_namespace=cloudwatch_agent.HUB_NAMESPACE,
+            json_path=cloudwatch_agent.HUB_TOKEN_JSON_PATH,
+        )
+        token_secret = self.cluster.add_manifest(
+            "HubMetricsTokenSecret",
+            {
+                "apiVersion": "v1",
+                "kind": "Secret",
+                "metadata": {
+                    "name": cloudwatch_agent.HUB_TOKEN_SECRET,
+                    "namespace": cloudwatch_agent.NAMESPACE,
+                },
+                "type": "Opaque",
+                # Already base64 encoded
+                "data": {"token": hub_token.value},
+            },
+        )
+        token_secret.node.add_dependency(namespace)
+
+        agent = self.cluster.add_manifest(
+            "CloudWatchAgent",
+            *cloudwatch_agent.manifests(
+                cluster_name, self.region, self.monitoring_config
+            ),
+        )
+        agent.node.add_dependency(service_account, log_group, token_secret)
+
+    def __metric(self, metric_name: str, statistic: str, **dimensions):
+        return cloudwatch.Metric(
+            namespace=cloudwatch_agent.METRIC_NAMESPACE,
+            metric_name=metric_name,
+            dimensions_map={
+                "ClusterName": self.cluster_props.cluster_name,
+                **dimensions,
+            },
+            statistic=statistic,
+            period=cdk.Duration.minutes(self.monitoring_config["period_minutes"]),
+        )
+
+    def __spawn_metric(self, series: str, **dimensions):
+        # Successful spawns only, failed ones say little about how long users wait
+        return self.__metric(
+            f"jupyterhub_server_spawn_duration_seconds_{series}",
+            "Sum",
+            status="success",
+            **dimensions,
+        )
+
+    def __spawn_bucket(self, bound: float):
+        return self.__spawn_metric("bucket", le=cloudwatch_agent.bucket_label(bound))
+
+    def __spawn_time_alarm(self):
+        threshold = self.monitoring_config["spawn_p95_threshold_seconds"]
+        if threshold not in cloudwatch_agent.SPAWN_DURATION_BUCKETS:
+            raise ValueError(
+                f"monitoring.spawn_p95_threshold_seconds {threshold} is not one of"
+                f" the hub's spawn time buckets {cloudwatch_agent.SPAWN_DURATION_BUCKETS}"
+            )
+
+        # The p95 spawn time is over the threshold exactly when more than 5% of
+        # the spawns in the period didn't finish within it, a bucket bound
+        slow_spawns = cloudwatch.MathExpression(
+            expression="IF(spawns > 0, 1 - fast / spawns, 0)",
+            using_metrics={
+                "fast": self.__spawn_bucket(threshold),
+                "spawns": self.__spawn_metric("count"),
+            },
+            label=f"Spawns over {threshold}s",
+            period=cdk.Duration.minutes(self.monitoring_config["period_minutes"]),
+        )
+        self.spawn_time_alarm = slow_spawns.create_alarm(
+            self,
+            "SpawnTimeP95Alarm",
+            alarm_description=f"p95 of JupyterHub spawn time is over {threshold}s",
+            threshold=0.05,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+            evaluation_periods=self.monitoring_config["evaluation_periods"],
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+        )
+
+        if self.monitoring_config.get("alarm_topic_arn"):
+            topic = sns.Topic.from_topic_arn(
+                self, "MonitoringAlarmTopic", self.monitoring_config["alarm_topic_arn"]
+            )
+            self.spawn_time_alarm.add_alarm_action(cloudwatch_actions.SnsAction(topic))
+
+    def __spawn_time_p95(self):
+        # Upper bound of the bucket holding the 95th percentile, from the
+        # per-period bucket counts. The top bucket stands for itself and above.
+        buckets = cloudwatch_agent.SPAWN_DURATION_BUCKETS
+        expression = str(buckets[-1])
+        for i in reversed(range(len(buckets) - 1)):
+            expression = f"IF(b{i} / spawns >= 0.95, {buckets[i]}, {expression})"
+        metrics = {
+            f"b{i}": self.__spawn_bucket(bound) for i, bound in enumerate(buckets[:-1])
+        }
+        metrics["spawns"] = self.__spawn_metric("count")
+        return cloudwatch.MathExpression(
+            expression=f"IF(spawns > 0, {expression})",
+            using_metrics=metrics,
+            label="p95 (bucket upper bound)",
+            period=cdk.Duration.minutes(self.monitoring_config["period_minutes"]),
+        )
+
+    def __dashboard(self):
+        period = cdk.Duration.minutes(self.monitoring_config["period_minutes"])
+        average_spawn_time = cloudwatch.MathExpression(
+            expression="IF(spawns > 0, total / spawns)",
+            using_metrics={
+                "total": self.__spawn_metric("sum"),
+                "spawns": self.__spawn_metric("count"),
+            },
+            label="Average",
+            period=period,
+        )
+        efs_dimensions = {"FileSystemId": self.cluster_props.efs_file_system_id}
+
+        cloudwatch.Dashboard(
+            self,
+            "MonitoringDashboard",
+            dashboard_name=f"{self.config['name']}-hub-{self.region}",
+            widgets=[
+                [
+                    cloudwatch.GraphWidget(
+                        title="Spawn time (s)",
+                        left=[self.__spawn_time_p95(), average_spawn_time],
+                        width=12,
+                    ),
+                    cloudwatch.GraphWidget(
+                        title="Spawns",
+                        left=[
+                            self.__metric(
+                                "jupyterhub_server_spawn_duration_seconds_count",
+                                "Sum",
+                                status=status,
+                            ).with_(label=status)
+                            for status in ("success", "failure")
+                        ],
+                        right=[self.__metric("jupyterhub_running_servers", "Maximum")],
+                        width=12,
+                    ),
+                ],
+                [
+                    cloudwatch.GraphWidget(
+                        title="Pending pods",
+                        left=[
+                            self.__metric(
+                                "cluster_autoscaler_unschedulable_pods_count",
+                                "Maximum",
+                            )
+                        ],
+                        width=8,
+                    ),
+                    cloudwatch.GraphWidget(
+                        title="Nodes",
+                        left=[
+                            self.__metric(
+                                "cluster_autoscaler_nodes_count", "Maximum", state=state
+                            ).with_(label=state)
+                            for state in ("ready", "notStarted", "unready")
+                        ],
+                        width=8,
+                    ),
+                    # EFS publishes no latency metric; latency climbs as the
+                    # file system nears its IO limit
+                    cloudwatch.GraphWidget(
+                        title="EFS load",
+                        left=[
+                            cloudwatch.Metric(
+                                namespace="AWS/EFS",
+                                metric_name="PercentIOLimit",
+                                dimensions_map=efs_dimensions,
+                                statistic="Maximum",
+                                period=period,
+                            )
+                        ],
+                        right=[
+                            cloudwatch.Metric(
+                                namespace="AWS/EFS",
+                                metric_name="ClientConnections",
+                                dimensions_map=efs_dimensions,
+                                statistic="Sum",
+                                period=period,
+                            )
+                        ],
+                        width=8,
+                    ),
+                ],
+                [
+                    cloudwatch.AlarmStatusWidget(
+                        alarms=[self.spawn_time_alarm], width=24
+                    )
+                ],
+            ],
+        )
@@ -0,0 +1,151 @@
+from typing import Any, Dict, List
+import json
+
+# Boot script of self-managed (asg) node pools with boot steps of their own,
+# built from the pool's entry in `eks.node_pools`. EksStack installs it as a
+# cloud-init per-boot script: it also has to run when a stopped warm pool
+# instance is started for a scale-out, and user data only runs on first boot.
+#
+# Warm pool instances (target lifecycle state Warmed:*) only pull the images
+# and are stopped again. The node joins the cluster on the boot that takes it
+# in service, and with a launch lifecycle hook it only counts as launched once
+# its kubelet is up.
+
+SCRIPT_PATH = "/var/lib/cloud/scripts/per-boot/omnispin-node.sh"
+LIFECYCLE_HOOK_NAME = "omnispin-node-ready"
+# Scopes the instances' CompleteLifecycleAction permission to their pool
+POOL_TAG = "omnispin:node-pool"
+
+KUBELET_CONFIG = "/etc/kubernetes/kubelet/kubelet-config.json"
+CONTAINERD_CONFIG = "/etc/eks/containerd/containerd-config.toml"
+# sed address of the CRI plugin's table, the pool's `containerd` settings go below it
+CRI_PLUGIN_PATTERN = r'^\[plugins\."io\.containerd\.grpc\.v1\.cri"\]$'
+
+# kubelet-config.json fields from the pool's `kubelet` section
+KUBELET_FIELDS = {
+    "max_pods": "maxPods",
+    "serialize_image_pulls": "serializeImagePulls",
+    "registry_pull_qps": "registryPullQPS",
+    "registry_burst": "registryBurst",
+}
+
+# Pool keys that need the boot script, i.e. an asg pool
+BOOT_KEYS = ("prepull_images", "warm_pool", "wait_for_ready", "kubelet", "containerd")
+
+
+def uses_boot_script(pool) -> bool:
+    return any(pool.get(key) for key in BOOT_KEYS)
+
+
+# Seconds a launching instance may take to get its kubelet up, None without a
+# lifecycle hook. Warm pools always have one: the instance must finish pulling
+# before it is stopped.
+def ready_timeout(pool):
+    wait_for_ready = pool.get("wait_for_ready") or {}
+    if wait_for_ready or pool.get("warm_pool"):
+        return wait_for_ready.get("timeout_seconds", 600)
+    return None
+
+
+def kubelet_config(pool) -> Dict[str, Any]:
+    kubelet = pool.get("kubelet") or {}
+    unknown = set(kubelet) - set(KUBELET_FIELDS)
+    if unknown:
+        raise ValueError(
+            f"Unknown kubelet settings {sorted(unknown)} in {pool['name']}"
+        )
+    return {
+        KUBELET_FIELDS[key]: value
+        for key, value in kubelet.items()
+        if value is not None
+    }
+
+
+def _pull_commands(images: List[str]) -> List[str]:
+    # A failed pull only costs the warm start, the node still joins. Images a
+    # warm pool instance already pulled are skipped.
+    return [
+        f"ctr --namespace k8s.io images ls -q | grep -qxF {image}"
+        f" || ctr --namespace k8s.io images pull {image} || true"
+        for image in images
+    ]
+
+
+def _containerd_commands(pool) -> List[str]:
+    settings = pool.get("containerd") or {}
+    return [
+        f"grep -q '^{key} = ' {CONTAINERD_CONFIG}"
+        f" || sed -i '/{CRI_PLUGIN_PATTERN}/a {key} = {json.dumps(value)}'"
+        f" {CONTAINERD_CONFIG}"
+        for key, value in settings.items()
+    ]
+
+
+def _kubelet_commands(pool) -> List[str]:
+    config = kubelet_config(pool)
+    if not config:
+        return []
+    return [
+        f"jq '. + {json.dumps(config)}' {KUBELET_CONFIG} > {KUBELET_CONFIG}.omnispin",
+        f"mv {KUBELET_CONFIG}.omnispin {KUBELET_CONFIG}",
+    ]
+
+
+def boot_script(
+    pool, images: List[str], bootstrap_command: str, signal_command: str
+) -> str:
+    lines = [
+        "#!/bin/bash",
+        "set -o xtrace",
+        'TOKEN=$(curl -s -X PUT http://169.254.169.254/latest/api/token -H "X-aws-ec2-metadata-token-ttl-seconds: 300")',
+        'metadata() { curl -s -H "X-aws-ec2-metadata-token: $TOKEN" "http://169.254.169.254/latest/meta-data/$1"; }',
+        "TARGET_STATE=$(metadata autoscaling/target-lifecycle-state)",
+    ]
+    if ready_timeout(pool) is not None:
+        lines += [
+            "complete_launch() {",
+            "  INSTANCE_ID=$(metadata instance-id)",
+            "  REGION=$(metadata placement/region)",
+            "  ASG=$(aws autoscaling describe-auto-scaling-instances --region $REGION"
+            " --instance-ids $INSTANCE_ID"
+            " --query 'AutoScalingInstances[0].AutoScalingGroupName' --output text)",
+            "  aws autoscaling complete-lifecycle-action --region $REGION"
+            ' --auto-scaling-group-name "$ASG"'
+            f" --lifecycle-hook-name {LIFECYCLE_HOOK_NAME}"
+            " --instance-id $INSTANCE_ID --lifecycle-action-result CONTINUE",
+            "}",
+        ]
+    else:
+        lines += ["complete_launch() { :; }"]
+
+    lines += ["systemctl start containerd"]
+    lines += _pull_commands(images)
+    lines += [
+        # Warm pool: images only, the node joins when it's started for a scale-out
+        'if [[ "$TARGET_STATE" == Warmed:* ]]; then',
+        "  complete_launch",
+        "  exit 0",
+        "fi",
+    ]
+    lines += _containerd_commands(pool)
+    lines += _kubelet_commands(pool)
+    lines += [bootstrap_command, signal_command]
+    if ready_timeout(pool) is not None:
+        # kubelet serving and the VPC CNI configured, the node turns Ready next
+        lines += [
+            "until curl -sf http://localhost:10248/healthz"
+            " && ls /etc/cni/net.d/10-aws.conflist; do sleep 5; done",
+        ]
+    lines += ["complete_launch"]
+    return "\n".join(lines)
+
+
+# User data writing the boot script and running it for the first boot, on
+# which cloud-init runs per-boot scripts before user data
+def user_data_commands(script: str) -> List[str]:
+    return [
+        f"mkdir -p $(dirname {SCRIPT_PATH})",
+        f"cat > {SCRIPT_PATH} <<'OMNISPIN_BOOT'\n{script}\nOMNISPIN_BOOT",
+        f"chmod +x {SCRIPT_PATH}",
+        SCRIPT_PATH,
+    ]
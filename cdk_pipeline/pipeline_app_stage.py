@@ -4,9 +4,35 @@ from cdk_pipeline.eks_cluster_deploy import EksStack
 from cdk_pipeline.z2jh_deploy import Z2jhDeployStack
 from cdk_pipeline.r53_lb_record import R53LbRecord
 from cdk_pipeline.td_peering_connection import TDPConStack
+from cdk_pipeline.monitoring_deploy import MonitoringStack
+
+# Each stage declares what it produces and consumes (SSM parameters, Kubernetes
+# objects) so the pipeline can deploy independent stages in the same wave.
+# A stage whose inputs depend on the config derives `consumes` from it with
+# config_consumes. See utils/wave_util.py.
+# fingerprint_config and fingerprint_files are the config sections and files
+# (besides the shared ones) the stage's stacks are built from. The pipeline
+# skips a stage whose inputs didn't change, see utils/fingerprint_util.py.
 
 
 class ClusterDeployStage(cdk.Stage):
+    produces = (
+        "ssm:/omnispin/eks",
+        "ssm:/omnispin/efs",
+        "ssm:/omnispin/hub",
+        "k8s:cluster",
+    )
+    consumes = ()
+    fingerprint_config = ("aws", "eks", "z2jh")
+    fingerprint_files = (
+        "cdk_pipeline/eks_cluster_deploy.py",
+        "cdk_pipeline/cluster_autoscaler.py",
+        "cdk_pipeline/node_bootstrap.py",
+        "cdk_pipeline/z2jh_values.py",
+        "etc/public-efs-driver.yaml",
+        "etc/jhConfig.yaml",
+    )
+
     def __init__(self, scope: Construct, construct_id: str, config, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
@@ -14,6 +40,18 @@ class ClusterDeployStage(cdk.Stage):
 
 
 class Z2jhDeployStage(cdk.Stage):
+    produces = ("k8s:z2jh/service/proxy-public", "k8s:z2jh/secret/hub")
+    consumes = ("ssm:/omnispin/eks", "ssm:/omnispin/hub", "k8s:cluster")
+    fingerprint_config = ("aws", "eks", "z2jh", "monitoring")
+    fingerprint_files = (
+        "cdk_pipeline/z2jh_deploy.py",
+        "cdk_pipeline/z2jh_values.py",
+        "cdk_pipeline/cloudwatch_agent.py",
+        "etc/jhConfig.yaml",
+        # Vendored charts, see z2jh.chart.path
+        "charts",
+    )
+
     def __init__(self, scope: Construct, construct_id: str, config, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
@@ -21,6 +59,16 @@ class Z2jhDeployStage(cdk.Stage):
 
 
 class R53EntryStage(cdk.Stage):
+    produces = ("r53:z2jh",)
+    consumes = ("ssm:/omnispin/eks", "k8s:z2jh/service/proxy-public")
+    # z2jh: the NLB lookup runs again when the Helm values change
+    fingerprint_config = ("aws", "eks", "z2jh", "r53")
+    fingerprint_files = (
+        "cdk_pipeline/r53_lb_record.py",
+        "cdk_pipeline/z2jh_values.py",
+        "etc/jhConfig.yaml",
+    )
+
     def __init__(self, scope: Construct, construct_id: str, config, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
@@ -28,7 +76,37 @@ class R53EntryStage(cdk.Stage):
 
 
 class TDPConStage(cdk.Stage):
+    produces = ("ec2:td-peering",)
+    fingerprint_config = ("aws", "eks", "teradata")
+    fingerprint_files = ("cdk_pipeline/td_peering_connection.py",)
+
+    # The SSM prefix of every peered database, from teradata.databases
+    @staticmethod
+    def config_consumes(config):
+        return ("ssm:/omnispin/eks",) + tuple(
+            f"ssm:{database['ssm_prefix']}"
+            for database in config["teradata"]["databases"]
+            if database["mode"] == "peering"
+        )
+
     def __init__(self, scope: Construct, construct_id: str, config, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        self.consumes = self.config_consumes(config)
         TDPConStack(self, "TDPConStack", config)
+
+
+class MonitoringStage(cdk.Stage):
+    produces = ("cw:monitoring",)
+    # The hub's Secret holds the metrics service token the agent scrapes with
+    consumes = ("ssm:/omnispin/eks", "k8s:cluster", "k8s:z2jh/secret/hub")
+    fingerprint_config = ("aws", "eks", "monitoring")
+    fingerprint_files = (
+        "cdk_pipeline/monitoring_deploy.py",
+        "cdk_pipeline/cloudwatch_agent.py",
+    )
+
+    def __init__(self, scope: Construct, construct_id: str, config, **kwargs) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        MonitoringStack(self, "MonitoringStack", config)
@@ -2,6 +2,10 @@ import aws_cdk as cdk
 from constructs import Construct
 from aws_cdk.pipelines import CodePipelineSource, ShellStep
 from aws_cdk import (
+    aws_codebuild as codebuild,
+    aws_ecr as ecr,
+    aws_iam as iam,
+    aws_s3 as s3,
     pipelines,
 )
 from .pipeline_app_stage import (
@@ -9,9 +13,26 @@ from .pipeline_app_stage import (
     Z2jhDeployStage,
     R53EntryStage,
     TDPConStage,
+    MonitoringStage,
 )
-from utils.stack_util import add_tags_to_stack
-from utils.config_util import add_commit_info_to_config
+from .r53_lb_record import record_name
+from utils.stack_util import add_app_aspects_to_stage, add_tags_to_stack
+from utils.config_util import (
+    add_commit_info_to_config,
+    region_config,
+    region_short_name,
+)
+from utils.fingerprint_util import (
+    FINGERPRINT_PARAMETER_PREFIX,
+    STORED_FINGERPRINTS_ENV,
+    fingerprint_parameter,
+    stage_fingerprints,
+    stored_fingerprints,
+)
+from utils.wave_util import build_waves
+
+# Where the synth step writes the stored stage fingerprints
+STORED_FINGERPRINTS_FILE = "/tmp/stage-fingerprints.json"
 
 
 class CdkZ2jhPipelineStack(cdk.Stack):
@@ -19,11 +40,13 @@ class CdkZ2jhPipelineStack(cdk.Stack):
     This is a Pipeline Stack for Z2JH
     """
 
-    def __init__(self, scope: Construct, construct_id: str, stage, **kwargs) -> None:
+    def __init__(
+        self, scope: Construct, construct_id: str, stage, config=None, **kwargs
+    ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
-        # Initialize config variable and get context from env_config which we set in app.py
-        config = self.node.try_get_context("env_config")
+        # Stage config, or the env_config context set in app.py for a single stage
+        config = config or self.node.try_get_context("env_config")
 
         # Configure Codepipeline source i.e., repo, branch and connection arn
         source_pipeline = CodePipelineSource.connection(
@@ -32,21 +55,26 @@ class CdkZ2jhPipelineStack(cdk.Stack):
             connection_arn=config["git"]["connection_arn"],
         )
 
+        synth_config = config.get("synth", {})
+        synth_image = self.__synth_build_image(synth_config)
+
         # Create self-mutated pipeline construct. pipelines.CodePipeline is a self-mutated pipeline
         # Tags are important part of CI/CD process to identify which git commit is responsible for CFT Deploymnet
         pipeline = pipelines.CodePipeline(
             self,
             "Pipeline",
             pipeline_name="CdkZeroToJupyterHub",
+            cli_version=synth_config.get("cdk_cli_version"),
+            synth_code_build_defaults=self.__synth_code_build_defaults(
+                synth_config, synth_image
+            ),
             synth=ShellStep(
                 "Synth",
                 input=source_pipeline,
-                install_commands=[
-                    "npm install -g aws-cdk",
-                    "python -m pip install --upgrade pip",
-                    "python -m pip install -r requirements.txt",
-                ],
-                commands=[f"ls -lah && cdk synth -c stage={stage} -vvv"],
+                install_commands=self.__synth_install_commands(
+                    synth_config, synth_image
+                ),
+                commands=self.__synth_commands(synth_config, stage),
                 primary_output_directory="cdk.out",
                 env={
                     "GIT_REPO": source_pipeline.source_attribute("FullRepositoryName"),
@@ -59,6 +87,11 @@ class CdkZ2jhPipelineStack(cdk.Stack):
                     "GIT_CONNECTION_ARN": source_pipeline.source_attribute(
                         "ConnectionArn"
                     ),
+                    **(
+                        {STORED_FINGERPRINTS_ENV: STORED_FINGERPRINTS_FILE}
+                        if synth_config.get("skip_unchanged_stages", False)
+                        else {}
+                    ),
                 },
             ),
         )
@@ -66,46 +99,212 @@ class CdkZ2jhPipelineStack(cdk.Stack):
         config = add_commit_info_to_config(config=config)
 
         add_tags_to_stack(self, config)
+
+        # Stages in the same wave have no dependency on each other and deploy in
+        # parallel. Each region in aws.regions gets its own set of stages, wave N
+        # deploys wave N of every region.
+        skip_unchanged = synth_config.get("skip_unchanged_stages", False)
+        stored = stored_fingerprints() if skip_unchanged else {}
+        fingerprints = {}
+        waves = []
+        # (zone, record name) -> region, each region's R53 stack creates its own
+        records = {}
+        regions = [config["aws"]["region"]] + list(config["aws"].get("regions") or {})
+        for region in dict.fromkeys(regions):
+            if region == config["aws"]["region"]:
+                # The home region keeps the original stage ids and stack names
+                regional = config
+                region_stages = self.__deploy_stages(config, "")
+            else:
+                regional = region_config(config, region)
+                region_stages = self.__deploy_stages(
+                    regional, f"-{region_short_name(region)}"
+                )
+
+            record = (regional["r53"]["zone_id"], record_name(regional))
+            if record in records:
+                raise ValueError(
+                    f"{records[record]} and {region} would both create the Route53"
+                    f" record {record[1]} in zone {record[0]}, set r53.record_name"
+                    f" in aws.regions.{region}"
+                )
+            records[record] = region
+
+            region_fingerprints = stage_fingerprints(region_stages)
+            stages = []
+            for stage_class, stage_id, stage_config in region_stages:
+                fingerprint = region_fingerprints[stage_id]
+                if stored.get(fingerprint_parameter(stage_id)) == fingerprint:
+                    # Neither its inputs nor any stage it consumes from changed
+                    # since its last deploy, so what it reads is still current
+                    cdk.Annotations.of(self).add_info(
+                        f"{stage_id}: unchanged since the last deploy, skipped"
+                    )
+                    continue
+                fingerprints[stage_id] = fingerprint
+                stages.append(
+                    stage_class(
+                        self,
+                        stage_id,
+                        env=cdk.Environment(
+                            account=stage_config["aws"]["account"],
+                            region=stage_config["aws"]["region"],
+                        ),
+                        config=stage_config,
+                    )
+                )
+
+            for i, wave_stages in enumerate(build_waves(stages)):
+                if i == len(waves):
+                    waves.append([])
+                waves[i] += wave_stages
+
+        for i, wave_stages in enumerate(waves, start=1):
+            wave = pipeline.add_wave(f"Wave{i}")
+            for stage in wave_stages:
+                add_app_aspects_to_stage(stage)
+                wave.add_stage(
+                    stage,
+                    post=(
+                        [
+                            self.__record_fingerprint_step(
+                                stage.node.id, fingerprints[stage.node.id]
+                            )
+                        ]
+                        if skip_unchanged
+                        else None
+                    ),
+                )
+
+    def __deploy_stages(self, config, suffix: str):
         # We could add If Statement here to only include this stage if cluster doesn't exist
-        eks_cluster = ClusterDeployStage(
-            self,
-            "ClusterDeploy",
-            env=cdk.Environment(
-                account=config["aws"]["account"], region=config["aws"]["region"]
-            ),
-            config=config,
+        stages = [
+            (ClusterDeployStage, "ClusterDeploy" + suffix, config),
+            (Z2jhDeployStage, "Z2jhDeployStage" + suffix, config),
+            (R53EntryStage, "R53EntryStage" + suffix, config),
+            (TDPConStage, "TDPeeringConnectionStage" + suffix, config),
+        ]
+        if (config.get("monitoring") or {}).get("enabled"):
+            stages.append((MonitoringStage, "MonitoringStage" + suffix, config))
+        return stages
+
+    def __fingerprint_parameters_arn(self):
+        return self.format_arn(
+            service="ssm",
+            resource="parameter",
+            resource_name=FINGERPRINT_PARAMETER_PREFIX.lstrip("/") + "/*",
         )
-        pipeline.add_stage(eks_cluster)
-
-        pipeline.add_stage(
-            Z2jhDeployStage(
-                self,
-                "Z2jhDeployStage",
-                env=cdk.Environment(
-                    account=config["aws"]["account"], region=config["aws"]["region"]
-                ),
-                config=config,
-            )
+
+    def __record_fingerprint_step(self, stage_id: str, fingerprint: str):
+        # Runs after the stage's stacks deployed successfully
+        return pipelines.CodeBuildStep(
+            f"{stage_id}Fingerprint",
+            commands=[
+                f"aws ssm put-parameter --name {fingerprint_parameter(stage_id)}"
+                f" --value {fingerprint} --type String --overwrite"
+            ],
+            role_policy_statements=[
+                iam.PolicyStatement(
+                    actions=["ssm:PutParameter"],
+                    resources=[self.__fingerprint_parameters_arn()],
+                )
+            ],
         )
 
-        pipeline.add_stage(
-            R53EntryStage(
-                self,
-                "R53EntryStage",
-                env=cdk.Environment(
-                    account=config["aws"]["account"], region=config["aws"]["region"]
-                ),
-                config=config,
+    def __synth_commands(self, synth_config, stage):
+        commands = ["date +%s > /tmp/synth-start"]
+        if synth_config.get("skip_unchanged_stages", False):
+            # Fingerprints of the last successful deploys; without them every stage deploys
+            commands.append(
+                f"aws ssm get-parameters-by-path --path {FINGERPRINT_PARAMETER_PREFIX}"
+                ' --query "Parameters[].{Name: Name, Value: Value}" --output json'
+                f" > {STORED_FINGERPRINTS_FILE}"
+                f' || echo "[]" > {STORED_FINGERPRINTS_FILE}'
             )
-        )
+        commands += [
+            f"ls -lah && cdk synth -c stage={stage} -vvv",
+            'echo "Synth took $(( $(date +%s) - $(cat /tmp/synth-start) ))s"',
+        ]
+        return commands
+
+    def __synth_install_commands(self, synth_config, synth_image):
+        # A prebuilt image already has the CLI and requirements; pip only verifies them
+        commands = ["date +%s > /tmp/synth-install-start"]
+        if synth_image is None:
+            cli_version = synth_config.get("cdk_cli_version")
+            cli_package = f"aws-cdk@{cli_version}" if cli_version else "aws-cdk"
+            commands += [
+                f"npm install -g {cli_package} --prefer-offline",
+                "python -m pip install --upgrade pip",
+            ]
+        commands += [
+            "python -m pip install -r requirements.txt",
+            'echo "Synth install took $(( $(date +%s) - $(cat /tmp/synth-install-start) ))s"',
+        ]
+        return commands
 
-        pipeline.add_stage(
-            TDPConStage(
-                self,
-                "TDPeeringConnectionStage",
-                env=cdk.Environment(
-                    account=config["aws"]["account"], region=config["aws"]["region"]
+    def __synth_build_image(self, synth_config):
+        image_config = synth_config.get("build_image", {})
+        tag = image_config.get("tag") or "latest"
+        if image_config.get("ecr_repository"):
+            repository = ecr.Repository.from_repository_name(
+                self, "SynthImageRepository", image_config["ecr_repository"]
+            )
+            return codebuild.LinuxBuildImage.from_ecr_repository(repository, tag)
+        if image_config.get("registry"):
+            return codebuild.LinuxBuildImage.from_docker_registry(
+                f"{image_config['registry']}:{tag}"
+            )
+        return None
+
+    def __synth_code_build_defaults(self, synth_config, synth_image):
+        cache_config = synth_config.get("cache", {})
+        cache_type = cache_config.get("type", "none")
+        if cache_type == "local":
+            cache = codebuild.Cache.local(codebuild.LocalCacheMode.CUSTOM)
+        elif cache_type == "s3":
+            if not cache_config.get("bucket"):
+                raise ValueError("synth.cache.bucket is required for an s3 cache")
+            cache = codebuild.Cache.bucket(
+                s3.Bucket.from_bucket_name(
+                    self, "SynthCacheBucket", cache_config["bucket"]
                 ),
-                config=config,
+                prefix=cache_config.get("prefix"),
             )
+        else:
+            cache = None
+
+        return pipelines.CodeBuildOptions(
+            cache=cache,
+            # Paths CodeBuild saves to and restores from the cache
+            partial_build_spec=(
+                codebuild.BuildSpec.from_object(
+                    {"cache": {"paths": ["/root/.npm/**/*", "/root/.cache/pip/**/*"]}}
+                )
+                if cache
+                else None
+            ),
+            build_environment=(
+                codebuild.BuildEnvironment(build_image=synth_image)
+                if synth_image
+                else None
+            ),
+            # Reads the stage fingerprints stored by __record_fingerprint_step
+            role_policy=(
+                [
+                    iam.PolicyStatement(
+                        actions=["ssm:GetParametersByPath"],
+                        resources=[
+                            self.format_arn(
+                                service="ssm",
+                                resource="parameter",
+                                resource_name=FINGERPRINT_PARAMETER_PREFIX.lstrip("/"),
+                            ),
+                            self.__fingerprint_parameters_arn(),
+                        ],
+                    )
+                ]
+                if synth_config.get("skip_unchanged_stages", False)
+                else None
+            ),
         )
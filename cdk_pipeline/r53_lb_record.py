@@ -1,21 +1,50 @@
+import hashlib
+import json
+
+import jsii
 from aws_cdk import (
     aws_route53 as route53,
     aws_eks as eks,
+    custom_resources as cr,
 )
 from constructs import Construct
 import aws_cdk as cdk
-from cdk_pipeline.cluster_props import ClusterProps
+from cdk_pipeline.cluster_props import ClusterProps, proxy_load_balancer_name
+from cdk_pipeline.z2jh_values import load_balancer_values
 from utils.stack_util import add_tags_to_stack
+from utils.yaml_util import load_document
+
+
+# Name of the record R53LbRecord creates in r53.zone_id
+def record_name(config) -> str:
+    return config["r53"].get("record_name", "z2jh")
+
+
+# Alias target of a load balancer known only by its DNS name and hosted zone
+# at deploy time, route53_targets.LoadBalancerTarget needs the construct
+@jsii.implements(route53.IAliasRecordTarget)
+class LoadBalancerAlias:
+    def __init__(self, dns_name: str, hosted_zone_id: str) -> None:
+        self.dns_name = dns_name
+        self.hosted_zone_id = hosted_zone_id
+
+    def bind(self, record, zone=None) -> route53.AliasRecordTargetConfig:
+        return route53.AliasRecordTargetConfig(
+            dns_name=f"dualstack.{self.dns_name}",
+            hosted_zone_id=self.hosted_zone_id,
+        )
 
 
 class R53LbRecord(cdk.Stack):
     """
     Create a z2jh.spt-dev.data-lab.io or z2jh.spt.data-lab.io
-    It will be an A record and of Alias Type. Region is us-west-2
-    Alias to Classic Load Balancer e.g.
+    Classic Load Balancer (eks.load_balancer.type classic), a CNAME e.g.
     dualstack.a9a62625b0b23443eb498f169df86569-2132870744.us-west-2.elb.amazonaws.com
     1. Get Loadbalancer address via k8s serviceName: proxy-public available in z2jh nameSpace
     2. Pass that lb name to r53 for record creation
+    NLB (type nlb), an A record of Alias Type
+    1. Look up the NLB the load balancer controller named, no kubectl
+    2. Alias the record to it
     """
 
     def __init__(self, scope: Construct, construct_id: str, config, **kwargs) -> None:
@@ -25,15 +54,22 @@ class R53LbRecord(cdk.Stack):
 
         add_tags_to_stack(self, config)
 
-        self.cluster_props = ClusterProps(self, "cluster_props")
+        self.config = config
+        self.cluster_props = ClusterProps.of(self, config)
 
-        self.__z2jh_service_address()
-        self.__route53_record()
+        if config["eks"]["load_balancer"]["type"] == "nlb":
+            self.__network_load_balancer()
+            self.__route53_alias_record()
+        else:
+            self.__z2jh_service_address()
+            self.__route53_record()
 
     def __z2jh_service_address(self):
+        # Not "LoadBalancerAttribute": that one used the kubectl provider of the
+        # cluster imported under cluster_props, a new id replaces it
         self.z2jh_service_address = eks.KubernetesObjectValue(
             self,
-            "LoadBalancerAttribute",
+            "ProxyPublicHostname",
             cluster=self.cluster_props.cluster,
             object_type="service",
             object_name=self.cluster_props.service_name,
@@ -45,7 +81,64 @@ class R53LbRecord(cdk.Stack):
         route53.CnameRecord(
             self,
             "CnameZ2jhRecord",
-            record_name="z2jh",
+            record_name=record_name(self.config),
             zone=self.cluster_props.zone,
             domain_name=self.z2jh_service_address.value,
         )
+
+    def __network_load_balancer(self):
+        # One ELB API call instead of importing the cluster and polling the
+        # service. The hub's Helm release waited for the NLB to be provisioned.
+        name = proxy_load_balancer_name(self.config)
+        # The call only runs again when it changes. A new physical id whenever
+        # the service annotations or the Helm values do looks the NLB up again,
+        # it may have been replaced.
+        release = json.dumps(
+            [
+                load_balancer_values(self.config),
+                self.config["z2jh"],
+                load_document("./etc/jhConfig.yaml"),
+            ],
+            sort_keys=True,
+            default=str,
+        )
+        release_hash = hashlib.sha256(release.encode()).hexdigest()[:16]
+        describe = cr.AwsSdkCall(
+            service="ELBv2",
+            action="describeLoadBalancers",
+            parameters={"Names": [name]},
+            physical_resource_id=cr.PhysicalResourceId.of(f"{name}-{release_hash}"),
+            output_paths=[
+                "LoadBalancers.0.DNSName",
+                "LoadBalancers.0.CanonicalHostedZoneId",
+            ],
+        )
+        self.z2jh_load_balancer = cr.AwsCustomResource(
+            self,
+            "LoadBalancerLookup",
+            on_create=describe,
+            on_update=describe,
+            policy=cr.AwsCustomResourcePolicy.from_sdk_calls(
+                resources=cr.AwsCustomResourcePolicy.ANY_RESOURCE
+            ),
+            # The SDK in the Lambda runtime has ELBv2, skip the npm install
+            install_latest_aws_sdk=False,
+        )
+
+    def __route53_alias_record(self):
+        route53.ARecord(
+            self,
+            "AliasZ2jhRecord",
+            record_name=record_name(self.config),
+            zone=self.cluster_props.zone,
+            target=route53.RecordTarget.from_alias(
+                LoadBalancerAlias(
+                    self.z2jh_load_balancer.get_response_field(
+                        "LoadBalancers.0.DNSName"
+                    ),
+                    self.z2jh_load_balancer.get_response_field(
+                        "LoadBalancers.0.CanonicalHostedZoneId"
+                    ),
+                )
+            ),
+        )
@@ -1,4 +1,4 @@
-from aws_cdk import aws_ec2 as ec2
+from aws_cdk import aws_ec2 as ec2, aws_ssm as ssm, Fn
 from constructs import Construct
 import aws_cdk as cdk
 from .cluster_props import ClusterProps
@@ -7,14 +7,19 @@ from utils.stack_util import add_tags_to_stack
 
 class TDPConStack(cdk.Stack):
     """
-    Setup VPC Peering between Vantage existing VPC and K8s VPC
+    Connect the K8s VPC to the Vantage databases in `teradata.databases`
+    Peering mode, per database:
     1. Get required resource IDs via SSM and its done in `cluster_props.py`
         - VPC
         - CIDR
         - Routing Table IDs
         - Peering Conection Id
     2. Create Peering connections between VPCs
-    3. Setup Routes EKS to TD and vice-versa.
+    3. Setup Routes EKS to TD and vice-versa, for every private route table.
+    PrivateLink mode, per database:
+    1. Interface endpoint of the database's endpoint service in every private
+       subnet of the K8s VPC
+    2. Publish its DNS name via SSM
     """
 
     def __init__(self, scope: Construct, construct_id: str, config, **kwargs) -> None:
@@ -24,40 +29,83 @@ class TDPConStack(cdk.Stack):
 
         add_tags_to_stack(self, config)
 
-        self.cluster_props = ClusterProps(self, "cluster_props")
+        self.cluster_props = ClusterProps.of(self, config)
 
-        self.__peering_connection()
-        self.__routes_td()
-        self.__routes_eks()
+        databases = config["teradata"]["databases"]
+        # As the construct ids spell them, the route ids title-case the name
+        names = [database["name"].title() for database in databases]
+        if len(set(names)) != len(names):
+            raise ValueError(
+                "teradata.databases names must be unique ignoring case:"
+                f" {[database['name'] for database in databases]}"
+            )
+
+        for database in databases:
+            if database["mode"] == "peering":
+                peering_connection = self.__peering_connection(database)
+                self.__routes_td(database, peering_connection)
+                self.__routes_eks(database, peering_connection)
+            elif database["mode"] == "privatelink":
+                self.__interface_endpoint(database)
+            else:
+                raise ValueError(
+                    f"Unknown teradata mode {database['mode']} for {database['name']}"
+                )
 
-    def __peering_connection(self):
-        self.peering_connection = ec2.CfnVPCPeeringConnection(
+    # Construct ids as the single database stack named them (name TD), so its
+    # peering connection and routes aren't replaced
+    def __peering_connection(self, database):
+        return ec2.CfnVPCPeeringConnection(
             self,
-            "Z2jhTDVPCPeeringConnection",
-            peer_vpc_id=self.cluster_props.td_vpc,
+            f"Z2jh{database['name']}VPCPeeringConnection",
+            peer_vpc_id=self.cluster_props.td_vpc(database),
             vpc_id=self.cluster_props.eks_vpc,
         )
 
-    def __routes_td(self):
-        routes = [1, 2, 3]
-        for route in routes:
+    def __routes_td(self, database, peering_connection):
+        route_tables = self.cluster_props.td_private_routetables(database)
+        for route, route_table in enumerate(route_tables, start=1):
 
             ec2.CfnRoute(
                 self,
-                f"TdToEks{route}",
-                route_table_id=eval(f"self.cluster_props.td_private_routetable{route}"),
+                f"{database['name'].title()}ToEks{route}",
+                route_table_id=route_table,
                 destination_cidr_block=self.cluster_props.eks_vpc_cidr,
-                vpc_peering_connection_id=self.peering_connection.attr_id,
+                vpc_peering_connection_id=peering_connection.attr_id,
             )
 
-    def __routes_eks(self):
-        routes = [1, 2, 3]
-        for route in routes:
+    def __routes_eks(self, database, peering_connection):
+        route_tables = self.cluster_props.eks_private_routetables
+        for route, route_table in enumerate(route_tables, start=1):
 
             ec2.CfnRoute(
                 self,
-                f"EksToTd{route}",
-                route_table_id=eval(f"self.cluster_props.eks_private_routetable{route}"),
-                destination_cidr_block=self.cluster_props.td_vpc_cidr,
-                vpc_peering_connection_id=self.peering_connection.attr_id,
+                f"EksTo{database['name'].title()}{route}",
+                route_table_id=route_table,
+                destination_cidr_block=self.cluster_props.td_vpc_cidr(database),
+                vpc_peering_connection_id=peering_connection.attr_id,
             )
+
+    def __interface_endpoint(self, database):
+        name = database["name"]
+        # One network interface per private subnet, i.e. per AZ of the cluster,
+        # reachable from the whole cluster VPC on the database port
+        endpoint = ec2.InterfaceVpcEndpoint(
+            self,
+            f"{name}Endpoint",
+            vpc=self.cluster_props.vpc,
+            service=ec2.InterfaceVpcEndpointService(
+                database["service_name"], database.get("port", 1025)
+            ),
+            private_dns_enabled=database.get("private_dns", False),
+        )
+
+        # DNS entries are "<hosted zone id>:<dns name>", the first is regional
+        ssm.StringParameter(
+            self,
+            f"{name}EndpointParameter",
+            parameter_name=f"/omnispin/teradata/{name}/endpoint",
+            string_value=Fn.select(
+                1, Fn.split(":", Fn.select(0, endpoint.vpc_endpoint_dns_entries))
+            ),
+        )
@@ -1,11 +1,35 @@
-import json
-import yaml
-from aws_cdk import aws_eks as eks, aws_ssm as ssm
+import hashlib
+import os
+import tarfile
+import tempfile
+
+from aws_cdk import aws_s3_assets as s3_assets
 from constructs import Construct
 import aws_cdk as cdk
+from cdk_pipeline.cluster_props import ClusterProps, HUB_DB_PASSWORD_SECRET
+from cdk_pipeline.z2jh_values import helm_values
 from utils.stack_util import add_tags_to_stack
 
 
+# Directory of a vendored chart. A .tgz from `helm pull` is unpacked first, the
+# kubectl Lambda only installs chart assets that are directories (zip assets).
+def chart_directory(path: str) -> str:
+    if os.path.isdir(path):
+        return path
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:16]
+    target = os.path.join(tempfile.gettempdir(), "omnispin-charts", digest)
+    if not os.path.isdir(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        staging = tempfile.mkdtemp(dir=os.path.dirname(target))
+        with tarfile.open(path) as tar:
+            tar.extractall(staging, filter="data")
+        os.replace(staging, target)
+    # helm pull packs the chart in a directory named after it
+    (chart,) = os.listdir(target)
+    return os.path.join(target, chart)
+
+
 class Z2jhDeployStack(cdk.Stack):
     """
     Pipeline Stack
@@ -15,6 +39,7 @@ class Z2jhDeployStack(cdk.Stack):
         super().__init__(scope, construct_id, **kwargs)
 
         # config = self.node.try_get_context("env_config")
+        self.config = config
 
         add_tags_to_stack(self, config)
 
@@ -23,45 +48,45 @@ class Z2jhDeployStack(cdk.Stack):
 
     def __cluster_init(self):
         # Cluster
-        self.cluster_name = ssm.StringParameter.value_for_string_parameter(
-            self, "/omnispin/eks/cluster/name"
-        )
+        self.cluster = ClusterProps.of(self, self.config).cluster
 
-        self.kubectl_role = ssm.StringParameter.value_for_string_parameter(
-            self, "/omnispin/eks/kubectl/role"
-        )
-
-        self.oidc_arn = ssm.StringParameter.value_for_string_parameter(
-            self, "/omnispin/eks/oidc/arn"
-        )
-
-        self.provider = eks.OpenIdConnectProvider.from_open_id_connect_provider_arn(
-            self, "oidc_provider", self.oidc_arn
-        )
-
-        self.cluster = eks.Cluster.from_cluster_attributes(
-            self,
-            "z2jh",
-            cluster_name=self.cluster_name,
-            kubectl_role_arn=self.kubectl_role,
-            open_id_connect_provider=self.provider,
-        )
+    def __hub_database(self):
+        hub_db = self.config["z2jh"].get("hub_db") or {}
+        if hub_db.get("type") != "postgres":
+            return None
+        props = ClusterProps.of(self, self.config)
+        return {
+            "endpoint": props.hub_db_endpoint,
+            "role_arn": props.hub_db_role,
+            "secret_name": HUB_DB_PASSWORD_SECRET,
+            "region": self.region,
+        }
 
     def __install_z2jh_with_helm(self):
-        with open("./etc/jhConfig.yaml", "r") as file:
-            configuration = yaml.safe_load(file)
-
-        with open("./etc/jhConfig.json", "w") as json_file:
-            json.dump(configuration, json_file)
-
-        jupyter_config = json.load(open("./etc/jhConfig.json"))
+        jupyter_config = helm_values(self.config, self.__hub_database())
+        chart_config = self.config["z2jh"]["chart"]
+        if chart_config.get("path"):
+            # Vendored chart shipped as an asset, no download from the chart repo on deploy
+            chart = {
+                "chart_asset": s3_assets.Asset(
+                    self,
+                    "JupyterHubChart",
+                    path=chart_directory(chart_config["path"]),
+                )
+            }
+        else:
+            chart = {
+                "chart": chart_config["name"],
+                "repository": chart_config["repository"],
+                "version": chart_config["version"],
+            }
+        timeout_minutes = chart_config.get("timeout_minutes")
         # Add and Apply Helm Chart
         self.cluster.add_helm_chart(
             "JupyterHub",
-            chart="jupyterhub",
-            repository="https://jupyterhub.github.io/helm-chart/",
             namespace="z2jh",
-            version="2.0.0",
             values=jupyter_config,
-            wait=True,
+            wait=chart_config["wait"],
+            timeout=cdk.Duration.minutes(timeout_minutes) if timeout_minutes else None,
+            **chart,
         )
@@ -0,0 +1,507 @@
+from typing import Any, Dict, List, Tuple
+import json
+from utils.yaml_util import load_document
+from cdk_pipeline import cloudwatch_agent
+from cdk_pipeline.cluster_props import proxy_load_balancer_name
+
+# Helm values for the Z2JH chart built from the `z2jh` section of stage config.
+# Each function returns only the keys the config sets, so an unset option keeps
+# whatever etc/jhConfig.yaml or the chart defaults say. `helm_values` merges
+# them over etc/jhConfig.yaml.
+
+
+# StorageClasses EksStack creates, ebs-gp3 for sqlite-ebs hub databases and EBS homes
+EFS_STORAGE_CLASS = "efs-sc"
+EBS_STORAGE_CLASS = "ebs-gp3"
+
+# Home claims per storage type. EBS homes get claims of their own, a user's
+# existing EFS claim would otherwise be reused whatever the storage class.
+HOME_STORAGE_CLASSES = {"efs": EFS_STORAGE_CLASS, "ebs": EBS_STORAGE_CLASS}
+HOME_PVC_NAME_TEMPLATES = {
+    "efs": "claim-{username}{servername}",
+    "ebs": "claim-ebs-{username}{servername}",
+}
+
+# Claim EksStack binds to the datasets access point, in the hub's namespace
+DATASETS_CLAIM = "datasets"
+
+# sqlite-ebs hub database claim EksStack creates. The chart's own claim,
+# hub-db-dir, can't move to another StorageClass once it exists.
+HUB_DB_EBS_CLAIM = "hub-db-ebs"
+HUB_DB_EBS_MOUNT_PATH = "/srv/jupyterhub/ebs"
+
+# Writes the hub database password from Secrets Manager into a pgpass file
+HUB_DB_PASSWORD_IMAGE = "public.ecr.aws/aws-cli/aws-cli:2.9.23"
+
+
+# etc/jhConfig.yaml with the per-stage overrides of the z2jh config section.
+# `database` is the postgres hub database EksStack published, see hub_db_values.
+def helm_values(config, database=None) -> Dict[str, Any]:
+    values = load_document("./etc/jhConfig.yaml")
+    z2jh_config = config.get("z2jh") or {}
+    for override in (
+        scheduling_values(z2jh_config),
+        pre_puller_values(z2jh_config),
+        home_values(z2jh_config),
+        profile_values(z2jh_config),
+        cull_values(z2jh_config),
+        hub_db_values(z2jh_config, database),
+        load_balancer_values(config),
+    ):
+        values = merge_values(values, override)
+    # Adds to the hub's NetworkPolicy rules, merge_values would replace them
+    values = merge_values(
+        values, monitoring_values(config.get("monitoring") or {}, values)
+    )
+    return values
+
+
+# Deep merge `override` into `base`. Dicts merge, anything else is replaced.
+def merge_values(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_values(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def scheduling_values(z2jh_config) -> Dict[str, Any]:
+    scheduling_config = z2jh_config.get("scheduling") or {}
+    scheduling = {}
+
+    placeholder = scheduling_config.get("user_placeholder")
+    if placeholder is not None:
+        scheduling["userPlaceholder"] = {
+            "enabled": placeholder.get("enabled", True),
+            "replicas": placeholder.get("replicas", 0),
+        }
+        if placeholder.get("resources"):
+            scheduling["userPlaceholder"]["resources"] = placeholder["resources"]
+
+    if scheduling_config.get("user_scheduler") is not None:
+        scheduling["userScheduler"] = {
+            "enabled": scheduling_config["user_scheduler"].get("enabled", True)
+        }
+
+    pod_priority = scheduling_config.get("pod_priority")
+    if pod_priority is not None:
+        scheduling["podPriority"] = {"enabled": pod_priority.get("enabled", True)}
+    elif placeholder is not None and placeholder.get("replicas", 0) > 0:
+        # Placeholders only give way to real users when they have a lower priority
+        scheduling["podPriority"] = {"enabled": True}
+
+    # require | prefer | ignore, matches the node-purpose label of eks.node_pools
+    match_node_purpose = scheduling_config.get("match_node_purpose") or {}
+    for pods, key in (("core", "corePods"), ("user", "userPods")):
+        if match_node_purpose.get(pods):
+            scheduling[key] = {
+                "nodeAffinity": {"matchNodePurpose": match_node_purpose[pods]}
+            }
+
+    return {"scheduling": scheduling} if scheduling else {}
+
+
+# Image name and tag, latest when untagged. Only the last path segment holds
+# the tag, a registry may have a port (registry:5000/team/lab).
+def split_image(image: str) -> Tuple[str, str]:
+    if ":" not in image.rsplit("/", 1)[-1]:
+        return image, "latest"
+    name, tag = image.rsplit(":", 1)
+    return name, tag
+
+
+def pre_puller_values(z2jh_config) -> Dict[str, Any]:
+    pre_puller_config = z2jh_config.get("pre_puller") or {}
+    pre_puller = {}
+
+    # hook: pulls on every helm upgrade, before the hub restarts.
+    # continuous: a DaemonSet pulls on each node as soon as it joins.
+    for key in ("hook", "continuous"):
+        if pre_puller_config.get(key) is not None:
+            pre_puller[key] = {"enabled": pre_puller_config[key]}
+    if pre_puller_config.get("pull_profile_list_images") is not None:
+        pre_puller["pullProfileListImages"] = pre_puller_config[
+            "pull_profile_list_images"
+        ]
+    # name: image[:tag] of any other image notebooks need
+    for name, image in (pre_puller_config.get("extra_images") or {}).items():
+        image_name, tag = split_image(image)
+        pre_puller.setdefault("extraImages", {})[name] = {
+            "name": image_name,
+            "tag": tag,
+        }
+
+    return {"prePuller": pre_puller} if pre_puller else {}
+
+
+# Tolerations the chart gives user pods, a profile's tolerations replace them
+USER_POD_TOLERATIONS = [
+    {
+        "key": key,
+        "operator": "Equal",
+        "value": "user",
+        "effect": "NoSchedule",
+    }
+    for key in ("hub.jupyter.org/dedicated", "hub.jupyter.org_dedicated")
+]
+
+
+def _home_storage(z2jh_config, storage: str) -> Dict[str, Any]:
+    if storage not in HOME_STORAGE_CLASSES:
+        raise ValueError(f"Unknown home storage {storage}, expected efs or ebs")
+    home = {
+        "storage_class": HOME_STORAGE_CLASSES[storage],
+        "pvc_name_template": HOME_PVC_NAME_TEMPLATES[storage],
+    }
+    # EFS claims are sized nominally, an EBS volume is as large as its claim
+    if storage == "ebs":
+        home["storage_capacity"] = z2jh_config["home"]["ebs_capacity"]
+    return home
+
+
+# Home storage of every user pod and the shared datasets mount
+def home_values(z2jh_config) -> Dict[str, Any]:
+    home_config = z2jh_config.get("home") or {}
+    datasets_config = z2jh_config.get("datasets") or {}
+    storage = {}
+    if home_config.get("storage", "efs") != "efs":
+        home = _home_storage(z2jh_config, home_config["storage"])
+        storage["dynamic"] = {
+            "storageClass": home["storage_class"],
+            "pvcNameTemplate": home["pvc_name_template"],
+        }
+        storage["capacity"] = home["storage_capacity"]
+    if datasets_config.get("enabled"):
+        storage["extraVolumes"] = [
+            {
+                "name": "datasets",
+                "persistentVolumeClaim": {
+                    "claimName": DATASETS_CLAIM,
+                    "readOnly": True,
+                },
+            }
+        ]
+        storage["extraVolumeMounts"] = [
+            {
+                "name": "datasets",
+                "mountPath": datasets_config["mount_path"],
+                "readOnly": True,
+            }
+        ]
+    if not storage:
+        return {}
+    return {"singleuser": {"storage": storage}}
+
+
+# Whether any user's home is an EBS volume, which stays in one AZ
+def uses_ebs_homes(z2jh_config) -> bool:
+    storages = [(z2jh_config.get("home") or {}).get("storage")]
+    storages += [profile.get("home") for profile in z2jh_config.get("profiles") or []]
+    return "ebs" in storages
+
+
+# Whether EksStack needs the EBS CSI driver and the ebs-gp3 StorageClass
+def uses_ebs(z2jh_config) -> bool:
+    if (z2jh_config.get("hub_db") or {}).get("type") == "sqlite-ebs":
+        return True
+    return uses_ebs_homes(z2jh_config)
+
+
+# Profiles users pick from on spawn, each a resource tier with its own image
+# and placement. Unset keys keep the singleuser settings.
+def profile_values(z2jh_config) -> Dict[str, Any]:
+    profiles = z2jh_config.get("profiles") or []
+    if not profiles:
+        return {}
+    if sum(1 for profile in profiles if profile.get("default")) > 1:
+        raise ValueError("Only one of z2jh.profiles can be the default")
+
+    profile_list = []
+    for profile in profiles:
+        override = {}
+        for resource, key in (("cpu", "cpu"), ("memory", "mem")):
+            for bound in ("guarantee", "limit"):
+                value = (profile.get(resource) or {}).get(bound)
+                if value is not None:
+                    override[f"{key}_{bound}"] = value
+        if profile.get("image"):
+            override["image"] = profile["image"]
+        if profile.get("node_selector"):
+            override["node_selector"] = dict(profile["node_selector"])
+        # Only a profile whose home differs from z2jh.home needs the override
+        home_storage = (z2jh_config.get("home") or {}).get("storage", "efs")
+        if profile.get("home") and profile["home"] != home_storage:
+            override.update(_home_storage(z2jh_config, profile["home"]))
+        if profile.get("tolerations"):
+            override["tolerations"] = USER_POD_TOLERATIONS + [
+                {"operator": "Equal", "effect": "NoSchedule", **toleration}
+                for toleration in profile["tolerations"]
+            ]
+
+        entry = {
+            "display_name": profile.get("display_name") or profile["name"],
+            "slug": profile["name"],
+        }
+        if profile.get("description"):
+            entry["description"] = profile["description"]
+        if profile.get("default"):
+            entry["default"] = True
+        if override:
+            entry["kubespawner_override"] = override
+        profile_list.append(entry)
+
+    return {"singleuser": {"profileList": profile_list}}
+
+
+# Where jupyter-server picks up the kernel culling settings on the user pods
+KERNEL_CULLING_CONFIG = "/etc/jupyter/jupyter_server_config.d/omnispin-culling.json"
+
+CULL_KEYS = {
+    "timeout": "timeout",
+    "every": "every",
+    "concurrency": "concurrency",
+    "max_age": "maxAge",
+    "users": "users",
+}
+
+
+# hub.extraConfig passing user_timeouts to the user's server on spawn
+USER_TIMEOUTS_CONFIG = """\
+# Per-user idle timeouts from z2jh.cull.user_timeouts
+cull_user_timeouts = {user_timeouts}
+cull_flags = (
+    "--ServerApp.shutdown_no_activity_timeout=",
+    "--MappingKernelManager.cull_idle_timeout=",
+)
+
+
+def cull_user_timeout(spawner):
+    timeout = cull_user_timeouts.get(spawner.user.name)
+    if timeout:
+        # The spawner is reused for the user's next spawn, drop the last flags
+        args = [arg for arg in spawner.args if not arg.startswith(cull_flags)]
+        spawner.args = args + [
+            f"--ServerApp.shutdown_no_activity_timeout={{timeout}}",
+            f"--MappingKernelManager.cull_idle_timeout={{timeout}}",
+        ]
+
+
+c.KubeSpawner.pre_spawn_hook = cull_user_timeout
+"""
+
+
+# Servers: the chart's idle culler stops servers idle for `timeout` seconds, or
+# older than `max_age`. Kernels: jupyter-server shuts down kernels idle inside
+# running servers, so their memory is freed while the server stays up.
+# user_timeouts: shorter idle timeouts for some users, applied by their own
+# server (shutdown_no_activity_timeout) and kernel culling. The idle culler's
+# `timeout` still bounds everybody.
+def cull_values(z2jh_config) -> Dict[str, Any]:
+    cull_config = z2jh_config.get("cull") or {}
+    values = {}
+
+    cull = {
+        key: cull_config[option]
+        for option, key in CULL_KEYS.items()
+        if cull_config.get(option) is not None
+    }
+    if cull:
+        values["cull"] = cull
+
+    kernels = cull_config.get("kernels") or {}
+    if kernels.get("enabled"):
+        values["singleuser"] = {
+            "extraFiles": {
+                "kernel-culling": {
+                    "mountPath": KERNEL_CULLING_CONFIG,
+                    "data": {
+                        "MappingKernelManager": {
+                            "cull_idle_timeout": kernels["idle_timeout"],
+                            "cull_interval": kernels["interval"],
+                            "cull_connected": kernels.get("connected", False),
+                            "cull_busy": kernels.get("busy", False),
+                        }
+                    },
+                }
+            }
+        }
+
+    user_timeouts = {
+        str(user): int(timeout)
+        for user, timeout in (cull_config.get("user_timeouts") or {}).items()
+    }
+    if user_timeouts:
+        values["hub"] = {
+            "extraConfig": {
+                "omnispin-cull-user-timeouts": USER_TIMEOUTS_CONFIG.format(
+                    user_timeouts=json.dumps(user_timeouts, sort_keys=True)
+                )
+            }
+        }
+
+    return values
+
+
+# sqlite-efs: SQLite on the efs-sc PVC of etc/jhConfig.yaml
+# sqlite-ebs: SQLite on a gp3 EBS volume
+# postgres: the RDS instance EksStack creates. `database` holds its endpoint,
+# the IRSA role allowed to read its password secret, the secret name and region.
+def hub_db_values(z2jh_config, database=None) -> Dict[str, Any]:
+    hub_db = z2jh_config.get("hub_db") or {}
+    db_type = hub_db.get("type", "sqlite-efs")
+
+    if db_type == "sqlite-efs":
+        return {}
+    if db_type == "sqlite-ebs":
+        # SQLite on a claim of our own, the chart then creates no hub-db-dir
+        return {
+            "hub": {
+                "db": {
+                    "type": "other",
+                    "url": f"sqlite:///{HUB_DB_EBS_MOUNT_PATH}/jupyterhub.sqlite",
+                },
+                "extraVolumes": [
+                    {
+                        "name": HUB_DB_EBS_CLAIM,
+                        "persistentVolumeClaim": {"claimName": HUB_DB_EBS_CLAIM},
+                    }
+                ],
+                "extraVolumeMounts": [
+                    {"name": HUB_DB_EBS_CLAIM, "mountPath": HUB_DB_EBS_MOUNT_PATH}
+                ],
+            }
+        }
+    if db_type != "postgres":
+        raise ValueError(
+            f"Unknown z2jh.hub_db.type {db_type},"
+            " expected sqlite-efs, sqlite-ebs or postgres"
+        )
+    if database is None:
+        # Only the stack deploying the chart resolves the database
+        return {}
+
+    postgres = hub_db.get("postgres") or {}
+    database_name = postgres.get("database_name", "jupyterhub")
+    username = postgres.get("username", "jupyterhub")
+    # The password never goes into the chart values: the init container reads it
+    # with the hub's IRSA role and libpq picks it up from PGPASSFILE
+    write_pgpass = (
+        "aws secretsmanager get-secret-value"
+        f' --secret-id "{database["secret_name"]}"'
+        " --query SecretString --output text"
+        " | sed 's/^/*:*:*:*:/' > /pgpass/pgpass && chmod 600 /pgpass/pgpass"
+    )
+    return {
+        "hub": {
+            "db": {
+                "type": "postgres",
+                "url": f"postgresql+psycopg2://{username}@{database['endpoint']}/{database_name}",
+            },
+            "serviceAccount": {
+                "annotations": {"eks.amazonaws.com/role-arn": database["role_arn"]}
+            },
+            "initContainers": [
+                {
+                    "name": "pgpass",
+                    "image": postgres.get("password_image", HUB_DB_PASSWORD_IMAGE),
+                    "command": ["sh", "-c", write_pgpass],
+                    "env": [
+                        {"name": "AWS_REGION", "value": database["region"]},
+                        {"name": "HOME", "value": "/tmp"},
+                    ],
+                    "securityContext": {"runAsUser": 1000, "runAsGroup": 1000},
+                    "volumeMounts": [{"name": "pgpass", "mountPath": "/pgpass"}],
+                }
+            ],
+            "extraVolumes": [{"name": "pgpass", "emptyDir": {"medium": "Memory"}}],
+            "extraVolumeMounts": [
+                {"name": "pgpass", "mountPath": "/pgpass", "readOnly": True}
+            ],
+            "extraEnv": {"PGPASSFILE": "/pgpass/pgpass"},
+        }
+    }
+
+
+# Lets the CloudWatch agent of MonitoringStage scrape /hub/metrics: without a
+# token, and through the hub's NetworkPolicy from the agent's namespace
+# `values` are the hub values so far, whose NetworkPolicy ingress rules are kept
+def monitoring_values(monitoring_config, values=None) -> Dict[str, Any]:
+    if not monitoring_config.get("enabled"):
+        return {}
+    agent_namespace = {"kubernetes.io/metadata.name": cloudwatch_agent.NAMESPACE}
+    network_policy = ((values or {}).get("hub") or {}).get("networkPolicy") or {}
+    agent_rule = {
+        "from": [{"namespaceSelector": {"matchLabels": agent_namespace}}],
+        "ports": [{"port": cloudwatch_agent.HUB_PORT}],
+    }
+    return {
+        "hub": {
+            # /hub/metrics stays authenticated, the agent sends the token of a
+            # service that can only read metrics
+            "services": {cloudwatch_agent.HUB_SERVICE: {}},
+            "loadRoles": {
+                "cloudwatch-metrics": {
+                    "description": "Read the hub's Prometheus metrics",
+                    "scopes": ["read:metrics"],
+                    "services": [cloudwatch_agent.HUB_SERVICE],
+                }
+            },
+            "networkPolicy": {
+                "ingress": [*(network_policy.get("ingress") or []), agent_rule]
+            },
+        }
+    }
+
+
+# proxy-public annotations for the AWS Load Balancer Controller EksStack
+# installs with eks.load_balancer.type nlb. A classic ELB keeps the chart's.
+def load_balancer_values(config) -> Dict[str, Any]:
+    lb_config = (config.get("eks") or {}).get("load_balancer") or {}
+    if lb_config.get("type", "classic") != "nlb":
+        return {}
+    prefix = "service.beta.kubernetes.io/aws-load-balancer"
+    cross_zone = str(bool(lb_config.get("cross_zone"))).lower()
+    deregistration_delay = lb_config.get("deregistration_delay", 300)
+    annotations = {
+        f"{prefix}-type": "external",
+        f"{prefix}-nlb-target-type": "ip",
+        f"{prefix}-name": proxy_load_balancer_name(config),
+        f"{prefix}-scheme": lb_config.get("scheme", "internet-facing"),
+        f"{prefix}-attributes": f"load_balancing.cross_zone.enabled={cross_zone}",
+        f"{prefix}-target-group-attributes": (
+            f"deregistration_delay.timeout_seconds={deregistration_delay}"
+        ),
+    }
+    if lb_config.get("proxy_protocol"):
+        annotations[f"{prefix}-proxy-protocol"] = "*"
+    return {"proxy": {"service": {"annotations": annotations}}}
+
+
+# Fully qualified single-user and profile images, e.g. for pulling on node boot
+def notebook_images(values) -> List[str]:
+    singleuser = values.get("singleuser") or {}
+    images = [singleuser.get("image")]
+    images += [
+        (profile.get("kubespawner_override") or {}).get("image")
+        for profile in singleuser.get("profileList") or []
+    ]
+
+    qualified = []
+    for image in images:
+        if not image:
+            continue
+        if isinstance(image, dict):
+            image = f"{image['name']}:{image.get('tag') or 'latest'}"
+        else:
+            name, tag = split_image(image)
+            image = f"{name}:{tag}"
+        registry = image.split("/")[0]
+        if "/" not in image:
+            image = "docker.io/library/" + image
+        elif "." not in registry and ":" not in registry and registry != "localhost":
+            image = "docker.io/" + image
+        if image not in qualified:
+            qualified.append(image)
+    return qualified
@@ -0,0 +1,60 @@
+import json
+import os
+
+import aws_cdk as cdk
+import aws_cdk.assertions as assertions
+import pytest
+
+from utils import config_util
+
+# Synth runs on whatever Node the environment has, keep jsii quiet about it
+os.environ.setdefault("JSII_SILENCE_WARNING_DEPRECATED_NODE_VERSION", "1")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Stub values for the placeholders in config/*.yaml so templates can be synthesized offline
+STUB_ACCOUNT = "123456789012"
+STUB_REGION = "us-west-2"
+# Looked up by `cdk synth` and stored in cdk.context.json, enough for eks.vpc.max_azs up to 6
+STUB_AZS = [f"{STUB_REGION}{zone}" for zone in "abcdef"]
+
+
+@pytest.fixture(autouse=True)
+def repo_root(monkeypatch):
+    # Config and manifests are read relative to the repository root, like `cdk synth`
+    monkeypatch.chdir(ROOT)
+
+
+def stub_config(stage: str = "dev"):
+    config = config_util.load_config(stage)
+    config["aws"]["account"] = STUB_ACCOUNT
+    config["aws"]["region"] = STUB_REGION
+    return config
+
+
+@pytest.fixture
+def config():
+    return stub_config()
+
+
+@pytest.fixture
+def env():
+    return cdk.Environment(account=STUB_ACCOUNT, region=STUB_REGION)
+
+
+def new_app(config) -> cdk.App:
+    app = cdk.App()
+    app.node.set_context("env_config", config)
+    app.node.set_context(
+        f"availability-zones:account={STUB_ACCOUNT}:region={STUB_REGION}", STUB_AZS
+    )
+    return app
+
+
+# Template.from_stack looks for nested templates in the app's assembly, stacks
+# in a Stage have theirs in the stage's
+def nested_template(nested_stack: cdk.NestedStack) -> assertions.Template:
+    stage = cdk.Stage.of(nested_stack)
+    path = os.path.join(stage.synth().directory, nested_stack.template_file)
+    with open(path) as f:
+        return assertions.Template.from_json(json.load(f))
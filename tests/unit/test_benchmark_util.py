@@ -0,0 +1,76 @@
+import json
+import tempfile
+
+from utils import benchmark_util
+
+BASELINE = {
+    "R53EntryStage": {
+        "wall_seconds": 2.0,
+        "process_seconds": 6.0,
+        "peak_rss_mb": 240.0,
+        "stacks": {
+            "R53EntryStage/R53EntryStack": {"template_bytes": 1000, "resources": 3}
+        },
+    }
+}
+
+
+def result(**changes):
+    current = json.loads(json.dumps(BASELINE))
+    target = current["R53EntryStage"]
+    stack = target["stacks"]["R53EntryStage/R53EntryStack"]
+    for key, value in changes.items():
+        (stack if key in stack else target)[key] = value
+    return current
+
+
+def test_within_thresholds():
+    assert benchmark_util.compare(BASELINE, result()) == []
+    assert benchmark_util.compare(BASELINE, result(template_bytes=1050)) == []
+    # Sub-second jitter is not a regression even when relative growth is large
+    assert benchmark_util.compare(BASELINE, result(wall_seconds=2.4)) == []
+
+
+def test_regressions():
+    regressions = benchmark_util.compare(
+        BASELINE,
+        result(wall_seconds=3.5, peak_rss_mb=400.0, template_bytes=1200, resources=4),
+    )
+
+    assert regressions == [
+        "R53EntryStage wall_seconds: 2.0 -> 3.5",
+        "R53EntryStage peak_rss_mb: 240.0 -> 400.0",
+        "R53EntryStage R53EntryStage/R53EntryStack template_bytes: 1000 -> 1200",
+        "R53EntryStage R53EntryStage/R53EntryStack resources: 3 -> 4",
+    ]
+
+
+def test_new_targets_and_stacks_have_no_baseline():
+    current = result()
+    current["R53EntryStage"]["stacks"]["R53EntryStage/Other"] = {
+        "template_bytes": 1,
+        "resources": 1,
+    }
+    current["TDPConStage"] = current["R53EntryStage"]
+
+    assert benchmark_util.compare(BASELINE, current) == []
+
+
+def test_synth_target_metrics(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    metrics = benchmark_util.synth_target("R53EntryStage", "dev")
+
+    # The cloud assembly is removed once measured
+    assert list(tmp_path.iterdir()) == []
+
+    (stack,) = metrics["stacks"]
+    assert stack == "R53EntryStage/R53EntryStack"
+    assert metrics["stacks"][stack]["resources"] > 0
+    assert metrics["stacks"][stack]["template_bytes"] > 0
+
+
+def test_stored_baseline_covers_every_target():
+    with open(benchmark_util.BASELINE) as f:
+        baseline = json.load(f)
+
+    assert sorted(baseline["dev"]) == sorted(benchmark_util.TARGETS)
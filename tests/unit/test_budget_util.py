@@ -0,0 +1,68 @@
+import json
+import os
+
+import aws_cdk.cx_api as cx_api
+
+from cdk_pipeline.pipeline_stack import CdkZ2jhPipelineStack
+from tests.unit.conftest import new_app
+from utils.budget_util import REPORT_FILE, add_resource_budget
+
+
+def synth_pipeline(config, env, budgets):
+    app = new_app(config)
+    budget = add_resource_budget(app, budgets)
+    CdkZ2jhPipelineStack(app, "CdkZ2jhPipelineStack", stage="dev", env=env)
+    return budget, app.synth()
+
+
+def test_counts_every_stack_including_pipeline_stages(config, env, tmp_path):
+    budget, assembly = synth_pipeline(config, env, config["budgets"])
+
+    # Nested stacks, e.g. the kubectl provider, are counted on their own
+    assert {
+        "CdkZ2jhPipelineStack",
+        "CdkZ2jhPipelineStack/ClusterDeploy/EksStack",
+        "CdkZ2jhPipelineStack/R53EntryStage/R53EntryStack",
+        "CdkZ2jhPipelineStack/TDPeeringConnectionStage/TDPConStack",
+        "CdkZ2jhPipelineStack/Z2jhDeployStage/Z2jhDeployStack",
+    } < set(budget.stacks)
+    assert budget.violations() == []
+
+    z2jh = budget.stacks["CdkZ2jhPipelineStack/Z2jhDeployStage/Z2jhDeployStack"]
+    assert z2jh["counts"]["kubectl_resources"] == 1
+    assert z2jh["counts"]["ssm_parameters"] >= 1
+
+    # Counts match the synthesized template
+    (eks_stack,) = [
+        stack
+        for nested in assembly.nested_assemblies
+        for stack in nested.nested_assembly.stacks
+        if stack.stack_name.endswith("EksStack")
+    ]
+    eks = budget.stacks["CdkZ2jhPipelineStack/ClusterDeploy/EksStack"]["counts"]
+    assert eks["resources"] == len(eks_stack.template["Resources"])
+
+    report = json.load(open(budget.write_report(str(tmp_path))))
+    assert report["budgets"] == dict(config["budgets"])
+    assert os.listdir(tmp_path) == [REPORT_FILE]
+
+
+def test_over_budget_fails_synth(config, env):
+    budget, assembly = synth_pipeline(config, env, {"kubectl_resources": 5})
+
+    (violation,) = budget.violations()
+    assert violation.startswith(
+        "CdkZ2jhPipelineStack/ClusterDeploy/EksStack: kubectl_resources"
+    )
+    (eks_stack,) = [
+        stack
+        for nested in assembly.nested_assemblies
+        for stack in nested.nested_assembly.stacks
+        if stack.stack_name.endswith("EksStack")
+    ]
+    (error,) = [
+        message
+        for message in eks_stack.messages
+        if message.level == cx_api.SynthesisMessageLevel.ERROR
+    ]
+    assert error.entry.data.startswith("Resource budget exceeded: kubectl_resources")
@@ -0,0 +1,74 @@
+import json
+
+import yaml
+
+from cdk_pipeline import cloudwatch_agent
+
+CONFIG = {
+    "agent_image": "public.ecr.aws/cloudwatch-agent/cloudwatch-agent:latest",
+    "scrape_interval": "1m",
+}
+
+
+def documents(kind):
+    return [
+        document
+        for document in cloudwatch_agent.manifests("z2jh", "us-west-2", CONFIG)
+        if document["kind"] == kind
+    ]
+
+
+def test_scrapes_hub_and_autoscaler():
+    (prometheus,) = [
+        document
+        for document in documents("ConfigMap")
+        if document["metadata"]["name"] == "prometheus-config"
+    ]
+    config = yaml.safe_load(prometheus["data"]["prometheus.yaml"])
+
+    jobs = {job["job_name"]: job for job in config["scrape_configs"]}
+    assert set(jobs) == {"jupyterhub", "cluster-autoscaler"}
+    assert jobs["jupyterhub"]["metrics_path"] == "/hub/metrics"
+    assert jobs["jupyterhub"]["bearer_token_file"] == "/etc/jupyterhub-metrics/token"
+    assert config["global"]["scrape_interval"] == "1m"
+
+
+def test_spawn_histogram_is_published_per_bucket():
+    (agent,) = [
+        document
+        for document in documents("ConfigMap")
+        if document["metadata"]["name"] == "prometheus-cwagentconfig"
+    ]
+    prometheus = json.loads(agent["data"]["cwagentconfig.json"])["logs"][
+        "metrics_collected"
+    ]["prometheus"]
+
+    assert prometheus["cluster_name"] == "z2jh"
+    assert prometheus["log_group_name"] == "/aws/containerinsights/z2jh/prometheus"
+    buckets = [
+        declaration
+        for declaration in prometheus["emf_processor"]["metric_declaration"]
+        if "_bucket" in declaration["metric_selectors"][0]
+    ]
+    assert buckets[0]["dimensions"] == [["ClusterName", "status", "le"]]
+
+
+def test_bucket_label():
+    assert cloudwatch_agent.bucket_label(120) == "120.0"
+    assert cloudwatch_agent.bucket_label(0.5) == "0.5"
+
+
+def test_agent_mounts_hub_token():
+    (deployment,) = documents("Deployment")
+    spec = deployment["spec"]["template"]["spec"]
+    (container,) = spec["containers"]
+
+    assert {
+        "name": "jupyterhub-metrics-token",
+        "mountPath": "/etc/jupyterhub-metrics",
+        "readOnly": True,
+    } in container["volumeMounts"]
+    assert {
+        "name": "jupyterhub-metrics-token",
+        "secret": {"secretName": "jupyterhub-metrics-token"},
+    } in spec["volumes"]
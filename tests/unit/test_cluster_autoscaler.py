@@ -0,0 +1,60 @@
+import pytest
+import yaml
+
+from cdk_pipeline import cluster_autoscaler
+
+CONFIG = {
+    "scan_interval": "10s",
+    "scale_down_delay_after_add": "5m",
+    "scale_down_unneeded_time": "15m",
+    "expander": "least-waste",
+}
+
+
+def deployment(documents):
+    (deployment,) = [d for d in documents if d["kind"] == "Deployment"]
+    return deployment["spec"]["template"]["spec"]["containers"][0]
+
+
+def test_image_follows_cluster_version():
+    container = deployment(cluster_autoscaler.manifests("z2jh", "1.24", CONFIG))
+
+    assert (
+        container["image"] == "registry.k8s.io/autoscaling/cluster-autoscaler:v1.24.1"
+    )
+    with pytest.raises(ValueError):
+        cluster_autoscaler.manifests("z2jh", "1.99", CONFIG)
+    assert deployment(
+        cluster_autoscaler.manifests("z2jh", "1.99", dict(CONFIG, image_tag="v1.99.0"))
+    )["image"].endswith(":v1.99.0")
+
+
+def test_flags_from_config():
+    command = deployment(cluster_autoscaler.manifests("z2jh", "1.24", CONFIG))[
+        "command"
+    ]
+
+    assert (
+        "--node-group-auto-discovery=asg:tag=k8s.io/cluster-autoscaler/enabled,"
+        "k8s.io/cluster-autoscaler/z2jh" in command
+    )
+    assert "--scan-interval=10s" in command
+    assert "--scale-down-delay-after-add=5m" in command
+    assert "--scale-down-unneeded-time=15m" in command
+    assert "--expander=least-waste" in command
+
+
+def test_priority_expander():
+    config = dict(
+        CONFIG, expander="priority", priorities={50: [".*Spot.*"], 10: [".*"]}
+    )
+    documents = cluster_autoscaler.manifests("z2jh", "1.24", config)
+
+    (config_map,) = [d for d in documents if d["kind"] == "ConfigMap"]
+    assert config_map["metadata"]["name"] == "cluster-autoscaler-priority-expander"
+    assert yaml.safe_load(config_map["data"]["priorities"]) == {
+        50: [".*Spot.*"],
+        10: [".*"],
+    }
+    with pytest.raises(ValueError):
+        cluster_autoscaler.manifests("z2jh", "1.24", dict(CONFIG, expander="priority"))
@@ -0,0 +1,101 @@
+import aws_cdk as cdk
+import aws_cdk.assertions as assertions
+import pytest
+
+from cdk_pipeline.cluster_props import (
+    CLUSTER_ATTRIBUTES_PARAMETER,
+    ClusterProps,
+    proxy_load_balancer_name,
+)
+from cdk_pipeline.eks_cluster_deploy import EksStack
+from cdk_pipeline.r53_lb_record import R53LbRecord
+from cdk_pipeline.td_peering_connection import TDPConStack
+from tests.unit.conftest import new_app
+
+
+def ssm_parameters(template):
+    return sorted(
+        name
+        for name in template.to_json().get("Parameters", {})
+        if name.startswith("SsmParameterValue")
+    )
+
+
+def test_props_are_shared_per_stack(config):
+    stack = cdk.Stack(new_app(config), "Stack")
+
+    assert ClusterProps.of(stack, config) is ClusterProps.of(stack, config)
+
+
+def test_cluster_attributes_resolve_once(config, env):
+    app = new_app(config)
+    stack = R53LbRecord(cdk.Stage(app, "R53EntryStage", env=env), "R53", config)
+
+    (parameter,) = ssm_parameters(assertions.Template.from_stack(stack))
+    assert "omnispineksclusterattributes" in parameter
+
+
+def test_peering_routes_follow_route_table_count(config, env):
+    config["eks"]["vpc"]["max_azs"] = 4
+    config["teradata"]["databases"][0]["private_route_tables"] = 2
+    app = new_app(config)
+    stack = TDPConStack(
+        cdk.Stage(app, "TDPeeringConnectionStage", env=env), "TD", config
+    )
+    template = assertions.Template.from_stack(stack)
+
+    template.resource_count_is("AWS::EC2::Route", 4 + 2)
+    # cluster attributes, Vantage VPC, CIDR and two route tables
+    assert len(ssm_parameters(template)) == 5
+
+
+def test_eks_publishes_cluster_attributes(config, env):
+    app = new_app(config)
+    stack = EksStack(cdk.Stage(app, "ClusterDeploy", env=env), "EksStack", config)
+    template = assertions.Template.from_stack(stack)
+
+    (attributes,) = template.find_resources(
+        "AWS::SSM::Parameter", {"Properties": {"Name": CLUSTER_ATTRIBUTES_PARAMETER}}
+    ).values()
+    joined = attributes["Properties"]["Value"]["Fn::Join"]
+    assert joined[0] == ","
+    # 9 cluster fields, 3 private route tables and 3 private subnets, then
+    # their AZs, which Fn::Join folds into one string
+    assert len(joined[1]) == 16
+    assert joined[1][-1] == "us-west-2a,us-west-2b,us-west-2c"
+    kubectl_function, kubectl_handler_role = joined[1][7:9]
+    assert "KubectlProvider" in kubectl_function["Fn::GetAtt"][0]
+    assert "KubectlProvider" in kubectl_handler_role["Fn::GetAtt"][0]
+
+
+@pytest.mark.parametrize("azs", [2, 3, 6])
+def test_eks_vpc_spans_max_azs(config, env, azs):
+    config["eks"]["vpc"]["max_azs"] = azs
+    app = new_app(config)
+    stack = EksStack(cdk.Stage(app, "ClusterDeploy", env=env), "EksStack", config)
+    template = assertions.Template.from_stack(stack)
+
+    template.resource_count_is("AWS::EC2::Subnet", 2 * azs)
+    template.resource_count_is("AWS::EC2::NatGateway", azs)
+    (cluster,) = template.find_resources("Custom::AWSCDK-EKS-Cluster").values()
+    subnets = cluster["Properties"]["Config"]["resourcesVpcConfig"]["subnetIds"]
+    assert len(subnets) == 2 * azs
+
+
+def test_eks_rejects_more_azs_than_the_region_has(config, env):
+    config["eks"]["vpc"]["max_azs"] = 7
+    app = new_app(config)
+
+    with pytest.raises(ValueError, match="max_azs"):
+        EksStack(cdk.Stage(app, "ClusterDeploy", env=env), "EksStack", config)
+
+
+def test_proxy_load_balancer_name(config):
+    assert proxy_load_balancer_name(config) == "dev-z2jh-proxy"
+
+    config["eks"]["load_balancer"]["name"] = "hub"
+    assert proxy_load_balancer_name(config) == "hub"
+
+    config["eks"]["load_balancer"]["name"] = "x" * 33
+    with pytest.raises(ValueError):
+        proxy_load_balancer_name(config)
@@ -0,0 +1,44 @@
+from benedict import benedict
+
+from utils import config_util
+
+
+def test_common_config_is_parsed_once(monkeypatch):
+    monkeypatch.setattr(config_util, "_common_config", None)
+    parsed = []
+    from_yaml = benedict.from_yaml
+
+    def counting_from_yaml(path, *args, **kwargs):
+        parsed.append(path)
+        return from_yaml(path, *args, **kwargs)
+
+    monkeypatch.setattr(benedict, "from_yaml", counting_from_yaml)
+    dev = config_util.load_config("dev")
+    prod = config_util.load_config("prod")
+
+    assert parsed == ["config/common.yaml", "config/dev.yaml", "config/prod.yaml"]
+    # Each stage merges into its own copy
+    assert dev["stage"] == "dev" and prod["stage"] == "prod"
+    assert len(dev["eks"]["node_pools"]) != len(prod["eks"]["node_pools"])
+
+
+def test_available_stages():
+    assert config_util.available_stages() == ["dev", "prod"]
+
+
+def test_region_config():
+    config = config_util.load_config("dev")
+    config["aws"]["regions"] = {"eu-west-1": {"r53": {"record_name": "z2jh-euw1"}}}
+
+    regional = config_util.region_config(config, "eu-west-1")
+
+    assert regional["aws"]["region"] == "eu-west-1"
+    assert regional["r53"]["record_name"] == "z2jh-euw1"
+    assert regional["r53"]["zone_name"] == config["r53"]["zone_name"]
+    assert "record_name" not in config["r53"]
+
+
+def test_region_short_name():
+    assert config_util.region_short_name("us-east-1") == "use1"
+    assert config_util.region_short_name("ap-southeast-2") == "aps2"
+    assert config_util.region_short_name("us-gov-west-1") == "usgw1"
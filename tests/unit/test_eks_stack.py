@@ -0,0 +1,551 @@
+import json
+
+import aws_cdk as cdk
+import aws_cdk.assertions as assertions
+import pytest
+
+from cdk_pipeline.eks_cluster_deploy import KUBECTL_PROVIDER_ID, EksStack
+from tests.unit.conftest import nested_template, new_app, stub_config
+from utils.manifest_util import custom_resource_report
+
+MANIFEST = "Custom::AWSCDK-EKS-KubernetesResource"
+
+
+def eks_template(config, env):
+    app = new_app(config)
+    stage = cdk.Stage(app, "ClusterDeploy", env=env)
+    stack = EksStack(stage, "EksStack", config)
+    return stack, assertions.Template.from_stack(stack)
+
+
+def test_manifests_per_document(config, env):
+    stack, template = eks_template(config, env)
+
+    # ca and efs documents, plus the EFS StorageClass, the aws-auth ConfigMap
+    # and two IRSA service accounts
+    assert stack.manifest_groups == {"ca": 5, "efs": 5}
+    template.resource_count_is(MANIFEST, 5 + 5 + 4)
+    assertions.Annotations.from_stack(stack).has_info(
+        "*", assertions.Match.string_like_regexp("10 manifest documents in 2 groups")
+    )
+
+
+def test_manifests_bundled_per_group(config, env):
+    config["eks"]["manifests"]["bundle"] = True
+    stack, template = eks_template(config, env)
+
+    template.resource_count_is(MANIFEST, 2 + 4)
+    bundles = template.find_resources(
+        MANIFEST, {"DependsOn": assertions.Match.any_value()}
+    )
+    efs = [name for name in bundles if name.startswith("z2jhmanifestBundleefs")]
+    ca = [name for name in template.find_resources(MANIFEST) if "Bundleca" in name]
+    assert efs and ca
+    assert ca[0] in bundles[efs[0]]["DependsOn"]
+
+
+def test_retain_replaced_manifests(config, env):
+    config["eks"]["manifests"]["retain_replaced"] = True
+    stack, template = eks_template(config, env)
+
+    retained = template.find_resources(MANIFEST, {"DeletionPolicy": "Retain"})
+    assert len(retained) == 10
+
+
+def test_custom_resource_report():
+    assert custom_resource_report({"ca": 5, "efs": 5}) == {
+        "documents": 10,
+        "per_document": 10,
+        "bundled": 2,
+    }
+
+
+def launch_configuration(template, asg_prefix):
+    (config,) = [
+        resource["Properties"]
+        for name, resource in template.find_resources(
+            "AWS::AutoScaling::LaunchConfiguration"
+        ).items()
+        if name.startswith(asg_prefix)
+    ]
+    return config
+
+
+def test_dev_node_pools(env):
+    stack, template = eks_template(stub_config("dev"), env)
+
+    template.resource_count_is("AWS::AutoScaling::AutoScalingGroup", 1)
+    template.resource_count_is("AWS::EKS::Nodegroup", 0)
+    template.has_resource_properties(
+        "AWS::AutoScaling::AutoScalingGroup", {"MinSize": "2", "MaxSize": "6"}
+    )
+    config = launch_configuration(template, "z2jhAutoScaling")
+    assert config["InstanceType"] == "m5.large"
+    assert config["BlockDeviceMappings"][0]["Ebs"]["VolumeSize"] == 100
+
+
+def test_prod_node_pools(env):
+    stack, template = eks_template(stub_config("prod"), env)
+
+    template.resource_count_is("AWS::AutoScaling::AutoScalingGroup", 1)
+    template.has_resource_properties(
+        "AWS::AutoScaling::AutoScalingGroup",
+        {
+            "MinSize": "2",
+            "MaxSize": "3",
+            "Tags": assertions.Match.array_with(
+                [
+                    {
+                        "Key": "k8s.io/cluster-autoscaler/node-template/label/hub.jupyter.org/node-purpose",
+                        "PropagateAtLaunch": True,
+                        "Value": "core",
+                    }
+                ]
+            ),
+        },
+    )
+    config = launch_configuration(template, "z2jhAutoScaling")
+    assert "--node-labels=hub.jupyter.org/node-purpose=core" in json.dumps(
+        config["UserData"]
+    )
+
+    template.has_resource_properties(
+        "AWS::EKS::Nodegroup",
+        {
+            "CapacityType": "SPOT",
+            "InstanceTypes": ["m5.xlarge", "m5a.xlarge", "m5d.xlarge", "m4.xlarge"],
+            "ScalingConfig": {"MinSize": 1, "MaxSize": 20, "DesiredSize": 1},
+            "Labels": {"hub.jupyter.org/node-purpose": "user"},
+            "Taints": [
+                {
+                    "Key": "hub.jupyter.org/dedicated",
+                    "Value": "user",
+                    "Effect": "NO_SCHEDULE",
+                }
+            ],
+        },
+    )
+    template.has_resource_properties(
+        "AWS::EC2::LaunchTemplate",
+        {
+            "LaunchTemplateData": {
+                "BlockDeviceMappings": [
+                    {
+                        "DeviceName": "/dev/xvda",
+                        "Ebs": assertions.Match.object_like(
+                            {"VolumeSize": 100, "VolumeType": "gp3", "Throughput": 250}
+                        ),
+                    }
+                ]
+            }
+        },
+    )
+
+
+def test_node_bootstrap_prepulls_notebook_images(config, env):
+    config["eks"]["node_pools"][0]["prepull_images"] = True
+    stack, template = eks_template(config, env)
+
+    user_data = json.dumps(
+        launch_configuration(template, "z2jhAutoScaling")["UserData"]
+    )
+    pull = user_data.index(
+        "ctr --namespace k8s.io images pull"
+        " docker.io/teradata/jupyterlab-extensions:3.4.0-ec10112022"
+    )
+    assert pull < user_data.index("/etc/eks/bootstrap.sh")
+    assert user_data.count("/etc/eks/bootstrap.sh") == 1
+
+
+def test_hub_db_sqlite_on_efs_adds_nothing(config, env):
+    stack, template = eks_template(config, env)
+
+    template.resource_count_is("AWS::EKS::Addon", 0)
+    template.resource_count_is("AWS::RDS::DBInstance", 0)
+
+
+def test_hub_db_sqlite_on_ebs(config, env):
+    config["z2jh"]["hub_db"]["type"] = "sqlite-ebs"
+    stack, template = eks_template(config, env)
+
+    template.has_resource_properties(
+        "AWS::EKS::Addon", {"AddonName": "aws-ebs-csi-driver"}
+    )
+    template.has_resource_properties(
+        MANIFEST,
+        {
+            "Manifest": assertions.Match.string_like_regexp(
+                '"provisioner":"ebs.csi.aws.com"'
+            )
+        },
+    )
+    claims = template.find_resources(
+        MANIFEST,
+        {
+            "Properties": {
+                "Manifest": assertions.Match.string_like_regexp('"name":"hub-db-ebs"')
+            }
+        },
+    )
+    (claim,) = claims.values()
+    assert claim["DeletionPolicy"] == "Retain"
+    assert '"storageClassName":"ebs-gp3"' in claim["Properties"]["Manifest"]
+    template.resource_count_is("AWS::RDS::DBInstance", 0)
+
+
+def test_hub_db_postgres(config, env):
+    config["z2jh"]["hub_db"]["type"] = "postgres"
+    stack, template = eks_template(config, env)
+
+    template.has_resource_properties(
+        "AWS::RDS::DBInstance",
+        {
+            "Engine": "postgres",
+            "EngineVersion": "14.6",
+            "DBName": "jupyterhub",
+            "StorageType": "gp3",
+            "StorageEncrypted": True,
+        },
+    )
+    template.has_resource_properties(
+        "AWS::SecretsManager::Secret", {"Name": "omnispin/hub/db/password"}
+    )
+    for name in ("/omnispin/hub/db/endpoint", "/omnispin/hub/db/role"):
+        template.has_resource_properties("AWS::SSM::Parameter", {"Name": name})
+
+
+def test_efs_defaults(config, env):
+    stack, template = eks_template(config, env)
+
+    (file_system,) = template.find_resources("AWS::EFS::FileSystem").values()
+    properties = file_system["Properties"]
+    assert "ThroughputMode" not in properties
+    assert properties["PerformanceMode"] == "generalPurpose"
+    assert properties["LifecyclePolicies"] == [
+        {"TransitionToIA": "AFTER_14_DAYS"},
+        {"TransitionToPrimaryStorageClass": "AFTER_1_ACCESS"},
+    ]
+    alarms = template.find_resources("AWS::CloudWatch::Alarm")
+    assert sorted(a["Properties"]["MetricName"] for a in alarms.values()) == [
+        "BurstCreditBalance",
+        "PercentIOLimit",
+    ]
+    template.resource_count_is("AWS::CloudWatch::Dashboard", 1)
+
+
+def test_efs_provisioned_throughput(config, env):
+    config["eks"]["efs"]["throughput_mode"] = "provisioned"
+    config["eks"]["efs"]["provisioned_throughput_mibps"] = 256
+    config["eks"]["efs"]["lifecycle_policy"] = None
+    config["eks"]["efs"]["out_of_infrequent_access_policy"] = None
+    stack, template = eks_template(config, env)
+
+    (file_system,) = template.find_resources("AWS::EFS::FileSystem").values()
+    properties = file_system["Properties"]
+    assert properties["ThroughputMode"] == "provisioned"
+    assert properties["ProvisionedThroughputInMibps"] == 256
+    assert "LifecyclePolicies" not in properties
+    # Burst credits only matter in bursting mode
+    alarms = template.find_resources("AWS::CloudWatch::Alarm")
+    assert [a["Properties"]["MetricName"] for a in alarms.values()] == [
+        "PercentIOLimit"
+    ]
+
+
+def test_efs_modes_are_case_insensitive(config, env):
+    config["eks"]["efs"]["throughput_mode"] = "BURSTING"
+    config["eks"]["efs"]["performance_mode"] = "General_Purpose"
+    stack, template = eks_template(config, env)
+
+    alarms = template.find_resources("AWS::CloudWatch::Alarm")
+    assert sorted(a["Properties"]["MetricName"] for a in alarms.values()) == [
+        "BurstCreditBalance",
+        "PercentIOLimit",
+    ]
+
+
+def test_efs_monitoring_disabled(config, env):
+    config["eks"]["efs"]["throughput_mode"] = "elastic"
+    config["eks"]["efs"]["monitoring"]["enabled"] = False
+    stack, template = eks_template(config, env)
+
+    template.has_resource_properties(
+        "AWS::EFS::FileSystem", {"ThroughputMode": "elastic"}
+    )
+    template.resource_count_is("AWS::CloudWatch::Alarm", 0)
+    template.resource_count_is("AWS::CloudWatch::Dashboard", 0)
+
+
+def test_asg_pool_has_one_instance_type(config, env):
+    config["eks"]["node_pools"][0]["instance_types"] = ["m5.large", "m5a.large"]
+
+    with pytest.raises(ValueError, match="exactly one instance type"):
+        eks_template(config, env)
+
+
+def test_asg_node_pools_are_discoverable_by_cluster_autoscaler(config, env):
+    stack, template = eks_template(config, env)
+
+    (asg,) = template.find_resources("AWS::AutoScaling::AutoScalingGroup").values()
+    tags = [tag["Key"] for tag in asg["Properties"]["Tags"]]
+    assert "k8s.io/cluster-autoscaler/enabled" in tags
+    assert (
+        stack.resolve(f"k8s.io/cluster-autoscaler/{stack.cluster.cluster_name}") in tags
+    )
+
+
+def test_kubectl_handler_tuning(config, env):
+    config["eks"]["kubectl"]["memory_mib"] = 2048
+    config["eks"]["kubectl"]["environment"] = {"HTTPS_PROXY": "http://proxy:3128"}
+    stack, _ = eks_template(config, env)
+    provider = nested_template(stack.node.find_child(KUBECTL_PROVIDER_ID))
+
+    provider.has_resource_properties(
+        "AWS::Lambda::Function",
+        {
+            "MemorySize": 2048,
+            "Environment": {
+                "Variables": assertions.Match.object_like(
+                    {"HTTPS_PROXY": "http://proxy:3128"}
+                )
+            },
+            "VpcConfig": assertions.Match.any_value(),
+        },
+    )
+
+
+def test_classic_load_balancer_has_no_controller(config, env):
+    _, template = eks_template(config, env)
+
+    charts = template.find_resources("Custom::AWSCDK-EKS-HelmChart")
+    assert not [
+        chart
+        for chart in charts.values()
+        if chart["Properties"]["Chart"] == "aws-load-balancer-controller"
+    ]
+
+
+def test_nlb_installs_load_balancer_controller(config, env):
+    config["eks"]["load_balancer"]["type"] = "nlb"
+    _, template = eks_template(config, env)
+
+    template.has_resource_properties(
+        "Custom::AWSCDK-EKS-HelmChart",
+        {"Chart": "aws-load-balancer-controller", "Namespace": "kube-system"},
+    )
+
+
+def ebs_storage_class(template):
+    (manifest,) = [
+        manifest
+        for manifest in template.find_resources(MANIFEST).values()
+        if "ebs.csi.aws.com" in json.dumps(manifest["Properties"]["Manifest"])
+    ]
+    return json.loads(manifest["Properties"]["Manifest"])[0]
+
+
+def test_ebs_homes_add_gp3_storage_class(config, env):
+    config["z2jh"]["profiles"] = [{"name": "fast", "home": "ebs"}]
+    config["eks"]["node_pools"][0]["zonal"] = True
+    config["eks"]["ebs"] = {"iops": 6000, "throughput": 250}
+    _, template = eks_template(config, env)
+
+    template.has_resource_properties(
+        "AWS::EKS::Addon", {"AddonName": "aws-ebs-csi-driver"}
+    )
+    assert ebs_storage_class(template)["parameters"] == {
+        "type": "gp3",
+        "encrypted": "true",
+        "iops": "6000",
+        "throughput": "250",
+    }
+
+
+def test_ebs_defaults_keep_gp3_baseline(config, env):
+    config["z2jh"]["home"]["storage"] = "ebs"
+    config["eks"]["node_pools"][0]["zonal"] = True
+    _, template = eks_template(config, env)
+
+    assert ebs_storage_class(template)["parameters"] == {
+        "type": "gp3",
+        "encrypted": "true",
+    }
+
+
+def test_ebs_throughput_needs_iops(config, env):
+    config["z2jh"]["home"]["storage"] = "ebs"
+    config["eks"]["node_pools"][0]["zonal"] = True
+    config["eks"]["ebs"] = {"iops": None, "throughput": 1000}
+
+    with pytest.raises(ValueError):
+        eks_template(config, env)
+
+
+def test_ebs_homes_need_a_zonal_user_pool(env):
+    config = stub_config("prod")
+    config["z2jh"]["home"]["storage"] = "ebs"
+    # A zonal core pool doesn't help users
+    config["eks"]["node_pools"][0]["zonal"] = True
+
+    with pytest.raises(ValueError, match="zonal user node pool"):
+        eks_template(config, env)
+
+
+def test_zonal_pool_has_a_group_per_az(env):
+    config = stub_config("prod")
+    config["z2jh"]["home"]["storage"] = "ebs"
+    config["eks"]["node_pools"][1]["zonal"] = True
+    stack, template = eks_template(config, env)
+
+    nodegroups = template.find_resources("AWS::EKS::Nodegroup").values()
+    subnets = [nodegroup["Properties"]["Subnets"] for nodegroup in nodegroups]
+    assert len(subnets) == config["eks"]["vpc"]["max_azs"]
+    assert all(len(subnet) == 1 for subnet in subnets)
+    assert len({json.dumps(subnet) for subnet in subnets}) == len(subnets)
+    # Each with the pool's size
+    template.has_resource_properties(
+        "AWS::EKS::Nodegroup",
+        {"ScalingConfig": {"MinSize": 1, "MaxSize": 20}},
+    )
+    # The core pool still spans every AZ
+    template.resource_count_is("AWS::AutoScaling::AutoScalingGroup", 1)
+
+
+def test_datasets_volume(config, env):
+    config["z2jh"]["datasets"]["enabled"] = True
+    _, template = eks_template(config, env)
+
+    template.has_resource_properties(
+        "AWS::EFS::AccessPoint",
+        {
+            "RootDirectory": {
+                "Path": "/datasets",
+                "CreationInfo": {
+                    "OwnerUid": "0",
+                    "OwnerGid": "0",
+                    "Permissions": "755",
+                },
+            }
+        },
+    )
+    namespace = template.find_resources(
+        MANIFEST,
+        {"Properties": {"Manifest": assertions.Match.string_like_regexp("Namespace")}},
+    )
+    assert [resource["DeletionPolicy"] for resource in namespace.values()] == ["Retain"]
+    (datasets,) = template.find_resources(
+        MANIFEST,
+        {
+            "Properties": {"Manifest": {"Fn::Join": assertions.Match.any_value()}},
+            "DependsOn": assertions.Match.array_with(
+                [assertions.Match.string_like_regexp("DatasetsNamespace")]
+            ),
+        },
+    ).values()
+    manifest = "".join(
+        part if isinstance(part, str) else "TOKEN"
+        for part in datasets["Properties"]["Manifest"]["Fn::Join"][1]
+    )
+    volume, claim = json.loads(manifest)
+    assert volume["spec"]["csi"] == {
+        "driver": "efs.csi.aws.com",
+        "volumeHandle": "TOKEN::TOKEN",
+        "readOnly": True,
+    }
+    assert claim["metadata"]["name"] == "datasets"
+    assert claim["metadata"]["namespace"] == "z2jh"
+    assert claim["spec"]["volumeName"] == volume["metadata"]["name"]
+
+
+def test_warm_pool(config, env):
+    config["eks"]["node_pools"][0]["warm_pool"] = {"min_size": 2, "max_prepared": 4}
+    config["eks"]["node_pools"][0]["kubelet"] = {"max_pods": 58}
+    _, template = eks_template(config, env)
+
+    template.has_resource_properties(
+        "AWS::AutoScaling::WarmPool",
+        {
+            "MinSize": 2,
+            "MaxGroupPreparedCapacity": 4,
+            "PoolState": "Stopped",
+            "InstanceReusePolicy": {"ReuseOnScaleIn": False},
+        },
+    )
+    template.has_resource_properties(
+        "AWS::AutoScaling::LifecycleHook",
+        {
+            "LifecycleHookName": "omnispin-node-ready",
+            "LifecycleTransition": "autoscaling:EC2_INSTANCE_LAUNCHING",
+            "HeartbeatTimeout": 600,
+            "DefaultResult": "CONTINUE",
+        },
+    )
+    template.has_resource_properties(
+        "AWS::AutoScaling::AutoScalingGroup",
+        {
+            "Tags": assertions.Match.array_with(
+                [
+                    {
+                        "Key": "omnispin:node-pool",
+                        "Value": "AutoScaling",
+                        "PropagateAtLaunch": True,
+                    }
+                ]
+            )
+        },
+    )
+    template.has_resource_properties(
+        "AWS::IAM::Policy",
+        {
+            "PolicyDocument": {
+                "Statement": assertions.Match.array_with(
+                    [
+                        assertions.Match.object_like(
+                            {
+                                "Action": "autoscaling:CompleteLifecycleAction",
+                                "Condition": {
+                                    "StringEquals": {
+                                        "autoscaling:ResourceTag/omnispin:node-pool": "AutoScaling"
+                                    }
+                                },
+                            }
+                        )
+                    ]
+                )
+            }
+        },
+    )
+    user_data = json.dumps(
+        launch_configuration(template, "z2jhAutoScaling")["UserData"]
+    )
+    assert "/var/lib/cloud/scripts/per-boot/omnispin-node.sh" in user_data
+    assert "--use-max-pods false" in user_data
+
+
+def test_plain_asg_pool_keeps_cdk_bootstrap(config, env):
+    _, template = eks_template(config, env)
+
+    template.resource_count_is("AWS::AutoScaling::WarmPool", 0)
+    template.resource_count_is("AWS::AutoScaling::LifecycleHook", 0)
+
+
+@pytest.mark.parametrize(
+    "pool",
+    [
+        {"warm_pool": {"state": "hibernated"}},
+        {"warm_pool": {"min_size": 1}, "spot_price": "0.05"},
+    ],
+)
+def test_unsupported_warm_pools(config, env, pool):
+    config["eks"]["node_pools"][0].update(pool)
+
+    with pytest.raises(ValueError):
+        eks_template(config, env)
+
+
+def test_managed_pools_have_no_boot_script(env):
+    config = stub_config("prod")
+    config["eks"]["node_pools"][1]["warm_pool"] = {"min_size": 1}
+
+    with pytest.raises(ValueError):
+        eks_template(config, env)
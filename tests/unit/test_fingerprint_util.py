@@ -0,0 +1,126 @@
+import json
+
+from cdk_pipeline.pipeline_app_stage import (
+    ClusterDeployStage,
+    MonitoringStage,
+    R53EntryStage,
+    TDPConStage,
+    Z2jhDeployStage,
+)
+from tests.unit.conftest import stub_config
+from utils import fingerprint_util
+from utils.fingerprint_util import stage_fingerprint, stage_fingerprints
+from utils.wave_util import stage_producers
+
+
+def test_fingerprint_is_stable():
+    assert stage_fingerprint(TDPConStage, stub_config()) == stage_fingerprint(
+        TDPConStage, stub_config()
+    )
+
+
+def test_fingerprint_follows_the_stage_config():
+    config = stub_config()
+    before = {
+        stage: stage_fingerprint(stage, config)
+        for stage in (ClusterDeployStage, TDPConStage)
+    }
+    config["teradata"]["databases"][0]["private_route_tables"] = 2
+
+    assert stage_fingerprint(TDPConStage, config) != before[TDPConStage]
+    assert stage_fingerprint(ClusterDeployStage, config) == before[ClusterDeployStage]
+
+
+def test_commit_tags_dont_change_the_fingerprint():
+    config = stub_config()
+    before = stage_fingerprint(TDPConStage, config)
+    config["tags"]["git:commitid"] = "0123abc"
+
+    assert stage_fingerprint(TDPConStage, config) == before
+
+
+def test_fingerprint_follows_the_stage_files(tmp_path, monkeypatch):
+    class FakeStage:
+        fingerprint_config = ()
+        fingerprint_files = (str(tmp_path / "stack.py"),)
+
+    (tmp_path / "stack.py").write_text("v1")
+    before = stage_fingerprint(FakeStage, stub_config())
+    (tmp_path / "stack.py").write_text("v2")
+
+    assert stage_fingerprint(FakeStage, stub_config()) != before
+
+
+def test_stored_fingerprints(tmp_path, monkeypatch):
+    monkeypatch.delenv(fingerprint_util.STORED_FINGERPRINTS_ENV, raising=False)
+    assert fingerprint_util.stored_fingerprints() == {}
+
+    stored = tmp_path / "fingerprints.json"
+    monkeypatch.setenv(fingerprint_util.STORED_FINGERPRINTS_ENV, str(stored))
+    # The lookup failed, nothing is skipped
+    assert fingerprint_util.stored_fingerprints() == {}
+
+    stored.write_text(json.dumps([{"Name": "/omnispin/fingerprint/a", "Value": "f"}]))
+    assert fingerprint_util.stored_fingerprints() == {"/omnispin/fingerprint/a": "f"}
+
+
+def test_null_config_values_dont_change_the_fingerprint():
+    config = stub_config("dev")
+    before = stage_fingerprint(TDPConStage, config)
+    del config["eks"]["kubectl"]["memory_mib"]
+
+    assert stage_fingerprint(TDPConStage, config) == before
+
+
+def test_consumers_follow_their_producers():
+    class Producer:
+        produces = ("ssm:/omnispin/eks",)
+        fingerprint_config = ("producer",)
+        fingerprint_files = ()
+
+    class Consumer:
+        consumes = ("ssm:/omnispin/eks",)
+        fingerprint_config = ()
+        fingerprint_files = ()
+
+    class Unrelated:
+        fingerprint_config = ()
+        fingerprint_files = ()
+
+    def fingerprints(config):
+        return stage_fingerprints(
+            [
+                (Consumer, "Consumer", config),
+                (Unrelated, "Unrelated", config),
+                (Producer, "Producer", config),
+            ]
+        )
+
+    config = stub_config()
+    before = fingerprints(config)
+    config["producer"] = "changed"
+    after = fingerprints(config)
+
+    assert after["Producer"] != before["Producer"]
+    assert after["Consumer"] != before["Consumer"]
+    assert after["Unrelated"] == before["Unrelated"]
+
+
+def test_stage_consumes_the_config_declares():
+    config = stub_config()
+
+    assert stage_producers(
+        [
+            (ClusterDeployStage, "Cluster", config),
+            (Z2jhDeployStage, "Z2jh", config),
+            (R53EntryStage, "R53", config),
+            (TDPConStage, "TD", config),
+            (MonitoringStage, "Monitoring", config),
+        ]
+    ) == {
+        "Cluster": [],
+        "Z2jh": ["Cluster"],
+        "R53": ["Cluster", "Z2jh"],
+        "TD": ["Cluster"],
+        "Monitoring": ["Cluster", "Z2jh"],
+    }
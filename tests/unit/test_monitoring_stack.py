@@ -0,0 +1,99 @@
+import json
+
+import aws_cdk as cdk
+import aws_cdk.assertions as assertions
+import pytest
+
+from cdk_pipeline.monitoring_deploy import MonitoringStack
+from tests.unit.conftest import new_app
+
+
+def monitoring_template(config, env):
+    config["monitoring"]["enabled"] = True
+    app = new_app(config)
+    stage = cdk.Stage(app, "MonitoringStage", env=env)
+    stack = MonitoringStack(stage, "MonitoringStack", config)
+    return assertions.Template.from_stack(stack)
+
+
+def test_agent_runs_with_cloudwatch_role(config, env):
+    template = monitoring_template(config, env)
+
+    template.has_resource_properties(
+        "AWS::IAM::Role",
+        {
+            "ManagedPolicyArns": [
+                {
+                    "Fn::Join": [
+                        "",
+                        [
+                            "arn:",
+                            {"Ref": "AWS::Partition"},
+                            ":iam::aws:policy/CloudWatchAgentServerPolicy",
+                        ],
+                    ]
+                }
+            ]
+        },
+    )
+    template.has_resource_properties("AWS::Logs::LogGroup", {"RetentionInDays": 30})
+
+
+def test_spawn_time_alarm(config, env):
+    config["monitoring"]["spawn_p95_threshold_seconds"] = 60
+    template = monitoring_template(config, env)
+
+    (alarm,) = template.find_resources("AWS::CloudWatch::Alarm").values()
+    properties = alarm["Properties"]
+    assert properties["Threshold"] == 0.05
+    metrics = {metric["Id"]: metric for metric in properties["Metrics"]}
+    dimensions = {
+        dimension["Name"]: dimension["Value"]
+        for dimension in metrics["fast"]["MetricStat"]["Metric"]["Dimensions"]
+    }
+    assert dimensions["le"] == "60.0"
+    assert dimensions["status"] == "success"
+
+
+def test_spawn_time_threshold_is_a_bucket(config, env):
+    config["monitoring"]["spawn_p95_threshold_seconds"] = 90
+
+    with pytest.raises(ValueError, match="spawn_p95_threshold_seconds"):
+        monitoring_template(config, env)
+
+
+def test_dashboard(config, env):
+    template = monitoring_template(config, env)
+
+    (dashboard,) = template.find_resources("AWS::CloudWatch::Dashboard").values()
+    body = json.dumps(dashboard["Properties"]["DashboardBody"])
+    for metric in (
+        "jupyterhub_server_spawn_duration_seconds_bucket",
+        "cluster_autoscaler_unschedulable_pods_count",
+        "cluster_autoscaler_nodes_count",
+        "PercentIOLimit",
+    ):
+        assert metric in body
+
+
+def test_hub_token_is_copied_next_to_the_agent(config, env):
+    template = monitoring_template(config, env)
+
+    template.has_resource_properties(
+        "Custom::AWSCDK-EKS-KubernetesObjectValue",
+        {
+            "ObjectType": "secret",
+            "ObjectName": "hub",
+            "ObjectNamespace": "z2jh",
+            "JsonPath": ".data.hub\\.services\\.cloudwatch-agent\\.apiToken",
+        },
+    )
+    manifests = template.find_resources("Custom::AWSCDK-EKS-KubernetesResource")
+    # The Secret's data is the looked up value, its manifest a join
+    rendered = [
+        json.dumps(manifest["Properties"]["Manifest"]).replace("\\", "")
+        for manifest in manifests.values()
+    ]
+    (secret,) = [manifest for manifest in rendered if '"kind":"Secret"' in manifest]
+    assert '"name":"jupyterhub-metrics-token"' in secret
+    assert "Fn::Join" in secret
@@ -0,0 +1,77 @@
+import pytest
+
+from cdk_pipeline import node_bootstrap
+
+POOL = {"name": "User", "type": "asg"}
+
+
+def script_lines(pool, images=()):
+    return node_bootstrap.boot_script(
+        pool, list(images), "BOOTSTRAP", "SIGNAL"
+    ).splitlines()
+
+
+def test_uses_boot_script():
+    assert not node_bootstrap.uses_boot_script(POOL)
+    assert not node_bootstrap.uses_boot_script({**POOL, "prepull_images": []})
+    for key in node_bootstrap.BOOT_KEYS:
+        assert node_bootstrap.uses_boot_script({**POOL, key: {"x": 1}})
+
+
+def test_ready_timeout():
+    assert node_bootstrap.ready_timeout(POOL) is None
+    assert node_bootstrap.ready_timeout({**POOL, "warm_pool": {"min_size": 1}}) == 600
+    wait_for_ready = {**POOL, "wait_for_ready": {"timeout_seconds": 300}}
+    assert node_bootstrap.ready_timeout(wait_for_ready) == 300
+
+
+def test_warm_instances_only_pull():
+    lines = script_lines({**POOL, "warm_pool": {"min_size": 1}}, ["image:1"])
+
+    pull = next(i for i, line in enumerate(lines) if "images pull image:1" in line)
+    warmed = lines.index('if [[ "$TARGET_STATE" == Warmed:* ]]; then')
+    assert pull < warmed < lines.index("BOOTSTRAP") < lines.index("SIGNAL")
+    assert lines[warmed + 1] == "  complete_launch"
+    assert lines[warmed + 2] == "  exit 0"
+    assert lines[warmed + 3] == "fi"
+    assert lines[-1] == "complete_launch"
+    assert any("complete-lifecycle-action" in line for line in lines)
+
+
+def test_no_lifecycle_hook_without_warm_pool():
+    lines = script_lines({**POOL, "prepull_images": ["image:1"]}, ["image:1"])
+
+    assert "complete_launch() { :; }" in lines
+    assert not any("aws autoscaling" in line for line in lines)
+    assert not any("healthz" in line for line in lines)
+
+
+def test_kubelet_and_containerd_settings():
+    lines = script_lines(
+        {
+            **POOL,
+            "kubelet": {"max_pods": 58, "serialize_image_pulls": False},
+            "containerd": {"max_concurrent_downloads": 10},
+        }
+    )
+
+    jq = next(line for line in lines if line.startswith("jq "))
+    assert '{"maxPods": 58, "serializeImagePulls": false}' in jq
+    containerd = next(line for line in lines if "containerd-config.toml" in line)
+    assert "/a max_concurrent_downloads = 10'" in containerd
+    # Settings are in place before bootstrap.sh copies and reads them
+    assert lines.index(jq) < lines.index("BOOTSTRAP")
+    assert lines.index(containerd) < lines.index("BOOTSTRAP")
+
+
+def test_unknown_kubelet_setting():
+    with pytest.raises(ValueError):
+        node_bootstrap.kubelet_config({**POOL, "kubelet": {"max_pod": 58}})
+
+
+def test_user_data_runs_script_on_first_boot():
+    commands = node_bootstrap.user_data_commands("echo boot")
+
+    assert commands[1].startswith(f"cat > {node_bootstrap.SCRIPT_PATH} <<")
+    assert "\necho boot\n" in commands[1]
+    assert commands[-1] == node_bootstrap.SCRIPT_PATH
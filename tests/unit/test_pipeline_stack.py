@@ -1,15 +1,198 @@
-import aws_cdk as core
+import json
+
 import aws_cdk.assertions as assertions
+import pytest
+
+from cdk_pipeline.pipeline_app_stage import ClusterDeployStage, TDPConStage
+
+from cdk_pipeline.pipeline_stack import CdkZ2jhPipelineStack
+from tests.unit.conftest import new_app
+from utils.fingerprint_util import (
+    STORED_FINGERPRINTS_ENV,
+    fingerprint_parameter,
+    stage_fingerprints,
+)
+from utils.wave_util import build_waves
+
+
+def pipeline_stages(template):
+    pipeline = template.find_resources("AWS::CodePipeline::Pipeline")
+    (resource,) = pipeline.values()
+    return {
+        stage["Name"]: [action["Name"] for action in stage["Actions"]]
+        for stage in resource["Properties"]["Stages"]
+    }
+
+
+def test_independent_stages_share_a_wave(config, env):
+    app = new_app(config)
+    stack = CdkZ2jhPipelineStack(app, "CdkZ2jhPipelineStack", stage="dev", env=env)
+    stages = pipeline_stages(assertions.Template.from_stack(stack))
+
+    # A wave holding a single stage is rendered under that stage's own name
+    after_assets = list(stages).index("Assets") + 1
+    deploy_stages = list(stages)[after_assets:]
+    assert deploy_stages == ["ClusterDeploy", "Wave2", "R53EntryStage"]
+
+    parallel = sorted({action.split(".")[0] for action in stages["Wave2"]})
+    assert parallel == ["TDPeeringConnectionStage", "Z2jhDeployStage"]
+
+
+def test_monitoring_stage_is_optional(config, env):
+    config["monitoring"]["enabled"] = True
+    app = new_app(config)
+    stack = CdkZ2jhPipelineStack(app, "CdkZ2jhPipelineStack", stage="dev", env=env)
+    stages = pipeline_stages(assertions.Template.from_stack(stack))
+
+    # Reads the hub's metrics token, it deploys after the hub
+    parallel = sorted({action.split(".")[0] for action in stages["Wave3"]})
+    assert parallel == ["MonitoringStage", "R53EntryStage"]
+
+
+def test_regions_deploy_in_parallel_waves(config, env):
+    config["aws"]["regions"] = {"us-east-1": {"r53": {"record_name": "z2jh-use1"}}}
+    app = new_app(config)
+    stack = CdkZ2jhPipelineStack(
+        app, "CdkZ2jhPipelineStack", stage="dev", config=config, env=env
+    )
+    stages = pipeline_stages(assertions.Template.from_stack(stack))
+
+    after_assets = list(stages).index("Assets") + 1
+    deploy_stages = list(stages)[after_assets:]
+    assert deploy_stages == ["Wave1", "Wave2", "Wave3"]
+    assert sorted({action.split(".")[0] for action in stages["Wave1"]}) == [
+        "ClusterDeploy",
+        "ClusterDeploy-use1",
+    ]
+    assert sorted({action.split(".")[0] for action in stages["Wave3"]}) == [
+        "R53EntryStage",
+        "R53EntryStage-use1",
+    ]
+
+    regional = stack.node.find_child("R53EntryStage-use1")
+    assert regional.region == "us-east-1"
+    (record,) = (
+        assertions.Template.from_stack(regional.node.find_child("R53EntryStack"))
+        .find_resources("AWS::Route53::RecordSet")
+        .values()
+    )
+    assert record["Properties"]["Name"] == "z2jh-use1.example.com."
+
+
+def test_regions_need_their_own_record(config, env):
+    config["aws"]["regions"] = {"us-east-1": {}}
+    app = new_app(config)
+
+    with pytest.raises(ValueError, match="r53.record_name in aws.regions.us-east-1"):
+        CdkZ2jhPipelineStack(
+            app, "CdkZ2jhPipelineStack", stage="dev", config=config, env=env
+        )
+
+
+def test_unchanged_stages_are_skipped(config, env, tmp_path, monkeypatch):
+    config["synth"]["skip_unchanged_stages"] = True
+    fingerprints = stage_fingerprints(
+        [
+            (ClusterDeployStage, "ClusterDeploy", config),
+            (TDPConStage, "TDPeeringConnectionStage", config),
+        ]
+    )
+    stored = tmp_path / "fingerprints.json"
+    stored.write_text(
+        json.dumps(
+            [
+                {
+                    "Name": fingerprint_parameter("TDPeeringConnectionStage"),
+                    "Value": fingerprints["TDPeeringConnectionStage"],
+                },
+                {
+                    "Name": fingerprint_parameter("R53EntryStage"),
+                    "Value": "from an older commit",
+                },
+            ]
+        )
+    )
+    monkeypatch.setenv(STORED_FINGERPRINTS_ENV, str(stored))
+    app = new_app(config)
+    stack = CdkZ2jhPipelineStack(app, "CdkZ2jhPipelineStack", stage="dev", env=env)
+    stages = pipeline_stages(assertions.Template.from_stack(stack))
+
+    after_assets = list(stages).index("Assets") + 1
+    deploy_stages = list(stages)[after_assets:]
+    assert deploy_stages == ["ClusterDeploy", "Z2jhDeployStage", "R53EntryStage"]
+    # Each deployed stage records its fingerprint afterwards
+    assert "ClusterDeployFingerprint" in stages["ClusterDeploy"]
+    assertions.Annotations.from_stack(stack).has_info(
+        "*", "TDPeeringConnectionStage: unchanged since the last deploy, skipped"
+    )
+
+
+class FakeNode:
+    def __init__(self, id):
+        self.id = id
+
+
+class FakeStage:
+    def __init__(self, id, produces=(), consumes=()):
+        self.node = FakeNode(id)
+        self.produces = produces
+        self.consumes = consumes
+
+
+def test_build_waves_orders_by_dependency():
+    a = FakeStage("a", produces=("x",))
+    b = FakeStage("b", produces=("y",), consumes=("x",))
+    c = FakeStage("c", consumes=("x", "external"))
+    d = FakeStage("d", consumes=("y",))
+
+    assert build_waves([d, c, b, a]) == [[a], [c, b], [d]]
+
+
+def test_build_waves_rejects_cycles():
+    a = FakeStage("a", produces=("x",), consumes=("y",))
+    b = FakeStage("b", produces=("y",), consumes=("x",))
+
+    try:
+        build_waves([a, b])
+    except ValueError as e:
+        assert "a, b" in str(e)
+    else:
+        raise AssertionError("expected a ValueError")
+
+
+def synth_project(template):
+    for project in template.find_resources("AWS::CodeBuild::Project").values():
+        build_spec = project["Properties"]["Source"]["BuildSpec"]
+        if "cdk synth" in build_spec:
+            return project["Properties"], build_spec
+    raise AssertionError("synth project not found")
+
+
+def test_synth_step_is_cached_and_pinned(config, env):
+    app = new_app(config)
+    stack = CdkZ2jhPipelineStack(app, "CdkZ2jhPipelineStack", stage="dev", env=env)
+    properties, build_spec = synth_project(assertions.Template.from_stack(stack))
+
+    assert properties["Cache"] == {"Type": "LOCAL", "Modes": ["LOCAL_CUSTOM_CACHE"]}
+    assert "/root/.cache/pip/**/*" in build_spec
+    assert "npm install -g aws-cdk@2.66.0 --prefer-offline" in build_spec
+    assert "Synth took" in build_spec
+
+
+def test_s3_synth_cache_needs_a_bucket(config, env):
+    config["synth"]["cache"]["type"] = "s3"
+    app = new_app(config)
+
+    with pytest.raises(ValueError, match="synth.cache.bucket"):
+        CdkZ2jhPipelineStack(app, "CdkZ2jhPipelineStack", stage="dev", env=env)
 
-from pipeline.pipeline_stack import PipelineStack
 
-# example tests. To run these tests, uncomment this file along with the example
-# resource in pipeline/pipeline_stack.py
-def test_sqs_queue_created():
-    app = core.App()
-    stack = PipelineStack(app, "pipeline")
-    template = assertions.Template.from_stack(stack)
+def test_synth_step_on_prebuilt_image(config, env):
+    config["synth"]["build_image"]["registry"] = "public.ecr.aws/example/synth"
+    app = new_app(config)
+    stack = CdkZ2jhPipelineStack(app, "CdkZ2jhPipelineStack", stage="dev", env=env)
+    properties, build_spec = synth_project(assertions.Template.from_stack(stack))
 
-#     template.has_resource_properties("AWS::SQS::Queue", {
-#         "VisibilityTimeout": 300
-#     })
+    assert properties["Environment"]["Image"] == "public.ecr.aws/example/synth:latest"
+    assert "npm install" not in build_spec
+    assert "pip install -r requirements.txt" in build_spec
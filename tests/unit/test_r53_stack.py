@@ -0,0 +1,94 @@
+import aws_cdk as cdk
+import aws_cdk.assertions as assertions
+
+from cdk_pipeline.r53_lb_record import R53LbRecord
+from tests.unit.conftest import new_app
+
+
+def r53_template(config, env):
+    app = new_app(config)
+    stack = R53LbRecord(cdk.Stage(app, "R53EntryStage", env=env), "R53", config)
+    return assertions.Template.from_stack(stack)
+
+
+def test_classic_load_balancer_cname(config, env):
+    template = r53_template(config, env)
+
+    template.resource_count_is("Custom::AWSCDK-EKS-KubernetesObjectValue", 1)
+    template.has_resource_properties("AWS::Route53::RecordSet", {"Type": "CNAME"})
+
+
+def test_classic_load_balancer_lookup_is_replaced(config, env):
+    template = r53_template(config, env)
+
+    # The cluster is imported at stack level now. The lookup that used the
+    # provider under cluster_props is replaced, its ServiceToken can't change.
+    resources = template.to_json()["Resources"]
+    assert "LoadBalancerAttribute2CD293A5" not in resources
+    provider = (
+        "R53EntryStageR53z2jh81BE9C53KubectlProviderNestedStack"
+        "R53EntryStageR53z2jh81BE9C53KubectlProviderNestedStackResource5445EEA6"
+    )
+    service_token = resources["ProxyPublicHostnameDF261B44"]["Properties"][
+        "ServiceToken"
+    ]
+    assert service_token["Fn::GetAtt"][0] == provider
+    # The record keeps its logical id, it's updated in place
+    assert "CnameZ2jhRecord13590D92" in resources
+
+
+def test_nlb_alias_record_without_kubectl(config, env):
+    config["eks"]["load_balancer"]["type"] = "nlb"
+    template = r53_template(config, env)
+
+    template.resource_count_is("Custom::AWSCDK-EKS-KubernetesObjectValue", 0)
+    template.resource_count_is("AWS::CloudFormation::Stack", 0)
+    (lookup,) = template.find_resources("Custom::AWS").values()
+    create = lookup["Properties"]["Create"]
+    assert '"action":"describeLoadBalancers"' in create
+    assert '"Names":["dev-z2jh-proxy"]' in create
+
+    template.has_resource_properties(
+        "AWS::Route53::RecordSet",
+        {
+            "Type": "A",
+            "AliasTarget": {
+                "DNSName": {
+                    "Fn::Join": [
+                        "",
+                        [
+                            "dualstack.",
+                            {
+                                "Fn::GetAtt": [
+                                    assertions.Match.any_value(),
+                                    "LoadBalancers.0.DNSName",
+                                ]
+                            },
+                        ],
+                    ]
+                },
+                "HostedZoneId": {
+                    "Fn::GetAtt": [
+                        assertions.Match.any_value(),
+                        "LoadBalancers.0.CanonicalHostedZoneId",
+                    ]
+                },
+            },
+        },
+    )
+
+
+def test_nlb_lookup_runs_again_when_helm_values_change(config, env):
+    config["eks"]["load_balancer"]["type"] = "nlb"
+
+    def lookup_call():
+        (lookup,) = r53_template(config, env).find_resources("Custom::AWS").values()
+        return lookup["Properties"]["Update"]
+
+    before = lookup_call()
+    assert lookup_call() == before
+    config["eks"]["load_balancer"]["proxy_protocol"] = True
+    after_annotations = lookup_call()
+    assert after_annotations != before
+    config["z2jh"]["home"]["ebs_capacity"] = "50Gi"
+    assert lookup_call() != after_annotations
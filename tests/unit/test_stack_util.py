@@ -0,0 +1,67 @@
+import aws_cdk as cdk
+import pytest
+
+from cdk_pipeline import pipeline_app_stage
+from tests.unit.conftest import new_app, stub_config
+from utils.config_util import add_commit_info_to_config
+from utils.stack_util import COMMIT_METADATA_KEY
+
+STAGES = (
+    pipeline_app_stage.ClusterDeployStage,
+    pipeline_app_stage.Z2jhDeployStage,
+    pipeline_app_stage.R53EntryStage,
+    pipeline_app_stage.TDPConStage,
+)
+
+
+def synth_commit(stage_class, commit_id, monkeypatch, resource_types=None):
+    monkeypatch.setenv("GIT_COMMIT_ID", commit_id)
+    monkeypatch.setenv("GIT_COMMIT_MESSAGE", f"Commit {commit_id}")
+    monkeypatch.setenv("GIT_COMMIT_AUTHOR", f"2023-01-01T00:00:0{commit_id[-1]}Z")
+    config = add_commit_info_to_config(config=stub_config("dev"))
+    if resource_types:
+        config["commit_tags"]["resource_types"] = resource_types
+    env = cdk.Environment(account="123456789012", region="us-west-2")
+    stage = stage_class(new_app(config), "Stage", env=env, config=config)
+    (stack,) = stage.synth().stacks
+    return stack.template
+
+
+@pytest.mark.parametrize("stage_class", STAGES)
+def test_commits_leave_resources_untouched(stage_class, monkeypatch):
+    first = synth_commit(stage_class, "commit1", monkeypatch)
+    second = synth_commit(stage_class, "commit2", monkeypatch)
+
+    assert first["Resources"] == second["Resources"]
+    assert first["Metadata"][COMMIT_METADATA_KEY]["git:commitid"] == "commit1"
+    assert second["Metadata"][COMMIT_METADATA_KEY]["git:commitid"] == "commit2"
+
+
+def test_stable_git_tags_stay_on_resources(monkeypatch):
+    template = synth_commit(pipeline_app_stage.TDPConStage, "commit1", monkeypatch)
+
+    (peering,) = [
+        resource
+        for resource in template["Resources"].values()
+        if resource["Type"] == "AWS::EC2::VPCPeeringConnection"
+    ]
+    tags = {tag["Key"] for tag in peering["Properties"]["Tags"]}
+    assert {"git:repo", "git:branch", "stage"} <= tags
+    assert "git:commitid" not in tags
+
+
+def test_commit_tags_on_allowed_resource_types(monkeypatch):
+    template = synth_commit(
+        pipeline_app_stage.TDPConStage,
+        "commit1",
+        monkeypatch,
+        resource_types=["AWS::EC2::VPCPeeringConnection"],
+    )
+
+    (peering,) = [
+        resource
+        for resource in template["Resources"].values()
+        if resource["Type"] == "AWS::EC2::VPCPeeringConnection"
+    ]
+    tags = {tag["Key"]: tag["Value"] for tag in peering["Properties"]["Tags"]}
+    assert tags["git:commitid"] == "commit1"
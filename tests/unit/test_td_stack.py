@@ -0,0 +1,164 @@
+import json
+
+import aws_cdk as cdk
+import aws_cdk.assertions as assertions
+import pytest
+
+from cdk_pipeline.cluster_props import (
+    CLUSTER_ATTRIBUTE_FIELDS,
+    CLUSTER_ATTRIBUTES_PARAMETER,
+)
+from cdk_pipeline.eks_cluster_deploy import EksStack
+from cdk_pipeline.pipeline_app_stage import TDPConStage
+from cdk_pipeline.td_peering_connection import TDPConStack
+from tests.unit.conftest import STUB_AZS, new_app
+
+ANALYTICS = {
+    "name": "Analytics",
+    "mode": "privatelink",
+    "service_name": "com.amazonaws.vpce.us-west-2.vpce-svc-0123456789abcdef0",
+    "port": 1025,
+}
+
+
+def td_template(config, env):
+    app = new_app(config)
+    stack = TDPConStack(
+        cdk.Stage(app, "TDPeeringConnectionStage", env=env), "TD", config
+    )
+    return assertions.Template.from_stack(stack)
+
+
+def logical_ids(template, resource_type):
+    return sorted(template.find_resources(resource_type))
+
+
+# Position in the cluster attributes parameter, see CLUSTER_ATTRIBUTE_FIELDS
+def attribute_index(value):
+    index, split = value["Fn::Select"]
+    assert "omnispineksclusterattributes" in split["Fn::Split"][1]["Ref"]
+    return index
+
+
+@pytest.mark.parametrize("azs", [2, 3, 6])
+def test_cluster_attributes_carry_subnet_azs(config, env, azs):
+    config["eks"]["vpc"]["max_azs"] = azs
+    app = new_app(config)
+    stack = EksStack(cdk.Stage(app, "ClusterDeploy", env=env), "EksStack", config)
+    template = assertions.Template.from_stack(stack)
+
+    (attributes,) = template.find_resources(
+        "AWS::SSM::Parameter", {"Properties": {"Name": CLUSTER_ATTRIBUTES_PARAMETER}}
+    ).values()
+    values = attributes["Properties"]["Value"]["Fn::Join"][1]
+    # Fn::Join folds the AZ names into one string
+    assert len(values) == len(CLUSTER_ATTRIBUTE_FIELDS) + 2 * azs + 1
+    # The AZs the VPC was built in, not the first N of the region
+    assert values[-1] == ",".join(STUB_AZS[:azs])
+
+
+@pytest.mark.parametrize("azs", [2, 3, 6])
+def test_peering_routes_per_az(config, env, azs):
+    config["eks"]["vpc"]["max_azs"] = azs
+    template = td_template(config, env)
+
+    template.resource_count_is("AWS::EC2::VPCPeeringConnection", 1)
+    # Every cluster route table to Vantage, Vantage's 3 back to the cluster
+    template.resource_count_is("AWS::EC2::Route", azs + 3)
+    routes = template.find_resources(
+        "AWS::EC2::Route",
+        {"Properties": {"RouteTableId": {"Fn::Select": assertions.Match.any_value()}}},
+    )
+    fields = len(CLUSTER_ATTRIBUTE_FIELDS)
+    assert sorted(
+        attribute_index(route["Properties"]["RouteTableId"])
+        for route in routes.values()
+    ) == list(range(fields, fields + azs))
+
+
+def test_peering_keeps_construct_ids(config, env):
+    template = td_template(config, env)
+
+    (peering,) = logical_ids(template, "AWS::EC2::VPCPeeringConnection")
+    assert peering.startswith("Z2jhTDVPCPeeringConnection")
+    routes = logical_ids(template, "AWS::EC2::Route")
+    assert [route[:8] for route in routes] == ["EksToTd1", "EksToTd2", "EksToTd3"] + [
+        "TdToEks1",
+        "TdToEks2",
+        "TdToEks3",
+    ]
+
+
+@pytest.mark.parametrize("azs", [2, 3, 6])
+def test_privatelink_endpoint_per_az(config, env, azs):
+    config["eks"]["vpc"]["max_azs"] = azs
+    config["teradata"]["databases"] = [ANALYTICS]
+    template = td_template(config, env)
+
+    template.resource_count_is("AWS::EC2::Route", 0)
+    (endpoint,) = template.find_resources("AWS::EC2::VPCEndpoint").values()
+    assert endpoint["Properties"]["VpcEndpointType"] == "Interface"
+    assert endpoint["Properties"]["ServiceName"] == ANALYTICS["service_name"]
+    # The cluster's private subnets, in the AZs the parameter names
+    fields = len(CLUSTER_ATTRIBUTE_FIELDS)
+    assert [
+        attribute_index(subnet) for subnet in endpoint["Properties"]["SubnetIds"]
+    ] == list(range(fields + azs, fields + 2 * azs))
+    assert "Fn::GetAZs" not in json.dumps(template.to_json())
+    template.has_resource_properties(
+        "AWS::EC2::SecurityGroup",
+        {
+            "SecurityGroupIngress": [
+                assertions.Match.object_like({"FromPort": 1025, "ToPort": 1025})
+            ]
+        },
+    )
+    template.has_resource_properties(
+        "AWS::SSM::Parameter", {"Name": "/omnispin/teradata/Analytics/endpoint"}
+    )
+
+
+def test_several_databases(config, env):
+    second = {
+        "name": "Staging",
+        "mode": "peering",
+        "ssm_prefix": "/spt/staging",
+        "private_route_tables": 2,
+    }
+    config["teradata"]["databases"] = config["teradata"]["databases"] + [
+        second,
+        ANALYTICS,
+    ]
+    template = td_template(config, env)
+
+    template.resource_count_is("AWS::EC2::VPCPeeringConnection", 2)
+    template.resource_count_is("AWS::EC2::Route", (3 + 3) + (3 + 2))
+    template.resource_count_is("AWS::EC2::VPCEndpoint", 1)
+
+
+@pytest.mark.parametrize("name", ["Analytics", "ANALYTICS"])
+def test_database_names_are_unique(config, env, name):
+    config["teradata"]["databases"] = [ANALYTICS, {**ANALYTICS, "name": name}]
+
+    with pytest.raises(ValueError, match="unique"):
+        td_template(config, env)
+
+
+def test_unknown_mode(config, env):
+    config["teradata"]["databases"] = [{"name": "TD", "mode": "transit"}]
+
+    with pytest.raises(ValueError):
+        td_template(config, env)
+
+
+def test_stage_consumes_peered_database_parameters(config):
+    config["teradata"]["databases"] += [
+        {"name": "Staging", "mode": "peering", "ssm_prefix": "/spt/staging"},
+        ANALYTICS,
+    ]
+
+    assert TDPConStage.config_consumes(config) == (
+        "ssm:/omnispin/eks",
+        "ssm:/spt/core",
+        "ssm:/spt/staging",
+    )
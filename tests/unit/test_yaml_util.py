@@ -0,0 +1,74 @@
+import os
+
+import pytest
+import yaml
+
+from utils import yaml_util
+
+MANIFESTS = """# ---
+# kind: Commented
+---
+kind: ConfigMap
+data:
+  banner: |
+    ---
+    not a document separator
+---
+kind: Secret
+"""
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(yaml_util, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(yaml_util, "_documents", {})
+    return tmp_path / "cache"
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    path = tmp_path / "etc" / "manifest.yaml"
+    path.parent.mkdir()
+    path.write_text(MANIFESTS)
+    return path
+
+
+def test_separator_inside_a_value(cache_dir, manifest):
+    documents = yaml_util.load_documents(str(manifest))
+
+    assert [document["kind"] for document in documents] == ["ConfigMap", "Secret"]
+    assert documents[0]["data"]["banner"] == "---\nnot a document separator\n"
+
+
+def test_unchanged_file_is_not_parsed_again(cache_dir, manifest, monkeypatch):
+    yaml_util.load_documents(str(manifest))
+
+    # A new synth process starts with an empty in-memory cache
+    monkeypatch.setattr(yaml_util, "_documents", {})
+    monkeypatch.setattr(yaml, "load_all", pytest.fail)
+    assert len(yaml_util.load_documents(str(manifest))) == 2
+
+
+def test_changed_file_is_parsed_again(cache_dir, manifest):
+    yaml_util.load_documents(str(manifest))
+    manifest.write_text("kind: Namespace\n")
+
+    assert yaml_util.load_documents(str(manifest)) == [{"kind": "Namespace"}]
+
+
+def test_never_writes_into_the_source_tree(cache_dir, manifest):
+    yaml_util.load_documents(str(manifest))
+
+    assert os.listdir(manifest.parent) == ["manifest.yaml"]
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_callers_get_their_own_copy(cache_dir, manifest):
+    yaml_util.load_documents(str(manifest))[1]["kind"] = "Changed"
+
+    assert yaml_util.load_documents(str(manifest))[1]["kind"] == "Secret"
+
+
+def test_load_document_requires_a_single_document(cache_dir, manifest):
+    with pytest.raises(ValueError):
+        yaml_util.load_document(str(manifest))
@@ -0,0 +1,200 @@
+import io
+import json
+import os
+import tarfile
+
+import aws_cdk as cdk
+import aws_cdk.assertions as assertions
+
+from cdk_pipeline.z2jh_deploy import Z2jhDeployStack, chart_directory
+from tests.unit.conftest import nested_template, new_app, stub_config
+
+
+def z2jh_template(config, env):
+    app = new_app(config)
+    stage = cdk.Stage(app, "Z2jhDeployStage", env=env)
+    stack = Z2jhDeployStack(stage, "Z2jhDeployStack", config)
+    return stack, assertions.Template.from_stack(stack)
+
+
+def helm_chart(config, env):
+    _, template = z2jh_template(config, env)
+    (chart,) = template.find_resources("Custom::AWSCDK-EKS-HelmChart").values()
+    return chart["Properties"]
+
+
+def helm_values(config, env):
+    values = helm_chart(config, env)["Values"]
+    if "Fn::Join" in values:
+        # Values with deploy-time tokens, stand in a placeholder for each token
+        delimiter, parts = values["Fn::Join"]
+        values = delimiter.join(
+            part if isinstance(part, str) else "TOKEN" for part in parts
+        )
+    return json.loads(values)
+
+
+def test_dev_keeps_chart_scheduling_defaults(env):
+    values = helm_values(stub_config("dev"), env)
+
+    assert "scheduling" not in values
+
+
+def test_prod_scheduling(env):
+    values = helm_values(stub_config("prod"), env)
+
+    assert values["scheduling"] == {
+        "userPlaceholder": {"enabled": True, "replicas": 4},
+        "userScheduler": {"enabled": True},
+        "podPriority": {"enabled": True},
+        "corePods": {"nodeAffinity": {"matchNodePurpose": "require"}},
+        "userPods": {"nodeAffinity": {"matchNodePurpose": "require"}},
+    }
+
+
+def test_dev_has_no_profiles(env):
+    values = helm_values(stub_config("dev"), env)
+
+    assert values["singleuser"]["profileList"] == []
+    assert values["singleuser"]["memory"]["guarantee"] == "1G"
+
+
+def test_prod_profiles(env):
+    values = helm_values(stub_config("prod"), env)
+
+    profiles = values["singleuser"]["profileList"]
+    assert [profile["slug"] for profile in profiles] == ["small", "medium", "large"]
+    assert profiles[0]["default"] is True
+    assert profiles[2]["kubespawner_override"] == {
+        "cpu_guarantee": 3,
+        "cpu_limit": 4,
+        "mem_guarantee": "12G",
+        "mem_limit": "14G",
+    }
+
+
+def test_prod_culls_idle_kernels(env):
+    values = helm_values(stub_config("prod"), env)
+
+    assert values["cull"] == {
+        "enabled": True,
+        "timeout": 3600,
+        "every": 600,
+        "concurrency": 10,
+        "maxAge": 86400,
+    }
+    culling = values["singleuser"]["extraFiles"]["kernel-culling"]["data"]
+    assert culling["MappingKernelManager"]["cull_connected"] is True
+    # Merged over the chart values, not replacing them
+    assert values["singleuser"]["extraEnv"] == {"accept_license": "Y"}
+
+
+def test_hub_db_defaults_to_sqlite_on_efs(env):
+    values = helm_values(stub_config("dev"), env)
+
+    assert values["hub"]["db"]["type"] == "sqlite-pvc"
+    assert values["hub"]["db"]["pvc"]["storageClassName"] == "efs-sc"
+
+
+def test_hub_db_sqlite_on_ebs(env):
+    config = stub_config("dev")
+    config["z2jh"]["hub_db"]["type"] = "sqlite-ebs"
+    values = helm_values(config, env)
+
+    # A claim of its own, hub-db-dir's StorageClass can't change
+    assert values["hub"]["db"]["type"] == "other"
+    assert (
+        values["hub"]["db"]["url"] == "sqlite:////srv/jupyterhub/ebs/jupyterhub.sqlite"
+    )
+    assert values["hub"]["extraVolumes"] == [
+        {"name": "hub-db-ebs", "persistentVolumeClaim": {"claimName": "hub-db-ebs"}}
+    ]
+    assert values["hub"]["extraVolumeMounts"] == [
+        {"name": "hub-db-ebs", "mountPath": "/srv/jupyterhub/ebs"}
+    ]
+
+
+def test_hub_db_postgres(env):
+    config = stub_config("dev")
+    config["z2jh"]["hub_db"]["type"] = "postgres"
+    values = helm_values(config, env)
+
+    assert values["hub"]["db"]["type"] == "postgres"
+    url = values["hub"]["db"]["url"]
+    assert url == "postgresql+psycopg2://jupyterhub@TOKEN/jupyterhub"
+    assert values["hub"]["serviceAccount"]["annotations"] == {
+        "eks.amazonaws.com/role-arn": "TOKEN"
+    }
+    assert values["hub"]["extraEnv"]["PGPASSFILE"] == "/pgpass/pgpass"
+
+
+def test_chart_from_repository(env):
+    chart = helm_chart(stub_config("dev"), env)
+
+    assert chart["Chart"] == "jupyterhub"
+    assert chart["Repository"] == "https://jupyterhub.github.io/helm-chart/"
+    assert chart["Version"] == "2.0.0"
+    assert chart["Wait"] is True
+    assert "Timeout" not in chart
+    assert "ChartAssetURL" not in chart
+
+
+def test_vendored_chart_directory(env, tmp_path):
+    (tmp_path / "Chart.yaml").write_text("name: jupyterhub\nversion: 2.0.0\n")
+    config = stub_config("dev")
+    config["z2jh"]["chart"]["path"] = str(tmp_path)
+    chart = helm_chart(config, env)
+
+    assert "ChartAssetURL" in chart
+    assert not {"Chart", "Repository", "Version"} & set(chart)
+
+
+def test_vendored_chart_tarball(env, tmp_path):
+    tarball = tmp_path / "jupyterhub-2.0.0.tgz"
+    with tarfile.open(tarball, "w:gz") as tar:
+        content = b"name: jupyterhub\nversion: 2.0.0\n"
+        info = tarfile.TarInfo("jupyterhub/Chart.yaml")
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+
+    directory = chart_directory(str(tarball))
+
+    assert os.path.basename(directory) == "jupyterhub"
+    assert os.listdir(directory) == ["Chart.yaml"]
+    assert chart_directory(str(tarball)) == directory
+
+
+def test_chart_timeout(env):
+    config = stub_config("dev")
+    config["z2jh"]["chart"]["timeout_minutes"] = 10
+    chart = helm_chart(config, env)
+
+    assert chart["Timeout"] == "600s"
+
+
+def test_own_kubectl_handler(env):
+    config = stub_config("dev")
+    config["eks"]["kubectl"]["memory_mib"] = 2048
+    config["eks"]["kubectl"]["private_subnets"] = True
+    app = new_app(config)
+    stage = cdk.Stage(app, "Z2jhDeployStage", env=env)
+    stack = Z2jhDeployStack(stage, "Z2jhDeployStack", config)
+
+    (provider,) = [
+        child for child in stack.node.children if child.node.id.endswith("Provider")
+    ]
+    nested_template(provider).has_resource_properties(
+        "AWS::Lambda::Function",
+        {"MemorySize": 2048, "VpcConfig": assertions.Match.any_value()},
+    )
+
+
+def test_shared_kubectl_handler(env):
+    config = stub_config("dev")
+    config["eks"]["kubectl"]["shared_provider"] = True
+    _, template = z2jh_template(config, env)
+
+    # No kubectl handler of its own, the chart invokes EksStack's
+    template.resource_count_is("AWS::CloudFormation::Stack", 0)
+    (chart,) = template.find_resources("Custom::AWSCDK-EKS-HelmChart").values()
+    assert "Fn::Select" in chart["Properties"]["ServiceToken"]
@@ -0,0 +1,459 @@
+import pytest
+
+from cdk_pipeline.z2jh_values import (
+    cull_values,
+    home_values,
+    hub_db_values,
+    load_balancer_values,
+    merge_values,
+    monitoring_values,
+    notebook_images,
+    pre_puller_values,
+    profile_values,
+    scheduling_values,
+    uses_ebs,
+)
+
+
+def test_merge_values():
+    base = {"hub": {"db": {"type": "sqlite-pvc", "url": None}}, "cull": {"every": 600}}
+    override = {"hub": {"db": {"type": "postgres"}}, "cull": {"every": 300}}
+
+    assert merge_values(base, override) == {
+        "hub": {"db": {"type": "postgres", "url": None}},
+        "cull": {"every": 300},
+    }
+    assert base["hub"]["db"]["type"] == "sqlite-pvc"
+
+
+def test_scheduling_unset_keeps_chart_defaults():
+    assert scheduling_values({}) == {}
+    assert scheduling_values({"scheduling": {}}) == {}
+
+
+def test_placeholders_switch_on_pod_priority():
+    values = scheduling_values({"scheduling": {"user_placeholder": {"replicas": 4}}})
+
+    assert values == {
+        "scheduling": {
+            "userPlaceholder": {"enabled": True, "replicas": 4},
+            "podPriority": {"enabled": True},
+        }
+    }
+
+
+def test_scheduling_values():
+    values = scheduling_values(
+        {
+            "scheduling": {
+                "user_placeholder": {
+                    "replicas": 2,
+                    "resources": {"requests": {"cpu": 1}},
+                },
+                "user_scheduler": {"enabled": False},
+                "pod_priority": {"enabled": False},
+                "match_node_purpose": {"core": "require"},
+            }
+        }
+    )
+
+    assert values == {
+        "scheduling": {
+            "userPlaceholder": {
+                "enabled": True,
+                "replicas": 2,
+                "resources": {"requests": {"cpu": 1}},
+            },
+            "userScheduler": {"enabled": False},
+            "podPriority": {"enabled": False},
+            "corePods": {"nodeAffinity": {"matchNodePurpose": "require"}},
+        }
+    }
+
+
+def test_pre_puller_values():
+    assert pre_puller_values({}) == {}
+
+    values = pre_puller_values(
+        {
+            "pre_puller": {
+                "hook": True,
+                "continuous": False,
+                "pull_profile_list_images": True,
+                "extra_images": {"spark": "apache/spark-py:v3.3.1"},
+            }
+        }
+    )
+
+    assert values == {
+        "prePuller": {
+            "hook": {"enabled": True},
+            "continuous": {"enabled": False},
+            "pullProfileListImages": True,
+            "extraImages": {"spark": {"name": "apache/spark-py", "tag": "v3.3.1"}},
+        }
+    }
+
+
+def test_pre_puller_extra_images_without_tag_or_with_registry_port():
+    values = pre_puller_values(
+        {
+            "pre_puller": {
+                "extra_images": {
+                    "base": "jupyter/base-notebook",
+                    "lab": "registry:5000/team/lab",
+                    "tagged": "registry:5000/team/lab:1.2",
+                }
+            }
+        }
+    )
+
+    assert values["prePuller"]["extraImages"] == {
+        "base": {"name": "jupyter/base-notebook", "tag": "latest"},
+        "lab": {"name": "registry:5000/team/lab", "tag": "latest"},
+        "tagged": {"name": "registry:5000/team/lab", "tag": "1.2"},
+    }
+
+
+def test_profile_values():
+    assert profile_values({}) == {}
+
+    profiles = profile_values(
+        {
+            "profiles": [
+                {
+                    "name": "small",
+                    "cpu": {"guarantee": 0.5, "limit": 1},
+                    "memory": {"guarantee": "2G", "limit": "4G"},
+                },
+                {
+                    "name": "large",
+                    "display_name": "Large",
+                    "description": "Exports",
+                    "default": True,
+                    "cpu": {"limit": 4},
+                    "image": "teradata/jupyterlab-extensions:latest",
+                    "node_selector": {"node.kubernetes.io/instance-type": "m5.2xlarge"},
+                    "tolerations": [{"key": "tier", "value": "large"}],
+                },
+            ]
+        }
+    )["singleuser"]["profileList"]
+
+    assert profiles[0] == {
+        "display_name": "small",
+        "slug": "small",
+        "kubespawner_override": {
+            "cpu_guarantee": 0.5,
+            "cpu_limit": 1,
+            "mem_guarantee": "2G",
+            "mem_limit": "4G",
+        },
+    }
+    large = profiles[1]
+    assert large["default"] is True
+    assert large["description"] == "Exports"
+    override = large["kubespawner_override"]
+    assert override["cpu_limit"] == 4
+    assert "mem_limit" not in override
+    assert override["image"] == "teradata/jupyterlab-extensions:latest"
+    assert override["node_selector"] == {
+        "node.kubernetes.io/instance-type": "m5.2xlarge"
+    }
+    # The user pool taint stays tolerated
+    assert [toleration["key"] for toleration in override["tolerations"]] == [
+        "hub.jupyter.org/dedicated",
+        "hub.jupyter.org_dedicated",
+        "tier",
+    ]
+    assert override["tolerations"][-1]["effect"] == "NoSchedule"
+
+
+def test_profile_values_single_default():
+    with pytest.raises(ValueError):
+        profile_values(
+            {
+                "profiles": [
+                    {"name": "a", "default": True},
+                    {"name": "b", "default": True},
+                ]
+            }
+        )
+
+
+def test_cull_values():
+    assert cull_values({}) == {}
+    assert cull_values({"cull": {"kernels": {"enabled": False}}}) == {}
+
+    values = cull_values(
+        {
+            "cull": {
+                "timeout": 7200,
+                "max_age": 86400,
+                "kernels": {"enabled": True, "idle_timeout": 1800, "interval": 300},
+                "user_timeouts": {"demo": 900},
+            }
+        }
+    )
+
+    assert values["cull"] == {"timeout": 7200, "maxAge": 86400}
+    kernel_culling = values["singleuser"]["extraFiles"]["kernel-culling"]
+    assert kernel_culling["mountPath"].startswith(
+        "/etc/jupyter/jupyter_server_config.d/"
+    )
+    assert kernel_culling["data"] == {
+        "MappingKernelManager": {
+            "cull_idle_timeout": 1800,
+            "cull_interval": 300,
+            "cull_connected": False,
+            "cull_busy": False,
+        }
+    }
+    assert (
+        '{"demo": 900}' in values["hub"]["extraConfig"]["omnispin-cull-user-timeouts"]
+    )
+
+
+class FakeSpawner:
+    def __init__(self, name):
+        self.user = type("User", (), {"name": name})
+        self.args = ["--debug"]
+
+
+def test_cull_user_timeouts_hook():
+    config = cull_values({"cull": {"user_timeouts": {"demo": 900}}})["hub"][
+        "extraConfig"
+    ]["omnispin-cull-user-timeouts"]
+    c = type("Config", (), {"KubeSpawner": type("KubeSpawner", (), {})})
+    exec(config, {"c": c})
+
+    demo, other = FakeSpawner("demo"), FakeSpawner("other")
+    for _ in range(2):
+        c.KubeSpawner.pre_spawn_hook(demo)
+    c.KubeSpawner.pre_spawn_hook(other)
+
+    assert demo.args == [
+        "--debug",
+        "--ServerApp.shutdown_no_activity_timeout=900",
+        "--MappingKernelManager.cull_idle_timeout=900",
+    ]
+    assert other.args == ["--debug"]
+
+
+def test_notebook_images():
+    values = {
+        "singleuser": {
+            "image": {"name": "teradata/jupyterlab-extensions", "tag": "3.4.0"},
+            "profileList": [
+                {"display_name": "default"},
+                {"kubespawner_override": {"image": "python"}},
+                {"kubespawner_override": {"image": "quay.io/jupyter/base:2023"}},
+                {"kubespawner_override": {"image": "registry:5000/team/lab"}},
+            ],
+        }
+    }
+
+    assert notebook_images(values) == [
+        "docker.io/teradata/jupyterlab-extensions:3.4.0",
+        "docker.io/library/python:latest",
+        "quay.io/jupyter/base:2023",
+        "registry:5000/team/lab:latest",
+    ]
+
+
+DATABASE = {
+    "endpoint": "hub.abc.us-west-2.rds.amazonaws.com:5432",
+    "role_arn": "arn:aws:iam::123456789012:role/hub",
+    "secret_name": "omnispin/hub/db/password",
+    "region": "us-west-2",
+}
+
+
+def test_hub_db_sqlite_modes():
+    assert hub_db_values({}) == {}
+    assert hub_db_values({"hub_db": {"type": "sqlite-efs"}}) == {}
+    ebs = hub_db_values({"hub_db": {"type": "sqlite-ebs"}})["hub"]
+    assert ebs["db"] == {
+        "type": "other",
+        "url": "sqlite:////srv/jupyterhub/ebs/jupyterhub.sqlite",
+    }
+    assert "pvc" not in ebs["db"]
+    with pytest.raises(ValueError):
+        hub_db_values({"hub_db": {"type": "mysql"}})
+
+
+def test_hub_db_postgres():
+    hub = hub_db_values({"hub_db": {"type": "postgres"}}, DATABASE)["hub"]
+
+    assert hub["db"] == {
+        "type": "postgres",
+        "url": "postgresql+psycopg2://jupyterhub@hub.abc.us-west-2.rds.amazonaws.com:5432/jupyterhub",
+    }
+    assert hub["serviceAccount"]["annotations"] == {
+        "eks.amazonaws.com/role-arn": DATABASE["role_arn"]
+    }
+    (init,) = hub["initContainers"]
+    assert DATABASE["secret_name"] in init["command"][-1]
+    assert hub["extraEnv"] == {"PGPASSFILE": "/pgpass/pgpass"}
+    # The password itself is never part of the values
+    assert "password" not in hub["db"]
+
+
+def test_monitoring_opens_hub_metrics():
+    assert monitoring_values({}) == {}
+    assert monitoring_values({"enabled": False}) == {}
+
+    hub = monitoring_values({"enabled": True})["hub"]
+    assert "authenticatePrometheus" not in hub
+    assert hub["services"] == {"cloudwatch-agent": {}}
+    assert hub["loadRoles"]["cloudwatch-metrics"] == {
+        "description": "Read the hub's Prometheus metrics",
+        "scopes": ["read:metrics"],
+        "services": ["cloudwatch-agent"],
+    }
+    (rule,) = hub["networkPolicy"]["ingress"]
+    assert rule["from"] == [
+        {
+            "namespaceSelector": {
+                "matchLabels": {"kubernetes.io/metadata.name": "amazon-cloudwatch"}
+            }
+        }
+    ]
+    assert rule["ports"] == [{"port": 8081}]
+
+
+def test_monitoring_keeps_hub_ingress_rules():
+    existing = {"from": [{"podSelector": {"matchLabels": {"app": "grafana"}}}]}
+    values = {"hub": {"networkPolicy": {"ingress": [existing]}}}
+
+    hub = monitoring_values({"enabled": True}, values)["hub"]
+    ingress = hub["networkPolicy"]["ingress"]
+    assert ingress[0] == existing
+    assert ingress[1]["ports"] == [{"port": 8081}]
+
+
+def load_balancer_config(**load_balancer):
+    return {
+        "stage": "dev",
+        "eks": {
+            "load_balancer": {
+                "type": "nlb",
+                "scheme": "internet-facing",
+                "cross_zone": True,
+                "deregistration_delay": 30,
+                "proxy_protocol": False,
+                **load_balancer,
+            }
+        },
+    }
+
+
+def test_classic_load_balancer_keeps_chart_service():
+    assert load_balancer_values({}) == {}
+    assert load_balancer_values(load_balancer_config(type="classic")) == {}
+
+
+def test_nlb_annotations():
+    prefix = "service.beta.kubernetes.io/aws-load-balancer"
+    annotations = load_balancer_values(load_balancer_config())["proxy"]["service"][
+        "annotations"
+    ]
+
+    assert annotations == {
+        f"{prefix}-type": "external",
+        f"{prefix}-nlb-target-type": "ip",
+        f"{prefix}-name": "dev-z2jh-proxy",
+        f"{prefix}-scheme": "internet-facing",
+        f"{prefix}-attributes": "load_balancing.cross_zone.enabled=true",
+        f"{prefix}-target-group-attributes": "deregistration_delay.timeout_seconds=30",
+    }
+
+
+def test_nlb_proxy_protocol():
+    values = load_balancer_values(
+        load_balancer_config(proxy_protocol=True, cross_zone=False, name="hub")
+    )
+    annotations = values["proxy"]["service"]["annotations"]
+
+    prefix = "service.beta.kubernetes.io/aws-load-balancer"
+    assert annotations[f"{prefix}-proxy-protocol"] == "*"
+    assert annotations[f"{prefix}-name"] == "hub"
+    assert annotations[f"{prefix}-attributes"].endswith("=false")
+
+
+HOME = {"storage": "efs", "ebs_capacity": "20Gi"}
+
+
+def test_efs_homes_keep_chart_storage():
+    assert home_values({}) == {}
+    assert home_values({"home": HOME, "datasets": {"enabled": False}}) == {}
+
+
+def test_ebs_homes():
+    storage = home_values({"home": {**HOME, "storage": "ebs"}})["singleuser"]["storage"]
+
+    assert storage == {
+        "dynamic": {
+            "storageClass": "ebs-gp3",
+            "pvcNameTemplate": "claim-ebs-{username}{servername}",
+        },
+        "capacity": "20Gi",
+    }
+
+
+def test_unknown_home_storage():
+    with pytest.raises(ValueError):
+        home_values({"home": {**HOME, "storage": "fsx"}})
+
+
+def test_datasets_mount():
+    storage = home_values(
+        {"home": HOME, "datasets": {"enabled": True, "mount_path": "/data"}}
+    )["singleuser"]["storage"]
+
+    assert storage == {
+        "extraVolumes": [
+            {
+                "name": "datasets",
+                "persistentVolumeClaim": {"claimName": "datasets", "readOnly": True},
+            }
+        ],
+        "extraVolumeMounts": [
+            {"name": "datasets", "mountPath": "/data", "readOnly": True}
+        ],
+    }
+
+
+def test_profile_home_storage():
+    profiles = profile_values(
+        {
+            "home": HOME,
+            "profiles": [
+                {"name": "default", "home": "efs"},
+                {"name": "fast", "home": "ebs"},
+            ],
+        }
+    )["singleuser"]["profileList"]
+
+    assert "kubespawner_override" not in profiles[0]
+    assert profiles[1]["kubespawner_override"] == {
+        "storage_class": "ebs-gp3",
+        "pvc_name_template": "claim-ebs-{username}{servername}",
+        "storage_capacity": "20Gi",
+    }
+
+    # Back to EFS from EBS homes
+    (profile,) = profile_values(
+        {"home": {**HOME, "storage": "ebs"}, "profiles": [{"name": "a", "home": "efs"}]}
+    )["singleuser"]["profileList"]
+    assert profile["kubespawner_override"] == {
+        "storage_class": "efs-sc",
+        "pvc_name_template": "claim-{username}{servername}",
+    }
+
+
+def test_uses_ebs():
+    assert not uses_ebs({"home": HOME, "hub_db": {"type": "sqlite-efs"}})
+    assert uses_ebs({"hub_db": {"type": "sqlite-ebs"}})
+    assert uses_ebs({"home": {**HOME, "storage": "ebs"}})
+    assert uses_ebs({"home": HOME, "profiles": [{"name": "a", "home": "ebs"}]})
@@ -0,0 +1,215 @@
+from typing import Any, Dict, List, Optional
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Synth benchmark: synthesizes the pipeline stack and each deploy stage offline
+# with stub account/region, one fresh process per target so timings and peak
+# memory include the jsii/node start-up every real synth pays.
+#
+#   python -m utils.benchmark_util                    compare with the baseline
+#   python -m utils.benchmark_util --update-baseline  store a new baseline
+
+BASELINE = "tests/benchmark_baseline.json"
+
+STUB_ACCOUNT = "123456789012"
+STUB_REGION = "us-west-2"
+
+TARGETS = (
+    "CdkZ2jhPipelineStack",
+    "ClusterDeployStage",
+    "Z2jhDeployStage",
+    "R53EntryStage",
+    "TDPConStage",
+    "MonitoringStage",
+)
+
+# Allowed growth over the baseline before a metric counts as a regression
+THRESHOLDS = {
+    "wall_seconds": 1.5,
+    "process_seconds": 1.5,
+    "peak_rss_mb": 1.25,
+    "template_bytes": 1.1,
+    "resources": 1.0,
+}
+# Timings of the small stages are a fraction of a second, ignore jitter below this
+MIN_SECONDS_DELTA = 0.5
+
+
+def _stub_config(stage: str):
+    from utils import config_util
+
+    config = config_util.load_config(stage)
+    config["aws"]["account"] = STUB_ACCOUNT
+    config["aws"]["region"] = STUB_REGION
+    return config
+
+
+def _stacks(assembly) -> List[Any]:
+    stacks = list(assembly.stacks)
+    for nested in assembly.nested_assemblies:
+        stacks += _stacks(nested.nested_assembly)
+    return stacks
+
+
+# Synthesizes one target in this process, returns wall time and per stack metrics
+def synth_target(target: str, stage: str) -> Dict[str, Any]:
+    import aws_cdk as cdk
+    from cdk_pipeline import pipeline_app_stage
+    from cdk_pipeline.pipeline_stack import CdkZ2jhPipelineStack
+
+    with tempfile.TemporaryDirectory(prefix="omnispin-benchmark-") as outdir:
+        start = time.perf_counter()
+        config = _stub_config(stage)
+        app = cdk.App(outdir=outdir)
+        app.node.set_context("env_config", config)
+        env = cdk.Environment(account=STUB_ACCOUNT, region=STUB_REGION)
+
+        if target == "CdkZ2jhPipelineStack":
+            CdkZ2jhPipelineStack(app, target, stage=stage, env=env)
+            assembly = app.synth()
+        else:
+            stage_class = getattr(pipeline_app_stage, target)
+            assembly = stage_class(app, target, env=env, config=config).synth()
+        wall_seconds = time.perf_counter() - start
+
+        return {
+            "wall_seconds": round(wall_seconds, 2),
+            "stacks": {
+                stack.hierarchical_id: {
+                    "template_bytes": os.path.getsize(stack.template_full_path),
+                    "resources": len(stack.template.get("Resources", {})),
+                }
+                for stack in _stacks(assembly)
+            },
+        }
+
+
+# Runs synth_target in a child process and adds the time the whole process
+# took (imports and jsii start-up included) and the peak RSS of it and of the
+# node process jsii starts, which the child waits for on exit
+def measure_target(target: str, stage: str) -> Dict[str, Any]:
+    with tempfile.NamedTemporaryFile(suffix=".json") as output:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "utils.benchmark_util",
+                "--stage",
+                stage,
+                "--worker",
+                target,
+                "--output",
+                output.name,
+            ],
+            stdout=subprocess.DEVNULL,
+        )
+        _, status, rusage = os.wait4(process.pid, 0)
+        process_seconds = time.perf_counter() - start
+        if os.waitstatus_to_exitcode(status) != 0:
+            raise RuntimeError(f"Synth of {target} failed")
+        result = json.load(output)
+    result["process_seconds"] = round(process_seconds, 2)
+    # ru_maxrss is in KiB on Linux
+    result["peak_rss_mb"] = round(rusage.ru_maxrss / 1024, 1)
+    return result
+
+
+def run(stage: str, targets=TARGETS) -> Dict[str, Any]:
+    return {target: measure_target(target, stage) for target in targets}
+
+
+# Metrics over baseline * threshold, as "<target> <stack> <metric>: <baseline> -> <now>"
+def compare(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    thresholds: Optional[Dict[str, float]] = None,
+) -> List[str]:
+    thresholds = thresholds or THRESHOLDS
+    regressions = []
+
+    def check(label, metric, before, now):
+        if before is None:
+            return
+        if metric.endswith("_seconds") and now - before < MIN_SECONDS_DELTA:
+            return
+        if now > before * thresholds[metric]:
+            regressions.append(f"{label} {metric}: {before} -> {now}")
+
+    for target, result in current.items():
+        base = baseline.get(target)
+        if base is None:
+            continue
+        for metric in ("wall_seconds", "process_seconds", "peak_rss_mb"):
+            check(target, metric, base.get(metric), result[metric])
+        for stack, metrics in result["stacks"].items():
+            base_stack = base["stacks"].get(stack, {})
+            for metric in ("template_bytes", "resources"):
+                check(
+                    f"{target} {stack}", metric, base_stack.get(metric), metrics[metric]
+                )
+    return regressions
+
+
+def format_results(results: Dict[str, Any]) -> str:
+    lines = [
+        f"{'target / stack':<60} {'synth s':>8} {'total s':>8} {'rss MB':>8}"
+        f" {'bytes':>9} {'res':>5}"
+    ]
+    for target, result in results.items():
+        lines.append(
+            f"{target:<60} {result['wall_seconds']:>8} {result['process_seconds']:>8}"
+            f" {result['peak_rss_mb']:>8}"
+        )
+        for stack, metrics in result["stacks"].items():
+            lines.append(
+                f"  {stack:<58} {'':>8} {'':>8} {'':>8}"
+                f" {metrics['template_bytes']:>9} {metrics['resources']:>5}"
+            )
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark offline synth")
+    parser.add_argument("--stage", default="dev")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--target", action="append", choices=TARGETS)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        with open(args.output, "w") as f:
+            json.dump(synth_target(args.worker, args.stage), f)
+        return 0
+
+    results = run(args.stage, args.target or TARGETS)
+    print(format_results(results))
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    if args.update_baseline:
+        baselines[args.stage] = {**baselines.get(args.stage, {}), **results}
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline for {args.stage} written to {args.baseline}")
+        return 0
+
+    regressions = compare(baselines.get(args.stage, {}), results)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
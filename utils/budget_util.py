@@ -0,0 +1,122 @@
+from typing import Any, Dict, List
+import json
+import os
+
+import jsii
+from aws_cdk import (
+    Annotations,
+    Aspects,
+    CfnParameter,
+    CfnResource,
+    IAspect,
+    Stack,
+    Stage,
+)
+from constructs import IConstruct
+
+# Deploy time follows the number of resources, SSM-backed parameters and
+# kubectl/Helm custom resources of a stack, and CloudFormation rejects a
+# template over 500 resources or 200 parameters. ResourceBudget counts them
+# per stack and flags the stacks over the `budgets` section of stage config.
+
+REPORT_FILE = "resource-budget.json"
+
+# Custom resources backed by the cluster's kubectl Lambda
+KUBECTL_RESOURCE_TYPES = (
+    "Custom::AWSCDK-EKS-KubernetesResource",
+    "Custom::AWSCDK-EKS-HelmChart",
+    "Custom::AWSCDK-EKS-KubernetesPatch",
+    "Custom::AWSCDK-EKS-KubernetesObjectValue",
+)
+
+
+# Constructs of this stack's template. Stages (e.g. the pipeline's deploy
+# stages) and nested stacks are counted on their own.
+def _stack_constructs(scope: IConstruct) -> List[IConstruct]:
+    constructs = []
+    for child in scope.node.children:
+        if Stage.is_stage(child) or Stack.is_stack(child):
+            continue
+        constructs.append(child)
+        constructs += _stack_constructs(child)
+    return constructs
+
+
+def count_stack(stack: Stack) -> Dict[str, int]:
+    counts = {
+        "resources": 0,
+        "parameters": 0,
+        "ssm_parameters": 0,
+        "custom_resources": 0,
+        "kubectl_resources": 0,
+    }
+    for construct in _stack_constructs(stack):
+        if isinstance(construct, CfnParameter):
+            counts["parameters"] += 1
+            if str(construct.type).startswith("AWS::SSM::Parameter::Value"):
+                counts["ssm_parameters"] += 1
+        elif isinstance(construct, CfnResource):
+            counts["resources"] += 1
+            resource_type = construct.cfn_resource_type
+            if resource_type.startswith("Custom::") or resource_type == (
+                "AWS::CloudFormation::CustomResource"
+            ):
+                counts["custom_resources"] += 1
+            if resource_type in KUBECTL_RESOURCE_TYPES:
+                counts["kubectl_resources"] += 1
+    return counts
+
+
+@jsii.implements(IAspect)
+class ResourceBudget:
+    def __init__(self, budgets: Dict[str, int]) -> None:
+        self.budgets = budgets
+        self.stacks = {}
+
+    def visit(self, node: IConstruct) -> None:
+        if not Stack.is_stack(node):
+            return
+        counts = count_stack(node)
+        over = [
+            f"{key} {counts[key]} > {budget}"
+            for key, budget in self.budgets.items()
+            if counts.get(key, 0) > budget
+        ]
+        self.stacks[node.node.path] = {"counts": counts, "over_budget": over}
+        if over:
+            Annotations.of(node).add_error(
+                "Resource budget exceeded: " + ", ".join(over)
+            )
+
+    def violations(self) -> List[str]:
+        return [
+            f"{path}: {', '.join(stack['over_budget'])}"
+            for path, stack in self.stacks.items()
+            if stack["over_budget"]
+        ]
+
+    def report(self) -> Dict[str, Any]:
+        return {"budgets": self.budgets, "stacks": self.stacks}
+
+    def write_report(self, outdir: str) -> str:
+        path = os.path.join(outdir, REPORT_FILE)
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+        return path
+
+
+# Add before the stacks are created: the pipeline copies the app's aspects into
+# its deploy stages when it adds them, see add_app_aspects_to_stage.
+def add_resource_budget(app: Stage, budgets: Dict[str, int]) -> ResourceBudget:
+    budget = ResourceBudget(dict(budgets))
+    Aspects.of(app).add(budget)
+    return budget
+
+
+# One budget for several stage configs synthesized together, the lowest limit wins
+def tightest_budgets(configs) -> Dict[str, int]:
+    budgets = {}
+    for config in configs:
+        for key, limit in (config.get("budgets") or {}).items():
+            budgets[key] = min(limit, budgets.get(key, limit))
+    return budgets
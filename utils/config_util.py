@@ -1,18 +1,38 @@
-from typing import Dict
+from typing import Dict, List
 import re
 from benedict import benedict
 import os
 
 # Load configuration and merge common conf and specific stage config.
 
+# config/common.yaml parsed once per process, shared by every stage synthesized in it
+_common_config = None
+
+
+def load_common_config() -> Dict:
+    global _common_config
+    if _common_config is None:
+        try:
+            _common_config = benedict.from_yaml("config/common.yaml")
+        except ValueError:
+            print("No config found in config/common.yaml.")
+            _common_config = benedict([])
+    # Stages merge their config into it, each gets its own copy
+    return _common_config.clone()
+
+
+# Every stage with a config/<stage>.yaml
+def available_stages() -> List[str]:
+    return sorted(
+        os.path.splitext(file_name)[0]
+        for file_name in os.listdir("config")
+        if file_name.endswith(".yaml") and file_name != "common.yaml"
+    )
+
 
 def load_config(stage: str) -> Dict:
     # Load common file
-    try:
-        common_config = benedict.from_yaml("config/common.yaml")
-    except ValueError:
-        print("No config found in config/common.yaml.")
-        common_config = benedict([])
+    common_config = load_common_config()
 
     # Load stage specific file
     try:
@@ -30,6 +50,22 @@ def load_config(stage: str) -> Dict:
     return common_config
 
 
+# Stage config for one of the regions in aws.regions: the stage config with
+# aws.region set and that region's overrides (e.g. r53.record_name) merged in
+def region_config(config: Dict, region: str) -> Dict:
+    regional = benedict(config).clone()
+    regional.merge((config["aws"].get("regions") or {}).get(region) or {})
+    regional["aws"]["region"] = region
+    return regional
+
+
+# Short region name for construct ids, e.g. us-east-1 -> use1. Nested stack names
+# (kubectl provider) repeat the construct path and must stay within 128 characters.
+def region_short_name(region: str) -> str:
+    parts = region.split("-")
+    return parts[0] + "".join(part[0] for part in parts[1:-1]) + parts[-1]
+
+
 def add_commit_info_to_config(config: Dict) -> Dict:
 
     config["tags"]["git:repo"] = re.sub(
@@ -0,0 +1,126 @@
+from typing import Dict, Iterable, List, Sequence, Tuple
+import hashlib
+import json
+import os
+
+from utils.wave_util import stage_producers
+
+# Content fingerprint of a pipeline stage: the config subtrees, etc/ files and
+# source modules the stage declares (see cdk_pipeline/pipeline_app_stage.py)
+# plus the inputs every stage shares, and the fingerprints of the stages it
+# consumes from: a stage reads what they publish, so it deploys again whenever
+# one of them changes. The pipeline stores the fingerprint of
+# each stage after a successful deploy and leaves unchanged stages out of the
+# next run, see synth.skip_unchanged_stages.
+
+FINGERPRINT_PARAMETER_PREFIX = "/omnispin/fingerprint"
+
+# JSON file the synth step writes the stored fingerprints to, as returned by
+# `aws ssm get-parameters-by-path`
+STORED_FINGERPRINTS_ENV = "OMNISPIN_STAGE_FINGERPRINTS"
+
+COMMON_CONFIG_KEYS = ("name", "stage", "tags", "commit_tags")
+COMMON_FILES = (
+    "requirements.txt",
+    "cdk.json",
+    "cdk_pipeline/pipeline_app_stage.py",
+    "cdk_pipeline/cluster_props.py",
+    "utils",
+)
+
+
+def fingerprint_parameter(stage_id: str) -> str:
+    return f"{FINGERPRINT_PARAMETER_PREFIX}/{stage_id}"
+
+
+def _files(paths: Iterable[str]) -> List[str]:
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs[:] = [name for name in dirs if name != "__pycache__"]
+                files.update(
+                    os.path.join(root, name)
+                    for name in names
+                    if not name.endswith(".pyc")
+                )
+        elif os.path.exists(path):
+            # Optional inputs, e.g. charts/, may not exist
+            files.add(path)
+    return sorted(files)
+
+
+# Null config values don't survive the CDK context (app.py passes the config
+# through it), leave them out so both ways of loading agree
+def _without_nulls(value):
+    if isinstance(value, dict):
+        return {
+            key: _without_nulls(item) for key, item in value.items() if item is not None
+        }
+    if isinstance(value, list):
+        return [_without_nulls(item) for item in value]
+    return value
+
+
+def stage_fingerprint(stage_class, config, upstream: Iterable[str] = ()) -> str:
+    subtree = {
+        key: config.get(key)
+        for key in COMMON_CONFIG_KEYS + tuple(stage_class.fingerprint_config)
+    }
+    # Commit tags change on every commit, they alone don't need a deploy
+    subtree["tags"] = {
+        key: value
+        for key, value in (subtree["tags"] or {}).items()
+        if not key.startswith("git:")
+    }
+
+    subtree = _without_nulls(subtree)
+
+    digest = hashlib.sha256(json.dumps(subtree, sort_keys=True, default=str).encode())
+    for path in _files(COMMON_FILES + tuple(stage_class.fingerprint_files)):
+        digest.update(path.encode() + b"\0")
+        with open(path, "rb") as f:
+            digest.update(f.read())
+        digest.update(b"\0")
+    for fingerprint in upstream:
+        digest.update(fingerprint.encode() + b"\0")
+    return digest.hexdigest()
+
+
+# Stage id -> fingerprint for the (stage class, stage id, config) entries of one
+# region, producers before their consumers
+def stage_fingerprints(stages: Sequence[Tuple[type, str, dict]]) -> Dict[str, str]:
+    producers = stage_producers(stages)
+    fingerprints = {}
+    remaining = list(stages)
+    while remaining:
+        ready = [
+            (stage_class, stage_id, config)
+            for stage_class, stage_id, config in remaining
+            if all(producer in fingerprints for producer in producers[stage_id])
+        ]
+        if not ready:
+            cycle = ", ".join(stage_id for _, stage_id, _ in remaining)
+            raise ValueError(f"Circular stage dependency between: {cycle}")
+        for stage_class, stage_id, config in ready:
+            fingerprints[stage_id] = stage_fingerprint(
+                stage_class,
+                config,
+                [fingerprints[producer] for producer in producers[stage_id]],
+            )
+        remaining = [stage for stage in remaining if stage[1] not in fingerprints]
+    return fingerprints
+
+
+# Parameter name -> fingerprint of the last successful deploy. Empty outside the
+# pipeline or when the lookup failed, i.e. every stage deploys.
+def stored_fingerprints() -> Dict[str, str]:
+    path = os.environ.get(STORED_FINGERPRINTS_ENV)
+    if not path:
+        return {}
+    try:
+        with open(path) as f:
+            parameters = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {parameter["Name"]: parameter["Value"] for parameter in parameters or []}
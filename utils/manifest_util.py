@@ -0,0 +1,20 @@
+from typing import Dict
+
+
+# Custom resources (kubectl Lambda calls on deploy) each way of applying the
+# manifest groups creates. `groups` maps a group name to its document count.
+def custom_resource_report(groups: Dict[str, int]) -> Dict[str, int]:
+    return {
+        "documents": sum(groups.values()),
+        "per_document": sum(groups.values()),
+        "bundled": len(groups),
+    }
+
+
+def format_custom_resource_report(stack_name: str, groups: Dict[str, int]) -> str:
+    report = custom_resource_report(groups)
+    return (
+        f"{stack_name}: {report['documents']} manifest documents in {len(groups)} groups"
+        f" -> {report['per_document']} custom resources applied per document,"
+        f" {report['bundled']} bundled"
+    )
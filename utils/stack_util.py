@@ -1,12 +1,42 @@
 from typing import Dict
-from aws_cdk import Tags, Stack
+from aws_cdk import Aspects, Tags, Stack, Stage
+
+# Tags add_commit_info_to_config sets that change on every commit. Tagging every
+# resource with them makes CloudFormation update every resource on every deploy.
+VOLATILE_TAGS = ("git:commitid", "git:commitmessage", "git:authordate")
+COMMIT_METADATA_KEY = "omnispin:commit"
 
 
 # Add tags to each element of the stack.
 def add_tags_to_stack(stack: Stack, config: Dict) -> None:
     # Add common tags
+    commit = {}
     for tag_key in config["tags"]:
+        if tag_key in VOLATILE_TAGS:
+            commit[tag_key] = config["tags"][tag_key]
+            continue
         Tags.of(stack).add(key=tag_key, value=config["tags"][tag_key])
 
+    # Per-commit values go into the template metadata, and onto resources only
+    # of the types commit_tags.resource_types allows
+    if commit:
+        metadata = dict(stack.template_options.metadata or {})
+        metadata[COMMIT_METADATA_KEY] = commit
+        stack.template_options.metadata = metadata
+        resource_types = (config.get("commit_tags") or {}).get("resource_types")
+        if resource_types:
+            for tag_key, value in commit.items():
+                Tags.of(stack).add(
+                    key=tag_key, value=value, include_resource_types=resource_types
+                )
+
     # Add environment in the tags
     Tags.of(stack).add(key="stage", value=config["stage"])
+
+
+# Aspects of the app don't reach into Stages. A stage built inside a stack, like
+# the pipeline's deploy stages, gets them added explicitly. Call before the stage
+# is synthesized, pipelines synthesize a stage as soon as it's added to a wave.
+def add_app_aspects_to_stage(stage: Stage) -> None:
+    for aspect in Aspects.of(stage.node.root).all:
+        Aspects.of(stage).add(aspect)
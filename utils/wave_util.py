@@ -0,0 +1,67 @@
+from typing import Dict, List, Sequence, Tuple
+
+from aws_cdk import Stage
+
+
+# Group pipeline stages into waves using the `produces` and `consumes` keys each
+# stage declares (SSM parameters, Kubernetes objects, ...). A stage lands in the
+# first wave after every stage that produces something it consumes. Keys nobody
+# in the pipeline produces (e.g. /spt/core written by Vantage) are external.
+def build_waves(stages: Sequence[Stage]) -> List[List[Stage]]:
+    producers = {}
+    for stage in stages:
+        for key in getattr(stage, "produces", ()):
+            producers.setdefault(key, []).append(stage)
+
+    depends_on = {}
+    for stage in stages:
+        depends_on[stage] = {
+            producer
+            for key in getattr(stage, "consumes", ())
+            for producer in producers.get(key, [])
+            if producer is not stage
+        }
+
+    waves = []
+    placed = set()
+    remaining = list(stages)
+    while remaining:
+        # Keep declaration order inside a wave so the pipeline layout is stable
+        wave = [stage for stage in remaining if depends_on[stage] <= placed]
+        if not wave:
+            cycle = ", ".join(stage.node.id for stage in remaining)
+            raise ValueError(f"Circular stage dependency between: {cycle}")
+        waves.append(wave)
+        placed.update(wave)
+        remaining = [stage for stage in remaining if stage not in placed]
+
+    return waves
+
+
+# What a stage class consumes with the given config, before the stage exists
+def stage_consumes(stage_class, config) -> Sequence[str]:
+    config_consumes = getattr(stage_class, "config_consumes", None)
+    if config_consumes:
+        return config_consumes(config)
+    return getattr(stage_class, "consumes", ())
+
+
+# Stage id -> ids of the stages producing something it consumes, for the
+# (stage class, stage id, config) entries of one region
+def stage_producers(stages: Sequence[Tuple[type, str, dict]]) -> Dict[str, List[str]]:
+    producers = {}
+    for stage_class, stage_id, _ in stages:
+        for key in getattr(stage_class, "produces", ()):
+            producers.setdefault(key, []).append(stage_id)
+
+    return {
+        stage_id: sorted(
+            {
+                producer
+                for key in stage_consumes(stage_class, config)
+                for producer in producers.get(key, [])
+                if producer != stage_id
+            }
+        )
+        for stage_class, stage_id, config in stages
+    }
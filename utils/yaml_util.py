@@ -0,0 +1,88 @@
+from typing import Any, List, Optional
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import yaml
+
+# Manifests and Helm values in etc/ are parsed once per content hash. Parsed
+# documents are kept in memory for the current synth and as JSON in a cache
+# directory outside the source tree for repeat synths.
+
+try:
+    # libyaml C loader, several times faster on the large manifests
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+CACHE_DIR = os.environ.get(
+    "OMNISPIN_YAML_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "omnispin-yaml-cache"),
+)
+
+_documents = {}
+
+
+# Every non-empty YAML document in the file, in order.
+def load_documents(file_location: str) -> List[Any]:
+    with open(file_location, "rb") as f:
+        content = f.read()
+
+    # Loader and PyYAML version are part of the key, they can change the result
+    key = hashlib.sha256(
+        content + f"{SafeLoader.__name__}:{yaml.__version__}".encode()
+    ).hexdigest()
+
+    if key not in _documents:
+        documents = _read_cache(key)
+        if documents is None:
+            documents = [
+                document
+                for document in yaml.load_all(content, Loader=SafeLoader)
+                if document is not None
+            ]
+            _write_cache(key, documents)
+        _documents[key] = documents
+
+    # Callers merge overrides into the result, never hand out the cached objects
+    return copy.deepcopy(_documents[key])
+
+
+# The single YAML document in the file, e.g. Helm values.
+def load_document(file_location: str) -> Any:
+    documents = load_documents(file_location)
+    if len(documents) != 1:
+        raise ValueError(
+            f"Expected one YAML document in {file_location}, found {len(documents)}"
+        )
+    return documents[0]
+
+
+def _read_cache(key: str) -> Optional[List[Any]]:
+    try:
+        with open(os.path.join(CACHE_DIR, key + ".json"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cache(key: str, documents: List[Any]) -> None:
+    try:
+        serialized = json.dumps(documents)
+    except (TypeError, ValueError):
+        return
+    # Skip documents JSON can't round-trip (dates, non-string keys)
+    if json.loads(serialized) != documents:
+        return
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Write then rename so a concurrent synth never reads a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(serialized)
+        os.replace(tmp_path, os.path.join(CACHE_DIR, key + ".json"))
+    except OSError:
+        # The cache is an optimisation only
+        pass